@@ -5,30 +5,36 @@ from FlowAgents.conversation_flow.message_role import MessageRole
 KNOWLEDGE_IMPORTANCE = 999
 
 class Knowledge(ImportanceMessage):
+    __slots__ = ()
+
     def __init__(self, content: str, importance: int = KNOWLEDGE_IMPORTANCE):
         super().__init__(importance, MessageRole.DEVELOPER, content)
 
-    def __str__(self):
-        return self.content
+    def _serialize(self) -> str:
+        return self.message
 
 class AgentsKnowledge:
     def __init__(self, files_folder_path: str = "files"):
         self.files_folder_path = files_folder_path
 
     def _get_files(self, path: str):
-        return os.listdir(path)
+        return [os.path.join(path, file_name) for file_name in os.listdir(path) if os.path.isfile(os.path.join(path, file_name))]
 
-    def _get_file_content(self, file_name: str):
-        with open(os.path.join(self.files_folder_path, file_name), "r") as file:
+    def _get_file_content(self, file_path: str):
+        with open(file_path, "r") as file:
             return file.read()
-        
+
     def get_knowledge(self, path: str) -> list[Knowledge]:
         """
         Get the knowledge from the path
-        @param path: the path to get the knowledge from
+        @param path: the path to get the knowledge from, relative to the files folder
         @return: a list of Knowledge objects
         """
+        path = os.path.join(self.files_folder_path, path)
         if(os.path.isfile(path)):
-            return [Knowledge(self._get_file_content(path))] # if the path is a file, return a list with the file content
-        files = self._get_files(path)
-        return [Knowledge(self._get_file_content(file)) for file in files] # if the path is a folder, return a list with the file contents
\ No newline at end of file
+            knowledge = [Knowledge(self._get_file_content(path))] # if the path is a file, return a list with the file content
+        else:
+            files = self._get_files(path)
+            knowledge = [Knowledge(self._get_file_content(file)) for file in files] # if the path is a folder, return a list with the file contents
+        Knowledge.compute_token_sizes(knowledge) # counts every file in one tokenizer pass
+        return knowledge
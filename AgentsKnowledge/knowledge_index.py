@@ -0,0 +1,261 @@
+from typing import Dict, List, Tuple, Iterable
+from collections import Counter
+from FlowAgents.conversation_flow.utils import Utils
+from .agents_knowledge import Knowledge
+import heapq
+import json
+import math
+import os
+import re
+
+TERM_PATTERN = re.compile(r"\w+")
+
+def _terms(text: str) -> List[str]:
+    return TERM_PATTERN.findall(text.lower())
+
+class KnowledgeIndex:
+    """
+    Persistent inverted index over chunks of the knowledge files. Only files whose mtime or size changed
+    are re-chunked, and chunks are ranked with BM25.
+    """
+
+    K1 = 1.5
+    B = 0.75
+    VERSION = 2
+
+    def __init__(self, files_folder_path: str = "AgentsKnowledge/files", index_path: str | None = None,
+                 chunk_tokens: int = 256):
+        """
+        @param files_folder_path: the folder knowledge names are resolved against
+        @param index_path: where the index is persisted, defaults to .index.json in the folder
+        @param chunk_tokens: max tokens of a chunk, paragraphs are kept whole when they fit
+        """
+        self.files_folder_path = files_folder_path
+        self.index_path = index_path or os.path.join(files_folder_path, ".index.json")
+        self.chunk_tokens = chunk_tokens
+        self.files: Dict[str, Dict] = {} # file path -> {mtime, size, chunks: chunk ids}
+        self.chunks: Dict[str, Dict] = {} # chunk id -> {source, text, tokens, length}
+        self.postings: Dict[str, Dict[str, int]] = {} # term -> chunk id -> term frequency
+        self._total_length = 0
+        self._next_id = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION or data.get("chunk_tokens") != self.chunk_tokens:
+            return # built with other settings, rebuilt from scratch
+        self.files = data["files"]
+        self.chunks = data["chunks"]
+        self.postings = data["postings"]
+        self._next_id = data["next_id"]
+        self._total_length = sum(chunk["length"] for chunk in self.chunks.values())
+
+    def save(self):
+        """
+        Persists the index if it changed, atomically so a crash never leaves a partial index
+        """
+        if not self._dirty:
+            return
+        directory = os.path.dirname(self.index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "version": self.VERSION,
+                "chunk_tokens": self.chunk_tokens,
+                "next_id": self._next_id,
+                "files": self.files,
+                "chunks": self.chunks,
+                "postings": self.postings,
+            }, file)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def resolve(self, name: str) -> List[str]:
+        """
+        @param name: a knowledge file or folder, relative to the files folder, the extension can be omitted
+        @return: the files of the knowledge, empty if it does not exist
+        """
+        path = os.path.join(self.files_folder_path, name)
+        if os.path.isdir(path):
+            return sorted(
+                os.path.join(root, file_name)
+                for root, _, file_names in os.walk(path)
+                for file_name in file_names
+                if not file_name.startswith(".")
+            )
+        if os.path.isfile(path):
+            return [path]
+        folder, prefix = os.path.split(path)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            os.path.join(folder, file_name) for file_name in os.listdir(folder)
+            if os.path.splitext(file_name)[0] == prefix and os.path.isfile(os.path.join(folder, file_name))
+        )
+
+    def update(self, names: Iterable[str]) -> List[str]:
+        """
+        Indexes the files of the knowledge names, re-chunking only the files that changed, then persists the index
+        @param names: knowledge files or folders
+        @return: the files of the knowledge
+        """
+        paths = [path for name in names for path in self.resolve(name)]
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.files.get(path)
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                self._index_file(path, stat)
+        for path in [path for path in self.files if path.startswith(self.files_folder_path) and not os.path.exists(path)]:
+            self._remove_file(path)
+        self.save()
+        return paths
+
+    def _index_file(self, path: str, stat: os.stat_result):
+        self._remove_file(path)
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            content = file.read()
+        chunk_ids = []
+        for text in self._chunk(content):
+            chunk_id = str(self._next_id)
+            self._next_id += 1
+            terms = Counter(_terms(text))
+            length = sum(terms.values())
+            self.chunks[chunk_id] = {"source": path, "text": text, "tokens": Utils.get_tokens_size(text), "length": length}
+            self._total_length += length
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+            chunk_ids.append(chunk_id)
+        self.files[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "chunks": chunk_ids}
+        self._dirty = True
+
+    def _remove_file(self, path: str):
+        entry = self.files.pop(path, None)
+        if entry is None:
+            return
+        for chunk_id in entry["chunks"]:
+            chunk = self.chunks.pop(chunk_id)
+            self._total_length -= chunk["length"]
+            for term in set(_terms(chunk["text"])):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(chunk_id, None)
+                    if not posting:
+                        del self.postings[term]
+        self._dirty = True
+
+    def _chunk(self, content: str) -> List[str]:
+        """
+        Splits on paragraphs, merging consecutive ones up to chunk_tokens and splitting longer ones on lines then words
+        """
+        chunks = []
+        current, current_tokens = [], 0
+        for piece, tokens in self._pieces(content):
+            if current and current_tokens + tokens > self.chunk_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+        if current:
+            chunks.append("\n\n".join(current))
+        return chunks
+
+    def _pieces(self, content: str) -> List[Tuple[str, int]]:
+        pieces = []
+        for paragraph in re.split(r"\n\s*\n", content):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = Utils.get_tokens_size(paragraph)
+            if tokens <= self.chunk_tokens:
+                pieces.append((paragraph, tokens))
+                continue
+            pieces.extend(self._merge(paragraph.split("\n"), "\n"))
+        return pieces
+
+    def _merge(self, parts: List[str], separator: str) -> List[Tuple[str, int]]:
+        """
+        Merges consecutive lines or words up to chunk_tokens, a line longer than that is split on words
+        @param parts: the lines or the words of the text
+        @param separator: what the parts are joined with, a newline for lines and a space for words
+        @return: the pieces and their tokens
+        """
+        pieces = []
+        start = 0
+        while start < len(parts):
+            if separator == "\n" and Utils.get_tokens_size(parts[start]) > self.chunk_tokens:
+                pieces.extend(self._merge(parts[start].split(" "), " "))
+                start += 1
+                continue
+            end = start + 1
+            while end < len(parts) and Utils.get_tokens_size(separator.join(parts[start:end + 1])) <= self.chunk_tokens:
+                end += 1
+            piece = separator.join(parts[start:end])
+            pieces.append((piece, Utils.get_tokens_size(piece)))
+            start = end
+        return pieces
+
+    def search(self, query: str, paths: List[str] | None = None, top_k: int = 5) -> List[Tuple[float, str]]:
+        """
+        @param query: the text the chunks are ranked against
+        @param paths: restricts the search to the chunks of these files, None for every file
+        @param top_k: max chunks returned
+        @return: the (score, chunk id) of the best chunks, best first
+        """
+        if not self.chunks:
+            return []
+        allowed = None if paths is None else set(paths)
+        average_length = self._total_length / len(self.chunks) or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(_terms(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (len(self.chunks) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for chunk_id, frequency in posting.items():
+                chunk = self.chunks[chunk_id]
+                if allowed is not None and chunk["source"] not in allowed:
+                    continue
+                norm = self.K1 * (1 - self.B + self.B * chunk["length"] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        return heapq.nlargest(top_k, ((score, chunk_id) for chunk_id, score in scores.items()))
+
+class KnowledgeRetriever:
+    """
+    The knowledge of one agent: the chunks most relevant to each request, within a token budget
+    """
+
+    def __init__(self, index: KnowledgeIndex, names: List[str], top_k: int = 5, token_budget: int = 2000):
+        """
+        @param index: the shared knowledge index
+        @param names: the knowledge files or folders of the agent
+        @param top_k: max chunks injected per request
+        @param token_budget: max tokens injected per request
+        """
+        self.index = index
+        self.names = names
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.paths = index.update(names)
+
+    def retrieve(self, query: str) -> List[Knowledge]:
+        """
+        @param query: the request
+        @return: the best chunks for the request that fit the token budget, best first
+        """
+        knowledge = []
+        budget = self.token_budget
+        for _, chunk_id in self.index.search(query, self.paths, self.top_k):
+            chunk = self.index.chunks[chunk_id]
+            if chunk["tokens"] > budget:
+                continue # a smaller, less relevant chunk may still fit
+            budget -= chunk["tokens"]
+            source = os.path.relpath(chunk["source"], self.index.files_folder_path)
+            knowledge.append(Knowledge(f"Knowledge from {source}:\n{chunk['text']}"))
+        return knowledge
@@ -1,188 +1,423 @@
 import tkinter as tk
 from tkinter import ttk
+from tkinter import font as tkfont
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+from datetime import datetime
+import queue
 import threading
 
 from FlowAgents.handoff_agent import HandoffAgent
+from FlowAgents.conversation_flow.utils import Utils
+from FlowAgents.conversation_flow.importance_message import WALL_CLOCK_OFFSET_NS
+
+DRAIN_INTERVAL_MS = 50 # how often the Tk thread applies the queued events
+MAX_EVENTS_PER_DRAIN = 5000 # bounds a drain so a burst never freezes the window
+MAX_HANDOFF_ROWS = 200 # finished handoffs kept per agent
+PREVIEW_CHARACTERS = 200
+
+
+class DebugEventFeed:
+    """
+    Agent side of the debugger: observes every chat flow and handoff manager of a tree and queues their changes.
+    Runs on the thread of the agents and never touches Tk.
+    """
+
+    def __init__(self, agent):
+        self.events: queue.SimpleQueue = queue.SimpleQueue()
+        self.agents: Dict[str, Any] = {}
+        self._observers: List[Tuple[Any, Any]] = [] # (observed manager, observer) pairs, to detach them
+        stack = [(agent.name, None, agent)]
+        while stack:
+            path, parent, current = stack.pop()
+            self.agents[path] = current
+            self._attach(path, parent, current)
+            if isinstance(current, HandoffAgent):
+                for subagent in reversed(current.get_subagents()):
+                    stack.append((f"{path}/{subagent.name}", path, subagent))
+
+    def _attach(self, path: str, parent: str | None, agent):
+        flow = agent.chat_flow_manager
+        prefix = flow.prefix.messages if flow.prefix is not None else ()
+        # the prefix is shared with other sessions and never changes, its messages get negative sequence numbers
+        rows = [self._row(index - len(prefix), message) for index, message in enumerate(prefix)]
+        rows.extend(flow.dump_state()["messages"])
+        self.events.put((path, {"op": "agent", "name": agent.name, "parent": parent, "model": agent.model,
+                                "epoch": flow.epoch, "rows": rows}))
+        self._observe(flow, lambda event, path=path: self.events.put((path, event)))
+        handoff_manager = getattr(agent, "handoff_manager", None)
+        if handoff_manager is not None:
+            for task_id, info in handoff_manager.pending_tasks.items():
+                self.events.put((path, {"op": "handoff", "task_id": task_id, "subagent": info["subagent"], "prompt": info["prompt"]}))
+            self._observe(handoff_manager, lambda event, path=path: self.events.put((path, event)))
+
+    def _observe(self, manager, observer):
+        manager.observers.append(observer)
+        self._observers.append((manager, observer))
+
+    @staticmethod
+    def _row(seq: int, message) -> Dict[str, Any]:
+        """
+        @return: the message as the records of the chat flow events, created_at in wall clock nanoseconds
+        """
+        return {"seq": seq, "role": message.messagerole.value, "importance": message.importance,
+                "message": message.message, "created_at": message.created_at_ns + WALL_CLOCK_OFFSET_NS}
+
+    def detach(self):
+        """
+        Stops observing the tree
+        """
+        for manager, observer in self._observers: # list.remove is atomic, the agents may keep emitting meanwhile
+            if observer in manager.observers:
+                manager.observers.remove(observer)
+        self._observers.clear()
+
+
+class AgentView:
+    """
+    What the Tk thread knows of one agent, rebuilt from the queued events only
+    """
+
+    def __init__(self, path: str, name: str, parent: str | None, model: str, epoch: int):
+        self.path = path
+        self.name = name
+        self.parent = parent
+        self.model = model
+        self.epoch = epoch
+        self.rows: Dict[int, List[Any]] = {} # sequence number -> [role, importance, epoch of the importance, message, created_at]
+        self._order: List[int] | None = [] # sequence numbers in chat order, None until rebuilt after a removal
+        self.handoffs: "OrderedDict[str, List[str]]" = OrderedDict() # task id -> [subagent, status, prompt]
+        self.pending = 0
+        self.evicted = 0
+        self.expired = 0
+
+    @property
+    def order(self) -> List[int]:
+        if self._order is None:
+            self._order = sorted(self.rows)
+        return self._order
+
+    def add_row(self, record: Dict[str, Any]):
+        seq = record["seq"]
+        self.rows[seq] = [record["role"], record["importance"], self.epoch, record["message"], record.get("created_at")]
+        if self._order is not None and (not self._order or seq > self._order[-1]):
+            self._order.append(seq)
+        else:
+            self._order = None
+
+    def importance(self, seq: int) -> int:
+        """
+        @return: the effective importance, decayed by the epochs elapsed since it was set like in the chat flow
+        """
+        _, importance, epoch, _, _ = self.rows[seq]
+        return importance if importance == Utils.MAX_IMPORTANCE else importance - (self.epoch - epoch)
+
+    def apply(self, event: Dict[str, Any]) -> bool:
+        """
+        @return: True if the messages changed, False if only the handoffs or the counters did
+        """
+        op = event["op"]
+        if op == "add":
+            self.add_row(event)
+        elif op == "remove":
+            if self.rows.pop(event["seq"], None) is not None:
+                self._order = None
+            if event.get("reason") == "evicted":
+                self.evicted += 1
+            elif event.get("reason") == "expired":
+                self.expired += 1
+        elif op == "epoch":
+            self.epoch = event["epoch"]
+        elif op == "change":
+            row = self.rows.get(event["seq"])
+            if row is not None:
+                row[0], row[3] = event["role"], event["message"]
+        elif op == "importance":
+            row = self.rows.get(event["seq"])
+            if row is not None:
+                row[1], row[2] = event["importance"], self.epoch
+        elif op == "clear":
+            self.rows.clear()
+            self._order = []
+        else:
+            self._apply_handoff(op, event)
+            return False
+        return True
+
+    def _apply_handoff(self, op: str, event: Dict[str, Any]):
+        if op == "handoff":
+            self.handoffs[event["task_id"]] = [event["subagent"], "running", event["prompt"]]
+        elif op == "handoff_done":
+            if event["task_id"] in self.handoffs and self.handoffs[event["task_id"]][1] == "running":
+                self.handoffs[event["task_id"]][1] = "done"
+        elif op == "result":
+            info = event["info"]
+            handoff = self.handoffs.setdefault(event["task_id"], [info["subagent"], "", ""])
+            handoff[1] = info["status"]
+            self.handoffs.move_to_end(event["task_id"])
+        while len(self.handoffs) > MAX_HANDOFF_ROWS:
+            self.handoffs.popitem(last=False)
+        self.pending = sum(1 for handoff in self.handoffs.values() if handoff[1] == "running")
+
+    def preview(self, seq: int) -> str:
+        role, _, _, message, _ = self.rows[seq]
+        importance = self.importance(seq)
+        text = (message or "").replace("\n", " ")[:PREVIEW_CHARACTERS]
+        return f"[{'pinned' if importance == Utils.MAX_IMPORTANCE else importance}] [{role}] {text}"
+
+
+class VirtualMessageList(ttk.Frame):
+    """
+    Shows the messages of one agent with only as many row widgets as fit in the window, scrolling re-labels them
+    """
+
+    def __init__(self, master, on_select):
+        super().__init__(master)
+        self.on_select = on_select
+        self.view: AgentView | None = None
+        self.first = 0
+        self.selected: int | None = None # sequence number of the selected message
+        self.following = True # the last message is visible, new messages scroll the list
+        self.row_height = tkfont.nametofont("TkDefaultFont").metrics("linespace") + 6
+        self.labels: List[ttk.Label] = []
+        self.texts: List[str | None] = [] # what each label shows, to skip the unchanged rows
+        self.body = ttk.Frame(self)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.body.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.body.bind("<Configure>", self._on_resize)
+        self._bind_wheel(self.body)
+
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda _: self.scroll(-1))
+        widget.bind("<Button-5>", lambda _: self.scroll(1))
+
+    def show(self, view: AgentView | None):
+        self.view = view
+        self.selected = None
+        self.first = max(0, len(view.order) - len(self.labels)) if view is not None else 0
+        self.refresh()
+
+    def _on_resize(self, event):
+        wanted = max(1, event.height // self.row_height)
+        while len(self.labels) < wanted: # row widgets are created only when the window grows
+            label = ttk.Label(self.body, anchor="w")
+            label.place(x=0, y=len(self.labels) * self.row_height, relwidth=1.0, height=self.row_height)
+            index = len(self.labels)
+            label.bind("<Button-1>", lambda _, index=index: self._on_click(index))
+            self._bind_wheel(label)
+            self.labels.append(label)
+            self.texts.append(None)
+        while len(self.labels) > wanted:
+            self.labels.pop().destroy()
+            self.texts.pop()
+        self.refresh(follow=self.following)
+
+    def scroll(self, rows: int):
+        self._scroll_to(self.first + rows)
+
+    def _scroll_to(self, first: int):
+        count = len(self.view.order) if self.view is not None else 0
+        self.first = max(0, min(first, count - len(self.labels)))
+        self.refresh()
+
+    def _on_scrollbar(self, action: str, amount: str, unit: str | None = None):
+        count = len(self.view.order) if self.view is not None else 0
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * count))
+        elif action == "scroll":
+            self.scroll(int(amount) * (len(self.labels) if unit == "pages" else 1))
+
+    def _on_click(self, index: int):
+        order = self.view.order if self.view is not None else []
+        if self.first + index < len(order):
+            self.selected = order[self.first + index]
+            self.refresh()
+            self.on_select(self.view, self.selected)
+
+    def refresh(self, follow: bool = False):
+        """
+        Re-labels the visible rows, only the labels whose text changed are touched
+        @param follow: keeps the last message visible, used when the list was scrolled to the bottom
+        """
+        order = self.view.order if self.view is not None else []
+        if follow:
+            self.first = max(0, len(order) - len(self.labels))
+        for index, label in enumerate(self.labels):
+            position = self.first + index
+            seq = order[position] if position < len(order) else None
+            text = self.view.preview(seq) if seq is not None else ""
+            if seq is not None and seq == self.selected:
+                text = "» " + text
+            if self.texts[index] != text:
+                label.configure(text=text)
+                self.texts[index] = text
+        self.following = self.first + len(self.labels) >= len(order)
+        count = max(1, len(order))
+        self.scrollbar.set(self.first / count, min(1.0, (self.first + len(self.labels)) / count))
 
 
 class AgentDebugGUI:
+    """
+    Debugger window of an agent tree. The agents only queue their changes, the Tk thread drains the queue every
+    DRAIN_INTERVAL_MS and updates the rows that changed, so the agent loop never waits on the window.
+    """
+
     def __init__(self, agent):
         self.agent = agent
+        self.feed = DebugEventFeed(agent) # subscribed on the agents thread, before the window exists
+        self.views: Dict[str, AgentView] = {}
         self.root = None
-        self.frame = None
+        self.selected_path: str | None = None
+        self.details = None # created on the first selected message
         self.running = True
-        
-        # Start GUI in a separate thread
+
+        # Start GUI in a separate thread, every Tk call happens on it
         self.thread = threading.Thread(target=self._run_gui)
         self.thread.daemon = True
         self.thread.start()
-    
+
     def _run_gui(self):
         """Run the GUI in a separate thread"""
-        self.root = tk.Tk()
+        try:
+            self.root = tk.Tk()
+        except tk.TclError: # no display, the agents must not keep queueing events nobody drains
+            self.running = False
+            self.feed.detach()
+            return
         self.root.title("Agent Debug GUI")
         self.root.geometry("1200x800")
-        
-        # Create main container that fills window
-        main_container = ttk.Frame(self.root)
-        main_container.pack(fill=tk.BOTH, expand=True)
-        
-        # Create scrollable canvas for content
-        canvas = tk.Canvas(main_container)
-        scrollbar = ttk.Scrollbar(main_container, orient="vertical", command=canvas.yview)
-        
-        # Create the frame that will contain all our content
-        self.frame = ttk.Frame(canvas)
-        
-        # Configure scrolling
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.create_window((0, 0), window=self.frame, anchor="nw")
-        
-        def configure_scroll_region(event):
-            canvas.configure(scrollregion=canvas.bbox("all"))
-        
-        self.frame.bind("<Configure>", configure_scroll_region)
-        
-        # Pack the scrollbar and canvas
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Refresh button at bottom
-        refresh_button = ttk.Button(
-            self.root, text="Refresh", command=self.refresh
-        )
-        refresh_button.pack(side=tk.BOTTOM, pady=10)
-        
-        # Initial refresh
-        self.refresh()
-        
-        # Start GUI main loop
+
+        panes = ttk.PanedWindow(self.root, orient=tk.HORIZONTAL)
+        panes.pack(fill=tk.BOTH, expand=True)
+
+        # agents on the left, with their counters, and the handoffs of the selected agent below them
+        left = ttk.Frame(panes)
+        self.agent_tree = ttk.Treeview(left, columns=("messages", "pending", "evicted", "expired"), selectmode="browse")
+        self.agent_tree.heading("#0", text="Agent")
+        for column in ("messages", "pending", "evicted", "expired"):
+            self.agent_tree.heading(column, text=column.capitalize())
+            self.agent_tree.column(column, width=70, anchor="e", stretch=False)
+        self.agent_tree.pack(fill=tk.BOTH, expand=True)
+        self.agent_tree.bind("<<TreeviewSelect>>", self._on_agent_selected)
+        self.handoff_tree = ttk.Treeview(left, columns=("status", "prompt"), height=8)
+        self.handoff_tree.heading("#0", text="Handoff to")
+        self.handoff_tree.heading("status", text="Status")
+        self.handoff_tree.heading("prompt", text="Prompt")
+        self.handoff_tree.column("status", width=80, stretch=False)
+        self.handoff_tree.pack(fill=tk.BOTH, expand=False, pady=(5, 0))
+        panes.add(left, weight=1)
+
+        # messages of the selected agent, then the details of the selected message
+        self.right = ttk.Frame(panes)
+        self.message_list = VirtualMessageList(self.right, self._on_message_selected)
+        self.message_list.pack(fill=tk.BOTH, expand=True)
+        panes.add(self.right, weight=3)
+
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
+        self.root.after(0, self._drain)
         self.root.mainloop()
-    
+
     def _on_closing(self):
         """Handle GUI window closing"""
         self.running = False
+        self.feed.detach()
         self.root.destroy()
-    
+
     def refresh(self):
-        """Refresh the GUI with current agent state"""
-        if not self.running or not self.frame:
+        """
+        Kept for callers of the previous API, the window follows the agents on its own; safe from any thread
+        """
+        self.feed.events.put((None, {"op": "refresh"}))
+
+    def _drain(self):
+        if not self.running:
             return
-            
-        # Clear the current display
-        for widget in self.frame.winfo_children():
-            widget.destroy()
-        
-        # Draw the agent tree
-        self._draw_agent(self.agent, self.frame)
-    
-    def _draw_agent(self, agent, parent_frame, level=0):
-        """Draw an agent and its conversation in the tree view"""
-        # Agent frame with collapsible content
-        agent_frame = ttk.Frame(parent_frame)
-        agent_frame.pack(fill=tk.X, expand=True, pady=2)
-        
-        # Agent header with toggle button
-        header_frame = ttk.Frame(agent_frame)
-        header_frame.pack(fill=tk.X, expand=True)
-        
-        expanded = tk.BooleanVar(value=True)
-        toggle_btn = ttk.Button(header_frame, text="▼", width=2)
-        toggle_btn.pack(side=tk.LEFT, padx=(level*20, 0))
-        
-        ttk.Label(header_frame, text=agent.name).pack(side=tk.LEFT, padx=5)
-        
-        # Agent content (will be toggled)
-        content_frame = ttk.Frame(agent_frame)
-        content_frame.pack(fill=tk.X, expand=True, padx=10)
-        
-        def toggle_content():
-            if expanded.get():
-                content_frame.pack_forget()
-                toggle_btn.configure(text="►")
-                expanded.set(False)
-            else:
-                content_frame.pack(fill=tk.X, expand=True, padx=10)
-                toggle_btn.configure(text="▼")
-                expanded.set(True)
-        
-        toggle_btn.configure(command=toggle_content)
-        
-        # Conversation section
-        conversation_frame = ttk.LabelFrame(content_frame, text="Conversation")
-        conversation_frame.pack(fill=tk.X, expand=True, pady=5)
-        
-        # Display conversation messages
-        conversation = agent.chat_flow_manager.chat_flow
-        if not conversation:
-            ttk.Label(conversation_frame, text="No conversation yet").pack(padx=10, pady=5)
-        else:
-            for message in conversation:
-                self._draw_message(message, conversation_frame)
-        
-        # If this is a HandoffAgent, show subagents
-        if isinstance(agent, HandoffAgent) and agent.get_subagents():
-            for subagent in agent.get_subagents():
-                self._draw_agent(subagent, content_frame, level + 1)
-    
-    def _draw_message(self, message, parent_frame):
-        """Draw a message with proper expand/collapse functionality"""
-        # Message container
-        msg_container = ttk.Frame(parent_frame)
-        msg_container.pack(fill=tk.X, expand=True, pady=1)
-        
-        # Message header with toggle
-        header = ttk.Frame(msg_container)
-        header.pack(fill=tk.X, expand=True)
-        
-        # Expansion state
-        expanded = tk.BooleanVar(value=False)
-        
-        # Toggle button
-        toggle_btn = ttk.Button(header, text="►", width=2)
-        toggle_btn.pack(side=tk.LEFT, padx=(5, 0))
-        
-        # Message preview label
-        label_text = f"[{message.importance}]. [{message.messagerole.value}]"
-        ttk.Label(header, text=label_text, width=20).pack(side=tk.LEFT, padx=5)
-        
-        # Message content in a text widget that wraps properly
-        content_preview = tk.Text(header, wrap=tk.WORD, height=1, width=80)
-        content_preview.insert("1.0", message.message)
-        content_preview.configure(state="disabled")
-        content_preview.pack(fill=tk.X, expand=True, padx=5)
-        
-        # Details frame (hidden by default)
-        details_frame = ttk.Frame(msg_container)
-        
-        # Content in full
-        content_full = tk.Text(details_frame, wrap=tk.WORD, height=10, width=80)
-        content_full.insert("1.0", message.message)
-        content_full.configure(state="disabled")
-        content_full.pack(fill=tk.X, expand=True, padx=5, pady=5)
-        
-        # Message metadata
-        metadata = ttk.Frame(details_frame)
-        metadata.pack(fill=tk.X, expand=True, pady=5)
-        
-        ttk.Label(metadata, text=f"Token Size: {message.get_token_size()}").pack(side=tk.LEFT, padx=5)
-        
-        created_at = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        ttk.Label(metadata, text=f"Created: {created_at}").pack(side=tk.LEFT, padx=5)
-        
-        # Toggle function that shows/hides details
-        def toggle_details():
-            if expanded.get():
-                details_frame.pack_forget()
-                toggle_btn.configure(text="►")
-                expanded.set(False)
-            else:
-                details_frame.pack(fill=tk.X, expand=True, padx=10, pady=5)
-                toggle_btn.configure(text="▼")
-                expanded.set(True)
-        
-        toggle_btn.configure(command=toggle_details)
+        changed_agents = set()
+        changed_messages = set()
+        for _ in range(MAX_EVENTS_PER_DRAIN):
+            try:
+                path, event = self.feed.events.get_nowait()
+            except queue.Empty:
+                break
+            if event["op"] == "agent":
+                self._add_view(path, event)
+                changed_messages.add(path)
+            elif event["op"] == "refresh":
+                changed_messages.add(self.selected_path)
+            elif path in self.views:
+                if self.views[path].apply(event):
+                    changed_messages.add(path)
+            changed_agents.add(path)
+        for path in changed_agents:
+            if path in self.views:
+                self._update_agent_row(self.views[path])
+        if self.selected_path in changed_agents:
+            self._update_handoffs(self.views[self.selected_path])
+        if self.selected_path in changed_messages:
+            self.message_list.refresh(follow=self.message_list.following)
+        self.root.after(DRAIN_INTERVAL_MS, self._drain)
+
+    def _add_view(self, path: str, event: Dict[str, Any]):
+        view = AgentView(path, event["name"], event["parent"], event["model"], event["epoch"])
+        for row in event["rows"]:
+            view.add_row(row)
+        self.views[path] = view
+        if not self.agent_tree.exists(path):
+            self.agent_tree.insert(event["parent"] or "", "end", iid=path, text=f"{view.name} ({view.model})", open=True)
+        if self.selected_path is None: # the first agent is shown until another one is selected
+            self._select(path)
+            self.agent_tree.selection_set(path)
+
+    def _update_agent_row(self, view: AgentView):
+        values = (len(view.rows), view.pending, view.evicted, view.expired)
+        if tuple(str(value) for value in self.agent_tree.item(view.path, "values")) != tuple(map(str, values)):
+            self.agent_tree.item(view.path, values=values)
+
+    def _update_handoffs(self, view: AgentView):
+        shown = set(self.handoff_tree.get_children())
+        for task_id in shown - set(view.handoffs):
+            self.handoff_tree.delete(task_id)
+        for task_id, (subagent, status, prompt) in view.handoffs.items():
+            values = (status, prompt.replace("\n", " ")[:PREVIEW_CHARACTERS])
+            if task_id not in shown:
+                self.handoff_tree.insert("", "end", iid=task_id, text=subagent, values=values)
+            elif tuple(map(str, self.handoff_tree.item(task_id, "values"))) != values:
+                self.handoff_tree.item(task_id, values=values)
+
+    def _on_agent_selected(self, _event):
+        selection = self.agent_tree.selection()
+        if selection and selection[0] != self.selected_path:
+            self._select(selection[0])
+
+    def _select(self, path: str):
+        self.selected_path = path
+        view = self.views[path]
+        self.handoff_tree.delete(*self.handoff_tree.get_children())
+        self._update_handoffs(view)
+        self.message_list.show(view)
+        if self.details is not None:
+            self.details.pack_forget()
+
+    def _on_message_selected(self, view: AgentView, seq: int):
+        if self.details is None: # one details pane, reused for every message
+            self.details = ttk.LabelFrame(self.right, text="Message")
+            self.details_text = tk.Text(self.details, wrap=tk.WORD, height=12)
+            self.details_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+            self.details_metadata = ttk.Label(self.details)
+            self.details_metadata.pack(fill=tk.X, padx=5, pady=(0, 5))
+        self.details.pack(fill=tk.BOTH, expand=False, pady=(5, 0))
+        role, _, _, message, created_at = view.rows[seq]
+        self.details_text.configure(state="normal")
+        self.details_text.delete("1.0", tk.END)
+        self.details_text.insert("1.0", message or "")
+        self.details_text.configure(state="disabled")
+        created = datetime.fromtimestamp(created_at / 1e9).strftime("%Y-%m-%d %H:%M:%S") if created_at else "-"
+        # counted on demand, only for the message looked at
+        self.details_metadata.configure(
+            text=f"Role: {role}   Importance: {view.importance(seq)}   Token Size: {Utils.get_tokens_size(message)}   Created: {created}"
+        )
 
 
 def create_debug_gui(agent):
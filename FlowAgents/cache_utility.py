@@ -0,0 +1,85 @@
+from typing import Awaitable, Callable, Dict, Any, Tuple
+from collections import OrderedDict
+import asyncio
+import time
+
+class TimedLRU:
+    """
+    In-memory LRU with an optional TTL, the least recently used entries are evicted first
+    """
+
+    def __init__(self, max_entries: int, ttl: float | None = None):
+        """
+        @param max_entries: entries kept
+        @param ttl: seconds an entry stays valid, None to keep it until evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict() # key -> (created at, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, key: str) -> Any | None:
+        """
+        @return: the value, None if it is missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.is_expired(entry[0]):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, value: Any, created_at: float | None = None):
+        """
+        @param created_at: when the value was computed, defaults to now
+        """
+        self._entries[key] = (created_at or time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution. When the caller running it is
+    cancelled, the callers waiting on it are not: one of them runs it again.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        @param key: identifies the call
+        @param compute: runs the call if none with the same key is in flight
+        @return: the result and True if this caller ran it, False if it came from another caller
+        """
+        while (in_flight := self._in_flight.get(key)) is not None:
+            try:
+                return await asyncio.shield(in_flight), False
+            except asyncio.CancelledError:
+                if not in_flight.cancelled() or asyncio.current_task().cancelling():
+                    raise # this caller was cancelled
+                # the caller running it was cancelled, this one takes over
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+            future.set_result(result)
+            return result, True
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # retrieved here so an unawaited failure is not logged
+            raise
+        finally:
+            del self._in_flight[key]
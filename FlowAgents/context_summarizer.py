@@ -0,0 +1,124 @@
+from typing import Dict, List
+from agents import Agent, Runner
+from .conversation_flow.importance_message import ImportanceMessage, ImportanceResponse
+from .conversation_flow.utils import Utils
+from .load_client import get_model
+import asyncio
+import weakref
+
+SUMMARY_PROMPT = (
+    "You compact the older part of a conversation between agents and users. Summarize the messages you receive "
+    "in a few sentences, keeping decisions, facts, open tasks and delegated results. Answer with the summary only."
+)
+
+class ContextSummarizer:
+    """
+    Summarizes the messages a chat flow evicts or lets expire, in the background with a cheap model, and adds the
+    summary back as one compact message. Dropped messages are batched until they reach min_tokens, runs never wait
+    on it and at most max_concurrency summaries run at once on each event loop.
+    """
+
+    def __init__(self, model: str = "openai/gpt-4o-mini", max_concurrency: int = 1,
+                 importance: int = Utils.DEFAULT_RESPONSE_IMPORTANCE, max_input_tokens: int = 8000, min_tokens: int = 2000):
+        """
+        @param model: the model writing the summaries
+        @param max_concurrency: max summaries running at once across every attached agent
+        @param importance: the importance of the summary messages
+        @param max_input_tokens: max tokens of messages summarized in one call, longer runs are summarized in parts
+        @param min_tokens: tokens of dropped messages an agent accumulates before they are summarized, so a few
+        evictions per turn do not cost a call each
+        """
+        self.model = model
+        self.importance = importance
+        self.max_input_tokens = max_input_tokens
+        self.min_tokens = min_tokens
+        self.max_concurrency = max_concurrency
+        self.summaries = 0
+        self.failures = 0
+        # event loop -> its semaphore, a semaphore can only be used on one loop and the server or batch runs may use several
+        self._semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+        self._pending: Dict[int, List[ImportanceMessage]] = {} # id of the agent -> messages waiting to be summarized
+        self._pending_tokens: Dict[int, int] = {} # id of the agent -> tokens of its pending messages
+        self._tasks: Dict[int, asyncio.Task] = {} # id of the agent -> its summarizing task
+        self._agent = None
+
+    def get_agent(self) -> Agent:
+        if self._agent is None:
+            self._agent = Agent(name="context_summarizer", instructions=SUMMARY_PROMPT, model=get_model(self.model))
+        return self._agent
+
+    def attach(self, agent):
+        """
+        Summarizes what the chat flow of the agent drops from now on
+        @param agent: the FlowAgent whose chat flow is compacted
+        """
+        agent.chat_flow_manager.removal_listener = lambda messages, reason: self.submit(agent, messages)
+
+    def submit(self, agent, messages: List[ImportanceMessage]):
+        """
+        Queues dropped messages of an agent, they are folded into the summary task of the agent if one is waiting
+        @param agent: the agent the messages were dropped from
+        @param messages: the dropped messages, in chat order
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # dropped outside of a run, nothing can summarize them
+        self._pending.setdefault(id(agent), []).extend(messages)
+        self._pending_tokens[id(agent)] = self._pending_tokens.get(id(agent), 0) + sum(message.get_token_size() for message in messages)
+        if self._pending_tokens[id(agent)] < self.min_tokens:
+            return # batched with the next dropped messages
+        task = self._tasks.get(id(agent))
+        if task is None or task.done():
+            self._tasks[id(agent)] = loop.create_task(self._summarize_pending(agent))
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _summarize_pending(self, agent):
+        while self._pending_tokens.get(id(agent), 0) >= self.min_tokens:
+            async with self._semaphore():
+                messages = self._take(id(agent))
+                try:
+                    summary = await self._summarize(messages)
+                except Exception:
+                    self.failures += 1
+                    continue
+            if summary:
+                self.summaries += 1
+                # added without decay, the background summary must not age the messages of the agent
+                agent.chat_flow_manager.add_message(
+                    ImportanceResponse(importance=self.importance, message=f"Summary of earlier messages: {summary}"),
+                    decay=False
+                )
+        self._tasks.pop(id(agent), None)
+
+    def _take(self, key: int) -> List[ImportanceMessage]:
+        """
+        @return: the oldest pending messages fitting in max_input_tokens, at least one
+        """
+        pending = self._pending[key]
+        tokens = 0
+        end = 0
+        while end < len(pending) and (end == 0 or tokens + pending[end].get_token_size() <= self.max_input_tokens):
+            tokens += pending[end].get_token_size()
+            end += 1
+        self._pending[key] = pending[end:]
+        self._pending_tokens[key] -= tokens
+        return pending[:end]
+
+    async def _summarize(self, messages: List[ImportanceMessage]) -> str:
+        text = "\n".join(str(message) for message in messages)
+        result = await Runner.run(self.get_agent(), text)
+        return result.final_output
+
+    async def drain(self):
+        """
+        Waits for every queued summary, batches still below min_tokens stay pending
+        """
+        while any(not task.done() for task in self._tasks.values()):
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
@@ -1,87 +1,375 @@
-from .importance_message import ImportanceMessage
+import heapq
+from itertools import count
+from typing import Callable
+import numpy as np
+from .importance_message import ImportanceMessage, DeveloperMessage, ImportanceRequest, ImportanceResponse, WALL_CLOCK_OFFSET_NS
+from .message_role import MessageRole
+from .relevance_packer import RelevancePacker
+from .flow_prefix import FlowPrefix
+from ..tracing import tracer
 
 class ChatFlowManager:
 
     MAX_CONTEXT_SIZE = 128000 # max context for the model
     CLEAN_THRESHOLD = 0.8 # 80% of the max token size
-    MAX_TOKEN_SIZE_THRESHOLD = MAX_CONTEXT_SIZE * CLEAN_THRESHOLD
 
     # anything with importance == MAX_IMPORTANCE is a developer message and won't be cleaned
     MAX_IMPORTANCE = 2147483647 # max importance for the model
 
-    def __init__(self):
+    def __init__(self, max_context_size: int = MAX_CONTEXT_SIZE, packer: RelevancePacker | None = None,
+                 prefix: FlowPrefix | None = None, name: str | None = None):
         """
         Initializes the chat flow manager
+        @param max_context_size: the max context of the model this chat flow is sent to
+        @param packer: enables the packing mode, only the messages relevant to each request are sent with it
+        @param prefix: constant developer messages the chat flow starts with, shared instead of copied
+        @param name: the agent owning the chat flow, labels its traces
         """
-        self.chat_flow = [] # list of ImportanceMessage objects
+        self.name = name
+        self.max_context_size = max_context_size
+        self.packer = packer
+        self.prefix = prefix
+        self._messages: dict[int, ImportanceMessage] = {} # sequence number -> message, kept in insertion order
+        self._token_sizes: dict[int, int] = {} # sequence number -> token size accounted in the running total
+        self._eviction_keys: dict[int, int] = {} # sequence number -> key of its live entry in the eviction index
+        self._segments: dict[int, str] = {} # sequence number -> serialized message
+        # serialized chat flow followed by the segments appended since, joined lazily by serialize(), None when a
+        # removal or an edit invalidated it
+        self._serialized_parts: list[str] | None = []
+        self._eviction_index = [] # min-heap of (importance + epoch, created_at_ns, sequence number), also the expiry queue
+        self._sequence = count()
+        self._total_token_size = 0
+        if prefix is not None:
+            self._serialized_parts = [prefix.serialized] if prefix.serialized else []
+            self._total_token_size = prefix.token_size
+        self.epoch = 0 # how many times the importance of every message was decremented
+        # called with the messages dropped by one cleaning pass and the reason, "evicted" or "expired"
+        self.removal_listener: Callable[[list[ImportanceMessage], str], None] | None = None
+        self.journal: Callable[[dict], None] | None = None # called with every change, to persist the chat flow
+        self.observers: list[Callable[[dict], None]] = [] # also called with every change, replays included, e.g. by the debugger
 
-    def add_message(self, message: ImportanceMessage):
+    @property
+    def chat_flow(self) -> list[ImportanceMessage]:
+        """
+        @return: the messages of the chat flow, oldest first
+        """
+        if self.prefix is not None:
+            return [*self.prefix.messages, *self._messages.values()]
+        return list(self._messages.values())
+
+    @chat_flow.setter
+    def chat_flow(self, messages: list[ImportanceMessage]):
+        self.clear()
+        for message in messages:
+            self._insert(message)
+
+    def __len__(self) -> int:
+        return len(self._messages) + (len(self.prefix.messages) if self.prefix is not None else 0)
+
+    def clear(self):
+        """
+        Removes every message from the chat flow, the prefix included
+        """
+        self.prefix = None
+        for message in self._messages.values():
+            self._unbind(message)
+        self._messages.clear()
+        self._token_sizes.clear()
+        self._segments.clear()
+        self._serialized_parts = []
+        self._eviction_keys.clear()
+        self._eviction_index.clear()
+        self._total_token_size = 0
+        if self.packer is not None:
+            self.packer.clear()
+        if self.journal is not None or self.observers:
+            self._emit({"op": "clear"})
+
+    def add_message(self, message: ImportanceMessage, decay: bool = True):
         """
         Removes all messages with importance < 0, then adds the new message to the chat flow, then triggers cleaning if necessary
         @param message: the message to add
+        @param decay: False to add the message without aging the others, e.g. for messages added in the background
         """
-        self.decrement_all_importance_messages()
-        self.remove_negative_importance_messages()
-        self.chat_flow.append(message)
+        if decay:
+            self.decrement_all_importance_messages()
+            self.remove_negative_importance_messages()
+        self._insert(message)
         self.trigger_cleaning()
 
+    def add_messages(self, messages: list[ImportanceMessage]):
+        """
+        Adds many messages in order, counting their token sizes in one pass
+        @param messages: the messages to add
+        """
+        ImportanceMessage.compute_token_sizes(messages)
+        for message in messages:
+            self.add_message(message)
+
+    def _is_pinned(self, message: ImportanceMessage) -> bool:
+        return message.importance == self.MAX_IMPORTANCE
+
+    def _insert(self, message: ImportanceMessage, seq: int | None = None):
+        if seq is None:
+            seq = next(self._sequence)
+        token_size = message.get_token_size()
+        message._importance = message.importance
+        message._flow = self
+        message._flow_seq = seq
+        message._flow_epoch = self.epoch
+        segment = message.__str__()
+        if self._serialized_parts is not None:
+            self._serialized_parts.append(segment) # O(segment), the buffer is only joined when serialized
+        self._messages[seq] = message
+        self._token_sizes[seq] = token_size
+        self._total_token_size += token_size
+        self._segments[seq] = segment
+        self._index(seq, message)
+        if self.journal is not None or self.observers:
+            self._emit({"op": "add", **self._record(seq, message)})
+
+    def _index(self, seq: int, message: ImportanceMessage):
+        if self._is_pinned(message):
+            self._eviction_keys.pop(seq, None)
+            return
+        # the key is the epoch at which the message expires, it is stable while every message decays together
+        key = message.importance + self.epoch
+        self._eviction_keys[seq] = key
+        heapq.heappush(self._eviction_index, (key, message.created_at_ns, seq))
+
+    def _unbind(self, message: ImportanceMessage):
+        message._importance = message.importance # freezes the effective importance
+        message._flow = None
+        message._flow_seq = None
+
+    def _emit(self, event: dict):
+        if self.journal is not None:
+            self.journal(event)
+        for observer in self.observers:
+            observer(event)
+
+    def _remove(self, seq: int, reason: str | None = None) -> ImportanceMessage:
+        message = self._messages.pop(seq)
+        self._unbind(message)
+        self._total_token_size -= self._token_sizes.pop(seq)
+        self._eviction_keys.pop(seq, None) # its heap entry becomes stale and is skipped lazily
+        self._segments.pop(seq)
+        self._serialized_parts = None
+        if self.packer is not None:
+            self.packer.discard(seq)
+        if self.journal is not None or self.observers:
+            self._emit({"op": "remove", "seq": seq, "reason": reason})
+        return message
+
+    def _on_message_changed(self, message: ImportanceMessage):
+        """
+        Refreshes the cached segment and token size of a message whose text or role was edited
+        @param message: the message that changed
+        """
+        seq = message._flow_seq
+        token_size = message.get_token_size()
+        self._total_token_size += token_size - self._token_sizes[seq]
+        self._token_sizes[seq] = token_size
+        self._segments[seq] = message.__str__()
+        self._serialized_parts = None
+        if self.packer is not None:
+            self.packer.discard(seq) # embedded again on the next pack
+        if self.journal is not None or self.observers:
+            self._emit({"op": "change", "seq": seq, "role": message.messagerole.value, "message": message.message})
+
+    def _on_importance_changed(self, message: ImportanceMessage):
+        """
+        Reindexes a message whose importance was set directly
+        @param message: the message that changed
+        """
+        self._index(message._flow_seq, message)
+        self._compact_eviction_index()
+        if self.journal is not None or self.observers:
+            self._emit({"op": "importance", "seq": message._flow_seq, "importance": message.importance})
+
+    def _compact_eviction_index(self):
+        """
+        Drops stale entries once they outnumber the live ones, keeping pops amortized O(log n)
+        """
+        if len(self._eviction_index) > 2 * len(self._eviction_keys) + 32:
+            self._eviction_index = [entry for entry in self._eviction_index if self._eviction_keys.get(entry[2]) == entry[0]]
+            heapq.heapify(self._eviction_index)
+
     def decrement_all_importance_messages(self):
         """
-        Decrements the importance of all messages by 1
+        Decrements the importance of all messages by 1, lazily: only the epoch moves
         """
-        for message in self.chat_flow:
-            message.importance -= 1
+        self.epoch += 1
+        if self.journal is not None or self.observers:
+            self._emit({"op": "epoch", "epoch": self.epoch})
 
     def remove_negative_importance_messages(self):
         """
-        Removes all messages with importance < 0
+        Removes all messages with importance < 0, only the expired ones are touched
         """
-        self.chat_flow = [response for response in self.chat_flow if response.importance >= 0]
+        removed = []
+        while self._eviction_index and self._eviction_index[0][0] < self.epoch:
+            key, _, seq = heapq.heappop(self._eviction_index)
+            if self._eviction_keys.get(seq) == key:
+                removed.append(self._remove(seq, "expired"))
+        self._compact_eviction_index()
+        self._notify_removed(removed, "expired")
 
     def get_total_token_size(self) -> int:
         """
         @return: the total token size of the chat flow
         """
-        return sum([response.get_token_size() for response in self.chat_flow])
+        return self._total_token_size
 
     def trigger_cleaning(self, threshold: float = CLEAN_THRESHOLD):
         """
         Automatically cleans the chat flow until we are under the threesold
         @param threshold: the threshold to clean the chat flow to
-        @return: the total token size of the chat flow
-        @return: the total importance of the chat flow
         """
-
-        # automatically cleans the chat flow until we are under the threesold
-        if self.get_total_token_size() < self.MAX_TOKEN_SIZE_THRESHOLD:
+        max_token_size = self.max_context_size * threshold
+        if self._total_token_size < max_token_size:
             return
 
-        cloned_chat_flow = self.chat_flow.copy()
-        # sorts the chat flow by importance (least important first) if importance is the same, then by created_at (oldest first)
-        cloned_chat_flow.sort(key=lambda message: (message.importance, message.created_at))
-        
-        cloned_chat_flow = [message for message in cloned_chat_flow if message.importance != self.MAX_IMPORTANCE] # exclude developer messages
-
-        # removes the oldest responses until the total size is less than the threshold
-        while self.get_total_token_size() > self.MAX_TOKEN_SIZE_THRESHOLD:
-            cloned_chat_flow.pop(0)
-
-        # order again the list by timestamp
-        cloned_chat_flow.sort(key=lambda message: message.created_at)
-        self.chat_flow = cloned_chat_flow
-        
+        # pops the least important message (oldest first on ties) until we are under the threshold, developer messages are never indexed
+        removed = []
+        with tracer.span("chat_flow.trigger_cleaning", agent=self.name, context_before=self._total_token_size) as span:
+            while self._total_token_size > max_token_size and self._eviction_index:
+                key, _, seq = heapq.heappop(self._eviction_index)
+                if self._eviction_keys.get(seq) != key:
+                    continue # stale entry of an already removed message
+                removed.append(self._remove(seq, "evicted"))
+            span.set(context_after=self._total_token_size, evicted=len(removed))
+        self._notify_removed(removed, "evicted")
 
+    def _notify_removed(self, removed: list[ImportanceMessage], reason: str):
+        if removed and self.removal_listener is not None:
+            removed.sort(key=lambda message: message.created_at_ns) # the listener gets them in chat order
+            self.removal_listener(removed, reason)
 
     def serialize(self) -> str:
         """
-        Serializes the chat flow to a string
+        Serializes the chat flow to a string, appends reuse the previous result and removals only re-join cached segments
         @return: the serialized chat flow
         """
-        return "\n".join(self.to_json_list())
-    
+        if self._serialized_parts is None:
+            prefix = self.prefix.segments if self.prefix is not None else ()
+            serialized = "\n".join([*prefix, *self._segments.values()])
+        elif len(self._serialized_parts) == 1:
+            return self._serialized_parts[0]
+        else:
+            serialized = "\n".join(self._serialized_parts)
+        self._serialized_parts = [serialized] if serialized else [] # an empty part would start the next append with a newline
+        return serialized
+
+    def pack(self, query: str) -> str:
+        """
+        Serializes only the messages worth sending with a request: developer messages, then the best set of the
+        others by relevance to the request, importance and recency that fits the packer budget, in chat order.
+        Falls back to serialize without a packer. Nothing is removed from the chat flow.
+        @param query: the incoming request
+        @return: the serialized packed chat flow
+        """
+        if self.packer is None:
+            return self.serialize()
+        budget = int(self.max_context_size * self.packer.budget_ratio)
+        if self._total_token_size <= budget:
+            return self.serialize()
+
+        seqs = [seq for seq in self._messages if seq in self._eviction_keys]
+        pinned_size = self._total_token_size - sum(self._token_sizes[seq] for seq in seqs)
+        importances = np.fromiter((self._eviction_keys[seq] - self.epoch for seq in seqs), dtype=np.int64, count=len(seqs))
+        token_sizes = np.fromiter((self._token_sizes[seq] for seq in seqs), dtype=np.int64, count=len(seqs))
+        scores = self.packer.score(query, seqs, [self._messages[seq].message for seq in seqs], importances)
+        chosen = {seqs[i] for i in self.packer.pack(scores, token_sizes, budget - pinned_size)}
+        prefix = self.prefix.segments if self.prefix is not None else ()
+        return "\n".join([*prefix, *(segment for seq, segment in self._segments.items() if seq in chosen or seq not in self._eviction_keys)])
+
+    @staticmethod
+    def _record(seq: int, message: ImportanceMessage) -> dict:
+        return {
+            "seq": seq,
+            "role": message.messagerole.value,
+            "importance": message.importance, # effective at the current epoch
+            "message": message.message,
+            "created_at": message.created_at_ns + WALL_CLOCK_OFFSET_NS, # wall clock, monotonic clocks restart
+        }
+
+    @staticmethod
+    def _message_from_record(record: dict) -> ImportanceMessage:
+        role = MessageRole(record["role"])
+        if role == MessageRole.DEVELOPER:
+            message = DeveloperMessage(message=record["message"])
+            message._importance = record["importance"]
+        elif role == MessageRole.USER:
+            message = ImportanceRequest(importance=record["importance"], message=record["message"])
+        else:
+            message = ImportanceResponse(importance=record["importance"], message=record["message"])
+        message.created_at_ns = record["created_at"] - WALL_CLOCK_OFFSET_NS
+        return message
+
+    def dump_state(self) -> dict:
+        """
+        @return: a JSON-serializable snapshot of the chat flow, sequence numbers included so a journal can be replayed on it,
+        the prefix comes from the agent template so only whether the chat flow still starts with it is recorded
+        """
+        return {
+            "epoch": self.epoch,
+            "prefixed": self.prefix is not None,
+            "messages": [self._record(seq, message) for seq, message in self._messages.items()],
+        }
+
+    def load_state(self, state: dict):
+        """
+        Replaces the chat flow with a snapshot from dump_state, without journaling it, the prefix is kept if the snapshot
+        still started with it
+        @param state: the snapshot
+        """
+        journal, self.journal = self.journal, None
+        # older snapshots have no prefix, their developer messages are among the saved ones
+        prefix = self.prefix if state.get("prefixed", False) else None
+        try:
+            self.clear()
+            self.prefix = prefix
+            if prefix is not None:
+                self._serialized_parts = [prefix.serialized] if prefix.serialized else []
+                self._total_token_size = prefix.token_size
+            self.epoch = state["epoch"]
+            for record in state["messages"]:
+                self._insert(self._message_from_record(record), record["seq"])
+            self._sequence = count(max(self._messages, default=-1) + 1)
+        finally:
+            self.journal = journal
+
+    def apply(self, event: dict):
+        """
+        Replays one journaled change, without journaling it again
+        @param event: the change passed to the journal
+        """
+        journal, self.journal = self.journal, None
+        try:
+            op = event["op"]
+            if op == "add":
+                self._insert(self._message_from_record(event), event["seq"])
+                self._sequence = count(max(event["seq"] + 1, next(self._sequence)))
+            elif op == "remove":
+                self._remove(event["seq"])
+            elif op == "epoch":
+                self.epoch = event["epoch"]
+            elif op == "change":
+                message = self._messages[event["seq"]]
+                message._messagerole = MessageRole(event["role"])
+                message.message = event["message"]
+            elif op == "importance":
+                self._messages[event["seq"]].importance = event["importance"]
+            elif op == "clear":
+                self.clear()
+        finally:
+            self.journal = journal
+
     def to_json_list(self) -> list[dict]:
         """
         Converts the chat flow to a list of dictionaries
         @return: the list of dictionaries
         """
-        return [message.__str__() for message in self.chat_flow]
\ No newline at end of file
+        prefix = self.prefix.segments if self.prefix is not None else ()
+        return [*prefix, *self._segments.values()]
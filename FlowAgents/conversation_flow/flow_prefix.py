@@ -0,0 +1,27 @@
+from .importance_message import ImportanceMessage, DeveloperMessage
+
+class FlowPrefix:
+    """
+    Constant developer messages shared by every chat flow built from the same agent template, serialized and
+    counted once. Its messages are shared between chat flows and must not be edited.
+    """
+
+    __slots__ = ("messages", "segments", "serialized", "token_size")
+
+    def __init__(self, messages: list[ImportanceMessage]):
+        """
+        @param messages: the messages every chat flow starts with
+        """
+        ImportanceMessage.compute_token_sizes(messages)
+        self.messages = tuple(messages)
+        self.segments = tuple(message.__str__() for message in messages)
+        self.serialized = "\n".join(self.segments)
+        self.token_size = sum(message.get_token_size() for message in messages)
+
+    @staticmethod
+    def from_texts(texts: list[str]) -> "FlowPrefix":
+        """
+        @param texts: the developer messages, in order
+        @return: the prefix of these developer messages
+        """
+        return FlowPrefix([DeveloperMessage(message=text) for text in texts])
@@ -1,38 +1,110 @@
 from abc import ABC, abstractmethod
 from .message_role import MessageRole
 from datetime import datetime
+import time
 from .utils import Utils
 from pydantic import BaseModel
 import json
 
+# offset between the wall clock and the monotonic clock, to display monotonic timestamps as dates
+WALL_CLOCK_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
 class ImportanceMessage(ABC):
 
+    # no per-instance __dict__, histories of many sessions are kept in memory at once
+    __slots__ = ("_importance", "_flow", "_flow_seq", "_flow_epoch", "_serialized", "_messagerole", "_message", "token_size", "created_at_ns")
+
     def __init__(self, importance: int, messagerole: MessageRole, message: str | None = None):
-        self.importance = importance
-        self.messagerole = messagerole
-        self.message = message
+        self._importance = importance
+        self._flow = None # the ChatFlowManager this message belongs to, it owns the decay epoch
+        self._flow_seq = None # sequence number of the message inside its chat flow
+        self._flow_epoch = 0 # epoch of the chat flow when _importance was last set
+        self._serialized = None # memoized __str__, invalidated when the text or the role changes
+        self._messagerole = messagerole
+        self._message = message
         self.token_size = None
-        self.created_at = datetime.now()
+        self.created_at_ns = time.monotonic_ns()
 
     def __str__(self):
+        if self._serialized is None:
+            self._serialized = self._serialize()
+        return self._serialized
+
+    def _serialize(self) -> str:
         # returns a json string of only message
         return json.dumps({
             'role': self.messagerole.value,
             'message': self.message
         })
 
+    @property
+    def message(self) -> str | None:
+        return self._message
+
+    @message.setter
+    def message(self, message: str | None):
+        self._message = message
+        self.token_size = None
+        self._on_content_changed()
+
+    @property
+    def messagerole(self) -> MessageRole:
+        return self._messagerole
+
+    @messagerole.setter
+    def messagerole(self, messagerole: MessageRole):
+        self._messagerole = messagerole
+        self._on_content_changed()
+
+    def _on_content_changed(self):
+        self._serialized = None
+        if self._flow is not None:
+            self._flow._on_message_changed(self)
+
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp((self.created_at_ns + WALL_CLOCK_OFFSET_NS) / 1e9)
+
+    @property
+    def importance(self) -> int:
+        """
+        @return: the effective importance, the stored importance minus the epochs elapsed in its chat flow
+        """
+        if self._flow is None or self._importance == Utils.MAX_IMPORTANCE:
+            return self._importance
+        return self._importance - (self._flow.epoch - self._flow_epoch)
+
+    @importance.setter
+    def importance(self, importance: int):
+        self._importance = importance
+        if self._flow is not None:
+            self._flow_epoch = self._flow.epoch
+            self._flow._on_importance_changed(self)
+
     def set_token_size(self, token_size: int):
         self.token_size = token_size
 
     def get_token_size(self) -> int:
         if(self.token_size is None):
-            return Utils.get_approximate_tokens_size(self.message)
+            self.token_size = Utils.get_tokens_size(self.message) # counted once, reset when the message is edited
         return self.token_size
+
+    @staticmethod
+    def compute_token_sizes(messages: list["ImportanceMessage"]):
+        """
+        Counts the token size of every message not counted yet in a single tokenizer pass
+        @param messages: the messages to count
+        """
+        uncounted = [message for message in messages if message.token_size is None]
+        for message, token_size in zip(uncounted, Utils.get_tokens_sizes([message.message for message in uncounted])):
+            message.token_size = token_size
     
 class DeveloperMessage(ImportanceMessage):
+    __slots__ = ()
+
     def __init__(self, message: str | None = None):
         """
         Initializes the developer message
@@ -42,6 +114,7 @@ class DeveloperMessage(ImportanceMessage):
 
 
 class ImportanceRequest(ImportanceMessage):
+    __slots__ = ()
 
     def __init__(self, importance: int = Utils.DEFAULT_USER_MESSAGE_IMPORTANCE, message: str | None = None):
         """ 
@@ -52,6 +125,7 @@ class ImportanceRequest(ImportanceMessage):
         super().__init__(importance, MessageRole.USER, message)
 
 class ImportanceResponse(ImportanceMessage):
+    __slots__ = ()
 
     def __init__(self, importance: int = Utils.DEFAULT_RESPONSE_IMPORTANCE, message: str | None = None):
         """
@@ -0,0 +1,162 @@
+from functools import lru_cache
+import math
+import re
+import zlib
+import numpy as np
+
+TERM_PATTERN = re.compile(r"\w+")
+
+@lru_cache(maxsize=65536)
+def _feature(term: str, dimensions: int) -> tuple[int, float]:
+    """
+    @return: the dimension of a term and its sign, shared by every packer so no cache keeps a packer alive
+    """
+    digest = zlib.crc32(term.encode("utf-8"))
+    return digest % dimensions, 1.0 if digest & 0x80000000 else -1.0 # the sign keeps collisions unbiased
+
+class RelevancePacker:
+    """
+    Picks the messages sent with a request: every message is scored against the request with hashed bag-of-words
+    embeddings, combined with its importance and recency, and the best set fitting the token budget is kept
+    (0/1 knapsack over bucketed token sizes). Message vectors are computed once and kept in a matrix, so scoring
+    a long history is a single matrix-vector product.
+    """
+
+    KNAPSACK_MAX_CELLS = 2_000_000 # candidates x buckets over which packing falls back to greedy by score per token
+
+    def __init__(self, dimensions: int = 512, budget_ratio: float = 0.5, relevance_weight: float = 1.0,
+                 importance_weight: float = 0.5, recency_weight: float = 0.3, buckets: int = 512):
+        """
+        @param dimensions: size of the hashed embeddings
+        @param budget_ratio: share of the max context the packed messages may take, developer messages included
+        @param relevance_weight: weight of the similarity with the request
+        @param importance_weight: weight of the importance, relative to the most important candidate
+        @param recency_weight: weight of the position in the chat flow, the newest message scoring 1
+        @param buckets: token sizes are rounded up to budget / buckets for the knapsack
+        """
+        self.dimensions = dimensions
+        self.budget_ratio = budget_ratio
+        self.relevance_weight = relevance_weight
+        self.importance_weight = importance_weight
+        self.recency_weight = recency_weight
+        self.buckets = buckets
+        self._vectors = np.zeros((64, dimensions), dtype=np.float32)
+        self._rows: dict[int, int] = {} # sequence number -> row of its vector
+        self._free_rows: list[int] = []
+        self._next_row = 0
+
+    def embed(self, text: str | None) -> np.ndarray:
+        """
+        @param text: the text to embed
+        @return: the unit hashed embedding of the text, zero for an empty text
+        """
+        counts: dict[str, int] = {}
+        for term in TERM_PATTERN.findall((text or "").lower()):
+            counts[term] = counts.get(term, 0) + 1
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        if not counts:
+            return vector
+        features = [_feature(term, self.dimensions) for term in counts]
+        indices = np.fromiter((index for index, _ in features), dtype=np.int64, count=len(features))
+        weights = np.fromiter(
+            (sign * (1.0 + math.log(frequency)) for (_, sign), frequency in zip(features, counts.values())),
+            dtype=np.float32, count=len(features)
+        )
+        np.add.at(vector, indices, weights)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _row(self, seq: int, text: str | None) -> int:
+        row = self._rows.get(seq)
+        if row is not None:
+            return row
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = self._next_row
+            self._next_row += 1
+            if row >= len(self._vectors):
+                self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+        self._vectors[row] = self.embed(text)
+        self._rows[seq] = row
+        return row
+
+    def discard(self, seq: int):
+        """
+        Forgets the cached vector of a removed or edited message
+        @param seq: the sequence number of the message
+        """
+        row = self._rows.pop(seq, None)
+        if row is not None:
+            self._free_rows.append(row)
+
+    def clear(self):
+        self._rows.clear()
+        self._free_rows.clear()
+        self._next_row = 0
+
+    def score(self, query: str, seqs: list[int], texts: list[str | None], importances: np.ndarray) -> np.ndarray:
+        """
+        @param query: the incoming request
+        @param seqs: the sequence numbers of the candidates, oldest first
+        @param texts: the text of each candidate, embedded only if not cached yet
+        @param importances: the effective importance of each candidate
+        @return: the combined score of each candidate
+        """
+        rows = np.fromiter((self._row(seq, text) for seq, text in zip(seqs, texts)), dtype=np.int64, count=len(seqs))
+        relevance = np.clip(self._vectors[rows] @ self.embed(query), 0.0, None)
+        importances = np.clip(importances.astype(np.float64), 0.0, None)
+        top_importance = importances.max() if len(importances) else 0.0
+        importance = importances / top_importance if top_importance > 0 else importances
+        recency = np.arange(1, len(seqs) + 1) / len(seqs) if len(seqs) else np.zeros(0)
+        return self.relevance_weight * relevance + self.importance_weight * importance + self.recency_weight * recency
+
+    def pack(self, scores: np.ndarray, token_sizes: np.ndarray, budget: int) -> np.ndarray:
+        """
+        @param scores: the score of each candidate
+        @param token_sizes: the token size of each candidate
+        @param budget: the tokens the chosen candidates may take
+        @return: the indices of the chosen candidates, in ascending order
+        """
+        if budget <= 0 or not len(scores):
+            return np.zeros(0, dtype=np.int64)
+        if token_sizes.sum() <= budget:
+            return np.arange(len(scores))
+        unit = max(1.0, budget / self.buckets)
+        weights = np.ceil(token_sizes / unit).astype(np.int64) # rounded up, a set fitting in buckets fits in tokens
+        capacity = int(budget // unit)
+        if len(scores) * (capacity + 1) > self.KNAPSACK_MAX_CELLS:
+            return self._pack_greedy(scores, token_sizes, budget)
+        return self._pack_knapsack(scores, weights, capacity)
+
+    @staticmethod
+    def _pack_knapsack(scores: np.ndarray, weights: np.ndarray, capacity: int) -> np.ndarray:
+        best = np.zeros(capacity + 1)
+        keep = np.zeros((len(scores), capacity + 1), dtype=bool)
+        free = []
+        for i, (score, weight) in enumerate(zip(scores, weights)):
+            if weight == 0:
+                free.append(i)
+            elif weight <= capacity:
+                candidate = best[:capacity + 1 - weight] + score
+                better = candidate > best[weight:]
+                keep[i, weight:] = better
+                best[weight:] = np.where(better, candidate, best[weight:])
+        chosen = free
+        remaining = capacity
+        for i in range(len(scores) - 1, -1, -1):
+            if keep[i, remaining]:
+                chosen.append(i)
+                remaining -= weights[i]
+        return np.sort(np.array(chosen, dtype=np.int64))
+
+    @staticmethod
+    def _pack_greedy(scores: np.ndarray, token_sizes: np.ndarray, budget: int) -> np.ndarray:
+        order = np.argsort(-scores / np.maximum(token_sizes, 1), kind="stable")
+        chosen = []
+        remaining = budget
+        for i in order:
+            if token_sizes[i] <= remaining: # skips what does not fit, smaller candidates may still fit
+                chosen.append(i)
+                remaining -= token_sizes[i]
+        return np.sort(np.array(chosen, dtype=np.int64))
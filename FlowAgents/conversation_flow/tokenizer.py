@@ -0,0 +1,95 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+class Tokenizer(ABC):
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """
+        @param text: the text to count
+        @return: the number of tokens of the text
+        """
+        pass
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """
+        Counts many texts in one pass
+        @param texts: the texts to count
+        @return: the number of tokens of each text
+        """
+        return [self.count(text) for text in texts]
+
+class TokenEstimator(Tokenizer):
+    """
+    Heuristic estimate used when tiktoken is missing, the counts are approximate: splits text with the cl100k
+    pre-tokenization pattern, then charges each piece the tokens the merges typically leave for it (short words
+    merge into one token, long and rare pieces fall back to a few bytes per token)
+    """
+
+    PRE_TOKENIZE_PATTERN = re.compile(
+        r"""'(?i:[sdmt]|ll|ve|re)| ?[A-Za-z]+| ?[0-9]{1,3}| ?[^\sA-Za-z0-9]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+    )
+
+    MAX_SINGLE_TOKEN_WORD = 7 # ascii words up to this length are almost always a single merged token
+    ASCII_BYTES_PER_TOKEN = 5
+    PUNCTUATION_BYTES_PER_TOKEN = 2
+    UNICODE_BYTES_PER_TOKEN = 3
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return sum(self._piece_tokens(piece) for piece in self.PRE_TOKENIZE_PATTERN.findall(text))
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        pieces = self.PRE_TOKENIZE_PATTERN.findall
+        piece_tokens = self._piece_tokens
+        return [sum(map(piece_tokens, pieces(text))) if text else 0 for text in texts]
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def _piece_tokens(piece: str) -> int:
+        if not piece.isascii():
+            return max(1, -(-len(piece.encode("utf-8")) // TokenEstimator.UNICODE_BYTES_PER_TOKEN))
+        word = piece.lstrip(" ")
+        if word.isalpha():
+            if len(word) <= TokenEstimator.MAX_SINGLE_TOKEN_WORD:
+                return 1
+            return -(-len(word) // TokenEstimator.ASCII_BYTES_PER_TOKEN)
+        if word.isdigit() or piece.isspace():
+            return 1
+        return max(1, -(-len(word) // TokenEstimator.PUNCTUATION_BYTES_PER_TOKEN))
+
+class TiktokenTokenizer(Tokenizer):
+    """
+    Exact counts through tiktoken, only available when tiktoken is installed
+    """
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        if tiktoken is None:
+            raise ImportError("tiktoken is not installed")
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch([text or "" for text in texts])]
+
+def default_tokenizer() -> Tokenizer:
+    """
+    @return: the exact tokenizer, the estimate if tiktoken is missing or cannot load its encoding, e.g. offline
+    """
+    if tiktoken is not None:
+        try:
+            return TiktokenTokenizer()
+        except Exception:
+            pass
+    return TokenEstimator()
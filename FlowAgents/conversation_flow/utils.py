@@ -1,14 +1,50 @@
+from .tokenizer import Tokenizer, default_tokenizer
+
 class Utils:
-    
-    TOKEN_TO_TEXT_RATIO = 0.75 # 1 token = 0.75 words
-    TEXT_TO_TOKEN_RATIO = 1 / TOKEN_TO_TEXT_RATIO
 
     MAX_IMPORTANCE = 2147483647
     DEVELOPER_MESSAGE_IMPORTANCE = MAX_IMPORTANCE
 
     DEFAULT_RESPONSE_IMPORTANCE = 100
     DEFAULT_USER_MESSAGE_IMPORTANCE = 20
-    
+
+    DEFAULT_CONTEXT_SIZE = 128000
+    MODEL_CONTEXT_SIZES = { # max context of each model, models not listed use DEFAULT_CONTEXT_SIZE
+        "gpt-4o": 128000,
+        "gpt-4o-mini": 128000,
+        "openai/gpt-4o": 128000,
+        "openai/gpt-4o-mini": 128000,
+        "openai/o3-mini": 200000,
+        "deepseek/deepseek-chat-v3-0324:free": 163840,
+    }
+
+    tokenizer: Tokenizer = default_tokenizer()
+
+    @staticmethod
+    def set_tokenizer(tokenizer: Tokenizer):
+        """
+        Replaces the tokenizer used to count every message
+        @param tokenizer: the tokenizer to use
+        """
+        Utils.tokenizer = tokenizer
+
+    @staticmethod
+    def get_tokens_size(text: str | None) -> int:
+        return Utils.tokenizer.count(text) if text else 0
+
+    @staticmethod
+    def get_tokens_sizes(texts: list[str | None]) -> list[int]:
+        """
+        Counts many texts in one pass of the tokenizer
+        @param texts: the texts to count
+        @return: the token size of each text
+        """
+        return Utils.tokenizer.count_batch([text or "" for text in texts])
+
     @staticmethod
-    def get_approximate_tokens_size(text: str) -> int:
-        return int(len(text) * Utils.TEXT_TO_TOKEN_RATIO)
+    def get_context_size(model: str) -> int:
+        """
+        @param model: the model name
+        @return: the max context of the model
+        """
+        return Utils.MODEL_CONTEXT_SIZES.get(model, Utils.DEFAULT_CONTEXT_SIZE)
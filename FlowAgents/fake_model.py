@@ -0,0 +1,197 @@
+from typing import Dict, Any, List, AsyncIterator
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from openai.types.completion_usage import CompletionUsage
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+
+WORDS = ("agent", "task", "result", "context", "message", "handoff", "model", "session", "request", "summary",
+         "research", "code", "document", "review", "plan", "data", "answer", "step", "flow", "tool")
+SUBAGENTS_PATTERN = re.compile(r"You can delegate tasks to these subagents: ([^\"\n]*)")
+
+class LatencyDistribution:
+    """
+    Seconds a fake call waits before answering, drawn from a named distribution
+    """
+
+    def __init__(self, distribution: str = "constant", **params):
+        """
+        @param distribution: constant (seconds), uniform (low, high), normal (mean, stddev),
+        lognormal (mean, sigma of the underlying normal) or exponential (mean)
+        @param params: the parameters of the distribution
+        """
+        if distribution not in ("constant", "uniform", "normal", "lognormal", "exponential"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.params = params
+
+    @staticmethod
+    def parse(latency: "float | Dict[str, Any] | LatencyDistribution") -> "LatencyDistribution":
+        """
+        @param latency: seconds, or a mapping with the distribution and its parameters
+        """
+        if isinstance(latency, LatencyDistribution):
+            return latency
+        if isinstance(latency, dict):
+            return LatencyDistribution(**latency)
+        return LatencyDistribution("constant", seconds=float(latency))
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.distribution == "constant":
+            return p.get("seconds", 0.0)
+        if self.distribution == "uniform":
+            return rng.uniform(p.get("low", 0.0), p.get("high", 0.0))
+        if self.distribution == "normal":
+            return max(0.0, rng.gauss(p.get("mean", 0.0), p.get("stddev", 0.0)))
+        if self.distribution == "lognormal":
+            return rng.lognormvariate(p.get("mean", -3.0), p.get("sigma", 0.5))
+        return rng.expovariate(1 / p["mean"]) if p.get("mean") else 0.0
+
+class FakeModel:
+    """
+    Deterministic stand-in for a chat model: the answer only depends on the seed and on the request, so runs are
+    reproducible whatever order concurrent calls land in. Answers are filler words, a scripted response when one of
+    the script patterns matches the request, and optionally handoff JSON to the subagents the instructions list.
+    """
+
+    def __init__(self,
+                 latency: float | Dict[str, Any] = 0.0,
+                 response_words: int | List[int] = (20, 80),
+                 seed: int = 0,
+                 script: List[Dict[str, str]] | None = None,
+                 handoff_rate: float = 0.0,
+                 max_handoffs: int = 1,
+                 chunk_words: int = 4,
+                 chunk_interval: float = 0.0):
+        """
+        @param latency: seconds before the first token, or a distribution, e.g. {"distribution": "lognormal", "mean": -3}
+        @param response_words: words of each response, or the [min, max] range they are drawn from
+        @param seed: changes every drawn response, latency and handoff
+        @param script: responses used when their regex matches the request, [{"match": "...", "response": "..."}],
+        checked in order, the response may contain handoff JSON
+        @param handoff_rate: chance an unscripted response delegates to the subagents listed in the instructions
+        @param max_handoffs: max handoffs in one unscripted response
+        @param chunk_words: words per streamed chunk
+        @param chunk_interval: seconds between two streamed chunks
+        """
+        self.latency = LatencyDistribution.parse(latency)
+        self.response_words = (response_words, response_words) if isinstance(response_words, int) else tuple(response_words)
+        self.seed = seed
+        self.script = [(re.compile(entry["match"]), entry["response"]) for entry in script or []]
+        self.handoff_rate = handoff_rate
+        self.max_handoffs = max_handoffs
+        self.chunk_words = chunk_words
+        self.chunk_interval = chunk_interval
+        self.calls = 0
+
+    @staticmethod
+    def request_text(messages: List[Dict[str, Any]]) -> str:
+        """
+        @return: the text of the chat messages, content parts included
+        """
+        texts = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        return "\n".join(texts)
+
+    def respond(self, text: str) -> tuple[str, float]:
+        """
+        @param text: the request
+        @return: the response and the latency before it, both only depending on the seed and the request
+        """
+        self.calls += 1
+        rng = random.Random(hashlib.blake2b(f"{self.seed}\0{text}".encode("utf-8"), digest_size=8).digest())
+        latency = self.latency.sample(rng)
+        for pattern, response in self.script:
+            if pattern.search(text):
+                return response, latency
+        words = rng.randint(*self.response_words)
+        response = " ".join(rng.choice(WORDS) for _ in range(words))
+        subagents = self._subagents(text)
+        if subagents and rng.random() < self.handoff_rate:
+            for _ in range(rng.randint(1, self.max_handoffs)):
+                handoff = {"handoff": {"subagent": rng.choice(subagents), "prompt": " ".join(rng.choice(WORDS) for _ in range(8))}}
+                response += " " + json.dumps(handoff)
+        return response, latency
+
+    @staticmethod
+    def _subagents(text: str) -> List[str]:
+        match = SUBAGENTS_PATTERN.search(text)
+        return re.findall(r"'([^']+)'", match.group(1)) if match else []
+
+    def chunks(self, response: str) -> List[str]:
+        words = response.split(" ")
+        return [" ".join(words[i:i + self.chunk_words]) + (" " if i + self.chunk_words < len(words) else "")
+                for i in range(0, len(words), self.chunk_words)]
+
+class _FakeCompletions:
+    def __init__(self, model: FakeModel):
+        self.model = model
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs):
+        """
+        Same signature as the OpenAI chat completions, the other options are accepted and ignored
+        """
+        text = FakeModel.request_text(messages)
+        response, latency = self.model.respond(text)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        completion_id = f"chatcmpl-fake-{self.model.calls}"
+        usage = CompletionUsage(prompt_tokens=len(text) // 4, completion_tokens=len(response) // 4,
+                                total_tokens=(len(text) + len(response)) // 4)
+        if stream:
+            return self._stream(completion_id, model, response, usage)
+        return ChatCompletion(
+            id=completion_id,
+            object="chat.completion",
+            created=int(time.time()),
+            model=model,
+            choices=[Choice(index=0, finish_reason="stop", message=ChatCompletionMessage(role="assistant", content=response))],
+            usage=usage,
+        )
+
+    async def _stream(self, completion_id: str, model: str, response: str, usage: CompletionUsage) -> AsyncIterator[ChatCompletionChunk]:
+        created = int(time.time())
+        for index, chunk in enumerate(self.model.chunks(response)):
+            if index > 0 and self.model.chunk_interval > 0:
+                await asyncio.sleep(self.model.chunk_interval)
+            yield ChatCompletionChunk(
+                id=completion_id, object="chat.completion.chunk", created=created, model=model,
+                choices=[ChunkChoice(index=0, delta=ChoiceDelta(role="assistant", content=chunk), finish_reason=None)],
+            )
+        yield ChatCompletionChunk(
+            id=completion_id, object="chat.completion.chunk", created=created, model=model,
+            choices=[ChunkChoice(index=0, delta=ChoiceDelta(), finish_reason="stop")], usage=usage,
+        )
+
+class _FakeChat:
+    def __init__(self, model: FakeModel):
+        self.completions = _FakeCompletions(model)
+
+class FakeAsyncOpenAI:
+    """
+    In-process replacement of AsyncOpenAI answering with a FakeModel, set the fake_model client option to use it
+    instead of the network
+    """
+
+    def __init__(self, **options):
+        """
+        @param options: the options of the FakeModel
+        """
+        self.model = FakeModel(**options)
+        self.chat = _FakeChat(self.model)
+        self.base_url = "fake://model"
+        self.api_key = "fake"
+
+    async def close(self):
+        pass
@@ -1,35 +1,98 @@
 from .conversation_flow.chat_flow_manager import ChatFlowManager
-from agents import Agent, Runner
+from .conversation_flow.relevance_packer import RelevancePacker
+from .conversation_flow.flow_prefix import FlowPrefix
+from agents import Agent, Runner, RunContextWrapper, RunResultStreaming
 from .conversation_flow.importance_message import DeveloperMessage, ImportanceRequest, ImportanceResponse
+from .conversation_flow.utils import Utils
 from agents import Tool
-from typing import List
-from .load_client import load_client, isClientLoaded, get_client
+from typing import List, AsyncIterator
+from dataclasses import dataclass
+from .load_client import get_model
+from .response_cache import ResponseCache
+from openai.types.responses import ResponseTextDeltaEvent
 from IOMethods.output_methods import OutputMethod, ConsoleOutputMethod
-from agents import OpenAIChatCompletionsModel
+from AgentsKnowledge.knowledge_index import KnowledgeRetriever
+from .tracing import tracer
 
 DEFAULT_INPUT = "Continue working on the request"
 
+@dataclass
+class FlowRunContext:
+    """
+    Per-run state handed to the Runner, the Agent itself is built once and shared by every run
+    """
+    instructions: str
+
+def _run_instructions(run_context: RunContextWrapper[FlowRunContext], agent: Agent) -> str:
+    return run_context.context.instructions
+
+class SharedAgent:
+    """
+    Agent scaffolding shared by every agent of the same template. It is built on first run, so loading the
+    configuration needs no client nor credentials, and built again once configure_client replaced the client.
+    """
+
+    def __init__(self, name: str, model: str, tools: List[Tool]):
+        self.name = name
+        self.model = model
+        self.tools = tools
+        self._agent: Agent | None = None
+
+    def get(self) -> Agent:
+        """
+        @return: the agent scaffolding with the shared model and client, its instructions are read from the run context
+        """
+        model = get_model(self.model)
+        if self._agent is None or self._agent.model is not model:
+            self._agent = Agent(name=self.name, instructions=_run_instructions, model=model, tools=self.tools)
+        return self._agent
+
+async def _as_stream(text: str) -> AsyncIterator[str]:
+    yield text
+
 class FlowAgent():
 
     def __init__(self, 
                  name : str, 
                  model : str = "openai/gpt-4o-mini", 
                  system_prompt : str = "", 
-                 tools : List[Tool] = [], 
-                 output_method : OutputMethod = ConsoleOutputMethod()):
+                 tools : List[Tool] | None = None, 
+                 output_method : OutputMethod | None = None,
+                 context_size : int | None = None,
+                 stream : bool = False,
+                 response_cache : ResponseCache | None = None,
+                 knowledge : KnowledgeRetriever | None = None,
+                 packer : RelevancePacker | None = None,
+                 prefix : FlowPrefix | None = None,
+                 agent : SharedAgent | None = None):
         """
         Initialize the flow agent
         @param name: the name of the agent
         @param model: the model to use
         @param system_prompt: the system prompt to use
         @param tools: the tools to use
+        @param output_method: where the responses are output, defaults to the console
+        @param context_size: the max context of the model, defaults to the known context of the model
+        @param stream: outputs the response token by token while it is generated
+        @param response_cache: answers identical calls without reaching the model, None to always call it
+        @param knowledge: retrieves the knowledge relevant to each request, it is never stored in the chat flow
+        @param packer: sends only the messages relevant to each request instead of the whole chat flow
+        @param prefix: the developer messages compiled by an agent template, used instead of adding the system prompt
+        @param agent: the agent scaffolding shared by the agents of the same template, None for one of its own
         """
         self.name = name
-        self.tools = tools
+        self.knowledge = knowledge
+        self.stream = stream
+        self.response_cache = response_cache
+        self.tools = tools if tools is not None else []
         self.model = model
-        self.chat_flow_manager = ChatFlowManager()  
-        self.add_developer_message(message=system_prompt)
-        self.output_method = output_method
+        self.chat_flow_manager = ChatFlowManager(max_context_size=context_size or Utils.get_context_size(model), packer=packer,
+                                                 prefix=prefix, name=name)
+        # only the instructions change between runs, so it can be shared
+        self._agent = agent if agent is not None else SharedAgent(name, model, self.tools)
+        if prefix is None:
+            self.add_developer_message(message=system_prompt)
+        self.output_method = output_method if output_method is not None else ConsoleOutputMethod()
         self.output_method.output(f"Agent {self.name} initialized")
 
     def add_user_message(self, importance : int, message : str):
@@ -55,35 +118,98 @@ class FlowAgent():
         """
         self.chat_flow_manager.add_message(ImportanceResponse(importance=importance, message=message))
 
+    def get_agent(self) -> Agent:
+        """
+        @return: the agent scaffolding, built on first use with the shared model and client
+        """
+        return self._agent.get()
+
     async def run(self, importance_request : ImportanceRequest) -> ImportanceResponse:
         """
         Runs the agent
         @param input: the input of the agent
         """
-        
-        instructions = self.chat_flow_manager.serialize()
-
-        if not isClientLoaded():
-            load_client()
-        agent = Agent(
-            name=self.name,
-            instructions=instructions,
-            model=OpenAIChatCompletionsModel(
-                model=self.model,
-                openai_client=get_client()
-            ),
-            tools=self.tools,
-        )
-        
+        with tracer.span("agent.run", agent=self.name, model=self.model) as span:
+            response = await self._run(importance_request)
+            span.set(context_tokens=self.chat_flow_manager.get_total_token_size())
+        return response
+
+    async def _run(self, importance_request : ImportanceRequest) -> ImportanceResponse:
         if(importance_request.message is None):
             importance_request.message = DEFAULT_INPUT
+
+        with tracer.span("chat_flow.serialize", context_tokens=self.chat_flow_manager.get_total_token_size()):
+            instructions = self.chat_flow_manager.pack(importance_request.message) # the whole chat flow unless packing
+
+        if self.knowledge is not None: # only the chunks relevant to this request, so eviction never drops them
+            instructions = "\n".join([instructions, *map(str, self.knowledge.retrieve(importance_request.message))])
         
         self.chat_flow_manager.add_message(importance_request)
-        result = await Runner.run(agent, importance_request.message)
-        response = ImportanceResponse(message=result.final_output)
-        self.output_method.output(f"{self.name}: {response.message}")
+        context = FlowRunContext(instructions=instructions)
+        response = ImportanceResponse(message=await self._respond(importance_request.message, context))
 
         self.chat_flow_manager.add_message(response)
         return response
 
+    async def _respond(self, message : str, context : FlowRunContext) -> str:
+        """
+        Gets the response from the cache if enabled, from the model otherwise, and outputs it
+        @param message: the input of the agent
+        @param context: the run context
+        @return: the complete response
+        """
+        if self.response_cache is None:
+            return await self._complete(message, context)
+
+        key = self.response_cache.make_key(self.model, context.instructions, message, self.tools)
+        output, computed = await self.response_cache.get_or_compute(key, lambda: self._complete(message, context))
+        if not computed:
+            # cached or coalesced: replayed through the same output path as a fresh response
+            if self.stream:
+                await self._output_stream(_as_stream(output))
+            else:
+                self.output_method.output_message(self.name, "assistant", output)
+        return output
+
+    async def _complete(self, message : str, context : FlowRunContext) -> str:
+        """
+        Calls the model and outputs the response, streamed chunk by chunk in stream mode
+        @param message: the input of the agent
+        @param context: the run context
+        @return: the complete response
+        """
+        with tracer.span("llm.call", stream=self.stream) as span:
+            if self.stream:
+                result = Runner.run_streamed(self.get_agent(), message, context=context)
+                await self._output_stream(self._text_deltas(result))
+            else:
+                result = await Runner.run(self.get_agent(), message, context=context)
+                self.output_method.output_message(self.name, "assistant", result.final_output)
+            usage = getattr(getattr(result, "context_wrapper", None), "usage", None) # token counts reported by the model
+            if usage is not None:
+                span.set(prompt_tokens=usage.input_tokens, completion_tokens=usage.output_tokens)
+        return result.final_output
+
+    async def _output_stream(self, chunks : AsyncIterator[str]):
+        """
+        Outputs each chunk of a streamed response as soon as it arrives
+        @param chunks: the chunks of the response
+        """
+        self.output_method.start_stream(self.name, "assistant")
+        try:
+            async for chunk in chunks:
+                self.output_method.output_chunk(chunk)
+        finally:
+            self.output_method.end_stream()
+
+    @staticmethod
+    async def _text_deltas(result : RunResultStreaming):
+        """
+        @param result: the streamed run
+        @return: an async iterator over the text chunks of the response
+        """
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                yield event.data.delta
+
         
@@ -1,10 +1,20 @@
-from typing import List
+from typing import List, Callable
 from agents import Tool
-from .flow_agent import FlowAgent
+import asyncio
+from .flow_agent import FlowAgent, SharedAgent
 from .conversation_flow.importance_message import ImportanceRequest, ImportanceResponse
-from IOMethods.output_methods import OutputMethod, ConsoleOutputMethod
+from IOMethods.output_methods import OutputMethod
 
 from .handoff_utility import HandoffManager
+from .handoff_scheduler import HandoffScheduler, ScheduledTask, COMPLETED
+from .handoff_parser import HandoffParser
+from .response_cache import ResponseCache
+from AgentsKnowledge.knowledge_index import KnowledgeRetriever
+from .conversation_flow.relevance_packer import RelevancePacker
+from .conversation_flow.flow_prefix import FlowPrefix
+from typing import AsyncIterator
+
+REENTRY_IMPORTANCE = 10 # importance of the request that wakes an agent when handoff results land
 
 class HandoffAgent(FlowAgent):
     def __init__(
@@ -14,44 +24,183 @@ class HandoffAgent(FlowAgent):
         system_prompt: str = (
             "You are a handoff agent with a set of subagents you can delegate tasks to"
         ),
-        tools: List[Tool] = [],
-        output_method: OutputMethod = ConsoleOutputMethod()
+        tools: List[Tool] | None = None,
+        output_method: OutputMethod | None = None,
+        context_size: int | None = None,
+        stream: bool = False,
+        response_cache: ResponseCache | None = None,
+        knowledge: KnowledgeRetriever | None = None,
+        packer: RelevancePacker | None = None,
+        reentry: bool = False,
+        reentry_debounce: float = 0.0,
+        prefix: FlowPrefix | None = None,
+        agent: SharedAgent | None = None
     ):
+        """
+        @param reentry: wakes the agent for a new turn as soon as handoff results land, instead of waiting for the next input
+        @param reentry_debounce: seconds without new results to wait before waking, so results landing together are folded into one turn
+        """
+
         super().__init__(
             name=name,
             model=model,
             system_prompt=system_prompt,
             tools=tools,
-            output_method=output_method
+            output_method=output_method,
+            context_size=context_size,
+            stream=stream,
+            response_cache=response_cache,
+            knowledge=knowledge,
+            packer=packer,
+            prefix=prefix,
+            agent=agent
         )
         self.handoff_manager = None
         self.subagents = []
+        self.reentry = reentry
+        self.reentry_debounce = reentry_debounce
+        self.reentry_listener: Callable[[FlowAgent, ImportanceResponse], None] | None = None # set by the parent HandoffManager
+        self.run_lock = asyncio.Lock() # serializes turns started by the user and by re-entry
+        self._reentry_task: asyncio.Task | None = None
+        self._reentry_job: ScheduledTask | None = None # the re-entry turn submitted to the scheduler
+        self._last_result_at = 0.0
 
 
-    async def run(self, importance_request: ImportanceRequest) -> ImportanceResponse:
+    async def _run(self, importance_request: ImportanceRequest) -> ImportanceResponse:
+        self.handoff_manager.redispatch_interrupted() # tasks restored from a session that were still in flight
         self.handoff_manager.check_completed_tasks()
-        response = await super().run(importance_request)
+        response = await super()._run(importance_request)
 
         clean_message, handoffs = self.handoff_manager.extract_handoffs(response.message)
         response.message = clean_message
 
+        if not self.stream: # while streaming, handoffs were already dispatched as soon as they closed
+            for handoff_data in handoffs:
+                self.handoff_manager.start_handoff(handoff_data)
+
+        return response
+
+    async def _output_stream(self, chunks: AsyncIterator[str]):
+        """
+        Streams the response without the handoff objects, each handoff starts as soon as its JSON closes
+        @param chunks: the chunks of the response
+        """
+        parser = HandoffParser()
+        self.output_method.start_stream(self.name, "assistant")
+        try:
+            async for chunk in chunks:
+                self._output_and_dispatch(*parser.feed(chunk))
+            self._output_and_dispatch(*parser.close())
+        finally:
+            self.output_method.end_stream()
+
+    def _output_and_dispatch(self, text: str, handoffs: List[dict]):
+        if text:
+            self.output_method.output_chunk(text)
         for handoff_data in handoffs:
             self.handoff_manager.start_handoff(handoff_data)
 
+    def notify_handoff_result(self):
+        """
+        Called by the HandoffManager when a handoff result lands, wakes the agent if re-entry is enabled
+        """
+        if not self.reentry:
+            return
+        loop = asyncio.get_running_loop()
+        self._last_result_at = loop.time()
+        if self._reentry_task is None or self._reentry_task.done():
+            self._reentry_task = loop.create_task(self._reenter_when_ready())
+
+    def is_reentering(self) -> bool:
+        """
+        @return: True while a re-entry is waiting for results to settle or running
+        """
+        return self._reentry_task is not None and not self._reentry_task.done()
+
+    def has_background_work(self) -> bool:
+        """
+        @return: True while this agent or one of its subagents has delegated tasks in flight or is re-entering,
+        the scheduler may be shared with other trees so its own tasks are not enough
+        """
+        return (bool(self.handoff_manager.pending_tasks) or self.is_reentering()
+                or any(isinstance(subagent, HandoffAgent) and subagent.has_background_work() for subagent in self.subagents))
+
+    async def _reenter_when_ready(self):
+        loop = asyncio.get_running_loop()
+        while self.handoff_manager.has_results():
+            delay = self._last_result_at + self.reentry_debounce - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay) # debounced: results keep landing, wait until they settle
+                continue
+            # autonomous turns go through the scheduler like delegated ones, under the same limits and timeout
+            done = loop.create_future()
+            self._reentry_job = self.handoff_manager.scheduler.submit(
+                self.name, lambda task: self._reenter_locked(),
+                on_done=lambda task: done.done() or done.set_result(task)
+            )
+            try:
+                if (await done).status != COMPLETED:
+                    break # timed out, failed or cancelled, the results are folded into the next turn
+            finally:
+                self._reentry_job = None
+
+    async def _reenter_locked(self):
+        async with self.run_lock:
+            # the tree may have been dropped meanwhile, and a user turn may have folded the results in
+            if self.reentry and self.handoff_manager.has_results():
+                await self.reenter()
+
+    async def reenter(self) -> ImportanceResponse:
+        """
+        Runs a turn without user input, folding in the handoff results that landed
+        @return: the response of the turn, also handed to the parent agent if any
+        """
+        response = await self.run(ImportanceRequest(importance=REENTRY_IMPORTANCE))
+        if self.reentry_listener is not None:
+            self.reentry_listener(self, response)
         return response
 
-    def set_subagents(self, subagents: List[FlowAgent]):
-        self.handoff_manager = HandoffManager(self, subagents)
-        subagent_list_str = ", ".join([f"'{s.name}'" for s in subagents])
-        self.add_developer_message(
-            message=f"You can delegate tasks to these subagents: {subagent_list_str}"
-        )
-        self.add_developer_message(
-            message=(
+    def set_subagents(self, subagents: List[FlowAgent], scheduler: HandoffScheduler | None = None, describe: bool = True):
+        """
+        @param subagents: the agents tasks can be delegated to
+        @param scheduler: the scheduler bounding the delegated tasks
+        @param describe: adds the handoff instructions to the chat flow, False when its prefix already has them
+        """
+        self.subagents = subagents
+        self.handoff_manager = HandoffManager(self, subagents, scheduler)
+        if describe:
+            for message in self.handoff_instructions([s.name for s in subagents]):
+                self.add_developer_message(message=message)
+
+    @staticmethod
+    def handoff_instructions(subagent_names: List[str]) -> List[str]:
+        """
+        @param subagent_names: the names of the subagents
+        @return: the developer messages telling the agent how to delegate to them
+        """
+        subagent_list_str = ", ".join([f"'{name}'" for name in subagent_names])
+        return [
+            f"You can delegate tasks to these subagents: {subagent_list_str}",
+            (
                 "To delegate a task, include this JSON anywhere in your response: "
                 '{"handoff": {"subagent": "NAME_OF_SUBAGENT", "prompt": "TASK_PROMPT"}}'
-            )
-        )
+            ),
+        ]
+
+    def cancel_background(self):
+        """
+        Cancels the delegated tasks and the re-entry of this agent and of its subagents, when the tree is dropped
+        """
+        self.reentry = False # results of the cancelled tasks land later, they must not wake the agent
+        for subagent in self.subagents:
+            if isinstance(subagent, HandoffAgent):
+                subagent.cancel_background()
+        for task_id in list(self.handoff_manager.pending_tasks):
+            self.handoff_manager.cancel_handoff(task_id)
+        if self._reentry_job is not None: # cancelling the waiting task alone leaves the submitted turn to run
+            self.handoff_manager.scheduler.cancel(self._reentry_job.task_id)
+        if self._reentry_task is not None:
+            self._reentry_task.cancel()
 
     def get_subagents(self):
         return self.subagents
@@ -0,0 +1,250 @@
+from typing import List, Dict, Tuple
+import json
+import re
+
+HANDOFF_PREFIX = '{"handoff"'
+WHITESPACE = " \t\n\r"
+TOKEN_CHARACTERS = frozenset("0123456789+-.eEtrufalsn")
+TOKEN_PATTERN = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+ESCAPES = frozenset('"\\/bfnrtu')
+
+# what the JSON validator expects next outside of strings and tokens
+VALUE, VALUE_OR_END, KEY, KEY_OR_END, COLON, COMMA_OR_END = range(6)
+
+class HandoffParser:
+    """
+    Incremental single-pass parser that splits a response into clean text and handoffs.
+    Text is fed in chunks as it is generated, each handoff is emitted as soon as its JSON object closes.
+    Every character is read once: the objects starting with {"handoff" nested in each other share one JSON
+    validator, an object is only parsed with json.loads once known to be valid and not nested in a handoff.
+    """
+
+    def __init__(self):
+        self.handoffs: List[Dict[str, str]] = []
+        self._clean: List[str] = [] # clean text emitted so far
+        self._position = 0 # characters read
+        self._index = 0 # position of the character being read
+        self._emitted = 0 # position up to which the text was emitted, the rest is held
+        self._held: List[str] = [] # text read since the emitted position, before the current chunk
+        self._prefix_start: int | None = None # position of the { matching HANDOFF_PREFIX so far
+        self._prefix_length = 0
+        self._prefix_depth = 0 # depth of the validator before that {
+        self._candidates: List[List] = [] # open objects starting with HANDOFF_PREFIX: [start, depth, first value character]
+        self._valid: List[Tuple[int, int]] = [] # (start, end) of the closed handoff objects not emitted yet
+        # JSON validator of the outermost candidate, the nested ones start at one of its values so they share it
+        self._containers: List[str] = []
+        self._expect = VALUE
+        self._string: int | None = None # KEY or VALUE while in a string
+        self._escape = 0 # 1 after a backslash, 2 to 5 while reading the hex digits of \u
+        self._token: List[str] | None = None # literal or number being read
+
+    def feed(self, chunk: str) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Parses the next chunk of the response
+        @param chunk: the chunk to parse
+        @return: the clean text that can be output and the handoffs closed by this chunk
+        """
+        text = []
+        handoffs = []
+        base = self._position
+        i = 0
+        while i < len(chunk):
+            if not self._candidates and self._prefix_start is None:
+                start = chunk.find("{", i)
+                if start == -1:
+                    break
+                i = start
+            self._read(chunk[i], base + i)
+            i += 1
+        self._position = base + len(chunk)
+        self._held.append(chunk[max(0, self._emitted - base):])
+        held_start = self._held_start()
+        self._flush(self._position if held_start is None else held_start, text, handoffs)
+        return self._emit(text, handoffs)
+
+    def close(self) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Ends the response, an object left open is not a handoff and is kept as text
+        @return: the remaining clean text and the handoffs found in it
+        """
+        text = []
+        handoffs = []
+        self._candidates.clear()
+        self._prefix_start = None
+        self._flush(self._position, text, handoffs)
+        return self._emit(text, handoffs)
+
+    def get_cleaned_message(self) -> str:
+        """
+        @return: the response without the handoff objects, whitespace is collapsed if any handoff was removed
+        """
+        cleaned_message = "".join(self._clean)
+        if self.handoffs:
+            return re.sub(r'\s+', ' ', cleaned_message.strip())
+        return cleaned_message
+
+    def _emit(self, text: List[str], handoffs: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+        clean_text = "".join(text)
+        self._clean.append(clean_text)
+        self.handoffs.extend(handoffs)
+        return clean_text, handoffs
+
+    def _held_start(self) -> int | None:
+        if self._candidates:
+            return self._candidates[0][0]
+        return self._prefix_start
+
+    def _read(self, char: str, position: int):
+        """
+        Reads one character: validates it for the open candidates, then matches it against HANDOFF_PREFIX
+        """
+        self._index = position
+        if self._candidates and not self._validate(char):
+            self._candidates.clear() # the error is inside every open candidate, none of them is a handoff
+
+        if self._prefix_start is not None:
+            if char == HANDOFF_PREFIX[self._prefix_length]:
+                self._prefix_length += 1
+                if self._prefix_length == len(HANDOFF_PREFIX):
+                    self._open_candidate()
+                return
+            self._prefix_start = None
+        if char == "{":
+            self._prefix_start = position
+            self._prefix_length = 1
+            self._prefix_depth = len(self._containers) - 1 if self._candidates else 0
+
+    def _open_candidate(self):
+        start = self._prefix_start
+        self._prefix_start = None
+        if self._candidates: # nested in a value of the open candidates, the validator already read the prefix
+            self._candidates.append([start, self._prefix_depth, None])
+            return
+        # outermost candidate, possibly after an error in the same prefix, the validator starts on the prefix
+        self._candidates.append([start, 0, None])
+        self._containers.clear()
+        self._expect = VALUE
+        self._string = None
+        self._escape = 0
+        self._token = None
+        for char in HANDOFF_PREFIX:
+            self._validate(char)
+
+    def _validate(self, char: str) -> bool:
+        """
+        Advances the JSON validator by one character, closing the candidates whose object ends
+        @return: False if the character makes the JSON invalid
+        """
+        if self._string is not None:
+            if self._escape == 1:
+                if char not in ESCAPES:
+                    return False
+                self._escape = 2 if char == "u" else 0
+            elif self._escape:
+                if char not in HEX_DIGITS:
+                    return False
+                self._escape = 0 if self._escape == 5 else self._escape + 1
+            elif char == "\\":
+                self._escape = 1
+            elif char == '"':
+                if self._string == KEY:
+                    self._expect = COLON
+                else:
+                    self._end_value()
+                self._string = None
+            elif char < " ":
+                return False # control characters must be escaped
+            return True
+
+        if self._token is not None:
+            if char in TOKEN_CHARACTERS:
+                self._token.append(char)
+                return True
+            token = "".join(self._token)
+            self._token = None
+            if not TOKEN_PATTERN.fullmatch(token):
+                return False
+            self._end_value()
+
+        if char in WHITESPACE:
+            return True
+        expect = self._expect
+        if expect == VALUE or expect == VALUE_OR_END:
+            if expect == VALUE_OR_END and char == "]":
+                return self._end_container("[")
+            candidate = self._candidates[-1]
+            if candidate[2] is None and len(self._containers) == candidate[1] + 1:
+                candidate[2] = char # the value of the handoff key
+            if char == "{":
+                self._containers.append("{")
+                self._expect = KEY_OR_END
+            elif char == "[":
+                self._containers.append("[")
+                self._expect = VALUE_OR_END
+            elif char == '"':
+                self._string = VALUE
+            elif char in TOKEN_CHARACTERS:
+                self._token = [char]
+            else:
+                return False
+            return True
+        if expect == KEY or expect == KEY_OR_END:
+            if char == '"':
+                self._string = KEY
+                return True
+            return expect == KEY_OR_END and char == "}" and self._end_container("{")
+        if expect == COLON:
+            if char == ":":
+                self._expect = VALUE
+                return True
+            return False
+        if char == ",":
+            self._expect = KEY if self._containers[-1] == "{" else VALUE
+            return True
+        return char in "}]" and self._end_container("{" if char == "}" else "[")
+
+    def _end_container(self, container: str) -> bool:
+        if self._containers[-1] != container:
+            return False
+        self._containers.pop()
+        candidate = self._candidates[-1]
+        if len(self._containers) == candidate[1]:
+            self._candidates.pop()
+            start = candidate[0]
+            if candidate[2] == "{": # a handoff unless a duplicated handoff key replaces it, checked when emitted
+                while self._valid and self._valid[-1][0] > start: # nested in this handoff, which wins
+                    self._valid.pop()
+                self._valid.append((start, self._index + 1))
+        self._end_value()
+        return True
+
+    def _end_value(self):
+        self._expect = COMMA_OR_END
+
+    def _flush(self, end: int, text: List[str], handoffs: List[Dict[str, str]]):
+        """
+        Emits the held text up to end, without the handoffs closed in it
+        """
+        if end <= self._emitted:
+            return
+        held = "".join(self._held)
+        offset = self._emitted
+        cursor = 0
+        emitted = 0
+        for start, stop in self._valid:
+            if stop > end:
+                break
+            emitted += 1
+            try:
+                data = json.loads(held[start - offset:stop - offset])
+            except (json.JSONDecodeError, RecursionError): # too deeply nested for the decoder, kept as text
+                continue
+            if isinstance(data.get("handoff"), dict):
+                text.append(held[cursor:start - offset])
+                handoffs.append(data["handoff"])
+                cursor = stop - offset
+        text.append(held[cursor:end - offset])
+        del self._valid[:emitted]
+        self._held = [held[end - offset:]] if end - offset < len(held) else []
+        self._emitted = end
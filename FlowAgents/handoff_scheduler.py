@@ -0,0 +1,228 @@
+from typing import Callable, Awaitable, Dict, Any
+from itertools import count
+import asyncio
+import heapq
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+
+class ScheduledTask:
+    """
+    A delegated task waiting in the scheduler queue or running
+    """
+
+    def __init__(self, task_id: str, subagent: str, priority: int, factory: Callable[["ScheduledTask"], Awaitable[Any]],
+                 deadline: float | None, on_done: Callable[["ScheduledTask"], None] | None):
+        self.task_id = task_id
+        self.subagent = subagent
+        self.priority = priority
+        self.factory = factory # builds the coroutine of the task once it starts
+        self.deadline = deadline # loop time after which the task is timed out, queue time included
+        self.on_done = on_done
+        self.status = QUEUED
+        self.result = None
+        self.error: BaseException | None = None
+        self.submitted_at = time.monotonic()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self.timer: asyncio.TimerHandle | None = None
+
+    def is_done(self) -> bool:
+        return self.status not in (QUEUED, RUNNING)
+
+class HandoffScheduler:
+    """
+    Bounded scheduler for delegated tasks: a priority queue (higher priority first, then FIFO) drained
+    under a global and a per-subagent concurrency limit, with deadlines, cancellation and unique task ids.
+    A single scheduler can be shared by every HandoffManager of a tree to bound the whole tree.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_concurrency_per_subagent: int = 2, timeout: float | None = None):
+        """
+        @param max_concurrency: max tasks running at once
+        @param max_concurrency_per_subagent: max tasks running at once on the same subagent
+        @param timeout: default seconds a task may take from submission, None for no deadline
+        """
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_subagent = max_concurrency_per_subagent
+        self.timeout = timeout
+        self.subagent_limits: Dict[str, int] = {} # subagent name -> concurrency limit overriding the default
+        self.subagent_timeouts: Dict[str, float] = {} # subagent name -> timeout overriding the default
+        self.tasks: Dict[str, ScheduledTask] = {} # task id -> queued or running task
+        self._queue = [] # heap of (-priority, sequence number, task)
+        self._sequence = count()
+        self._ids = count(1)
+        self._running = 0
+        self._running_per_subagent: Dict[str, int] = {}
+        self._stats = {status: 0 for status in (COMPLETED, FAILED, TIMED_OUT, CANCELLED)}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._run_time_total = 0.0
+        self._run_time_max = 0.0
+        self._started = 0
+
+    def set_subagent_limit(self, subagent: str, max_concurrency: int | None = None, timeout: float | None = None):
+        """
+        Overrides the concurrency limit and the timeout of a subagent
+        @param subagent: the subagent name
+        @param max_concurrency: max tasks running at once on the subagent
+        @param timeout: seconds a task of the subagent may take from submission
+        """
+        if max_concurrency is not None:
+            self.subagent_limits[subagent] = max_concurrency
+        if timeout is not None:
+            self.subagent_timeouts[subagent] = timeout
+
+    def submit(self, subagent: str, factory: Callable[[ScheduledTask], Awaitable[Any]], priority: int = 0,
+               timeout: float | None = None, on_done: Callable[[ScheduledTask], None] | None = None) -> ScheduledTask:
+        """
+        Queues a task, it starts as soon as the concurrency limits allow it
+        @param subagent: the name of the subagent running the task
+        @param factory: builds the coroutine of the task, it receives the task
+        @param priority: higher priorities start first
+        @param timeout: seconds the task may take from now, defaults to the subagent or scheduler timeout
+        @param on_done: called with the task once it completed, failed, timed out or was cancelled
+        @return: the scheduled task
+        """
+        loop = asyncio.get_running_loop()
+        if timeout is None:
+            timeout = self.subagent_timeouts.get(subagent, self.timeout)
+        deadline = None if timeout is None else loop.time() + timeout
+        task = ScheduledTask(self.new_task_id(), subagent, priority, factory, deadline, on_done)
+        self.tasks[task.task_id] = task
+        heapq.heappush(self._queue, (-priority, next(self._sequence), task))
+        if deadline is not None:
+            task.timer = loop.call_at(deadline, self._expire, task)
+        self._pump()
+        return task
+
+    def new_task_id(self) -> str:
+        """
+        @return: an id never returned before by this scheduler
+        """
+        return f"task_{next(self._ids)}"
+
+    def advance_task_ids(self, task_ids):
+        """
+        Makes sure new ids never collide with ids issued before a restart
+        @param task_ids: ids issued by a previous scheduler
+        """
+        numbers = [int(task_id[5:]) for task_id in task_ids if task_id.startswith("task_") and task_id[5:].isdigit()]
+        if numbers:
+            self._ids = count(max(max(numbers) + 1, next(self._ids)))
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a queued or running task
+        @param task_id: the id of the task
+        @return: True if the task was cancelled, False if it was unknown or already done
+        """
+        task = self.tasks.get(task_id)
+        if task is None or task.is_done():
+            return False
+        if task.status == RUNNING:
+            task.task.cancel() # _run records the cancellation
+        else:
+            self._finish(task, CANCELLED) # its queue entry is skipped lazily
+        return True
+
+    def _expire(self, task: ScheduledTask):
+        if task.status == QUEUED:
+            self._finish(task, TIMED_OUT)
+
+    def _limit(self, subagent: str) -> int:
+        return self.subagent_limits.get(subagent, self.max_concurrency_per_subagent)
+
+    def _pump(self):
+        """
+        Starts queued tasks by priority while there is capacity, tasks of saturated subagents keep their place
+        """
+        blocked = []
+        while self._queue and self._running < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            task = entry[2]
+            if task.status != QUEUED:
+                continue
+            if self._running_per_subagent.get(task.subagent, 0) >= self._limit(task.subagent):
+                blocked.append(entry)
+                continue
+            self._start(task)
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+    def _start(self, task: ScheduledTask):
+        if task.timer is not None:
+            task.timer.cancel()
+        task.status = RUNNING
+        task.started_at = time.monotonic()
+        queue_wait = task.started_at - task.submitted_at
+        self._started += 1
+        self._queue_wait_total += queue_wait
+        self._queue_wait_max = max(self._queue_wait_max, queue_wait)
+        self._running += 1
+        self._running_per_subagent[task.subagent] = self._running_per_subagent.get(task.subagent, 0) + 1
+        task.task = asyncio.create_task(self._run(task))
+        task.task.add_done_callback(lambda _, task=task: self._cancelled_before_run(task))
+
+    def _cancelled_before_run(self, task: ScheduledTask):
+        """
+        A task cancelled right after it started never enters _run, its slot is released here instead
+        """
+        if task.status != RUNNING:
+            return # finished by _run
+        self._running -= 1
+        self._running_per_subagent[task.subagent] -= 1
+        self._finish(task, CANCELLED)
+        self._pump()
+
+    async def _run(self, task: ScheduledTask):
+        loop = asyncio.get_running_loop()
+        remaining = None if task.deadline is None else max(0.0, task.deadline - loop.time())
+        try:
+            task.result = await asyncio.wait_for(task.factory(task), remaining)
+            status = COMPLETED
+        except asyncio.TimeoutError:
+            status = TIMED_OUT
+        except asyncio.CancelledError:
+            status = CANCELLED
+        except Exception as e:
+            task.error = e
+            status = FAILED
+        run_time = time.monotonic() - task.started_at
+        self._run_time_total += run_time
+        self._run_time_max = max(self._run_time_max, run_time)
+        self._running -= 1
+        self._running_per_subagent[task.subagent] -= 1
+        self._finish(task, status)
+        self._pump()
+
+    def _finish(self, task: ScheduledTask, status: str):
+        if task.timer is not None:
+            task.timer.cancel()
+        task.status = status
+        task.finished_at = time.monotonic()
+        self._stats[status] += 1
+        self.tasks.pop(task.task_id, None)
+        if task.on_done is not None:
+            task.on_done(task)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        @return: task counters and queue-wait / run-time statistics in seconds
+        """
+        finished_runs = self._started - self._running
+        return {
+            "queued": sum(1 for task in self.tasks.values() if task.status == QUEUED),
+            "running": self._running,
+            **self._stats,
+            "avg_queue_wait": self._queue_wait_total / self._started if self._started else 0.0,
+            "max_queue_wait": self._queue_wait_max,
+            "avg_run_time": self._run_time_total / finished_runs if finished_runs else 0.0,
+            "max_run_time": self._run_time_max,
+        }
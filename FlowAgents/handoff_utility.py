@@ -1,81 +1,118 @@
-from typing import List, Dict, Any, Tuple
-import json
-import re
+from typing import List, Dict, Any, Tuple, Callable
 import asyncio
 
 from .flow_agent import FlowAgent
+from .handoff_parser import HandoffParser
+from .handoff_scheduler import HandoffScheduler, ScheduledTask, TIMED_OUT, CANCELLED
 from .conversation_flow.importance_message import ImportanceRequest, ImportanceResponse
+from .tracing import tracer, Span
 
 class HandoffManager:
-    def __init__(self, parent_agent: FlowAgent, subagents: List[FlowAgent]):
+    def __init__(self, parent_agent: FlowAgent, subagents: List[FlowAgent], scheduler: HandoffScheduler | None = None):
+        """
+        @param parent_agent: the agent delegating the tasks
+        @param subagents: the agents tasks can be delegated to
+        @param scheduler: the scheduler bounding the delegated tasks, share one to bound a whole tree
+        """
         self.parent_agent = parent_agent
         self.subagents = subagents
+        self.scheduler = scheduler or HandoffScheduler()
         self.pending_tasks: Dict[str, Dict[str, Any]] = {}
         self.handoff_results: Dict[str, Dict[str, Any]] = {}
+        self.interrupted: List[Dict[str, Any]] = [] # restored tasks that were in flight, dispatched again
+        self.journal: Callable[[dict], None] | None = None # called with every change, to persist the handoffs
+        self.observers: List[Callable[[dict], None]] = [] # also called with every change, e.g. by the debugger
+        for subagent in subagents:
+            if hasattr(subagent, "reentry_listener"):
+                subagent.reentry_listener = self._on_subagent_reentry
 
     def extract_handoffs(self, message: str) -> Tuple[str, List[Dict[str, str]]]:
-        handoffs = []
-        positions = []
-        i = 0
-        while i < len(message):
-            possible_start = message[i:i+10].find('{"handoff"')
-            if possible_start != -1:
-                start = message.find('{"handoff"', i)
-                if start == -1:
-                    break
-
-                brace_count = 0
-                found_valid = False
-                for j in range(start, len(message)):
-                    if message[j] == '{':
-                        brace_count += 1
-                    elif message[j] == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            json_str = message[start:j+1]
-                            try:
-                                data = json.loads(json_str)
-                                if "handoff" in data and isinstance(data["handoff"], dict):
-                                    handoffs.append(data["handoff"])
-                                    positions.append((start, j+1))
-                                    found_valid = True
-                            except json.JSONDecodeError:
-                                pass
-                            break
-                i = j + 1 if found_valid else start + 1
-            else:
-                i += 1
-
-        if positions:
-            cleaned_message = ""
-            last_end = 0
-            for start, end in sorted(positions):
-                cleaned_message += message[last_end:start]
-                last_end = end
-            cleaned_message += message[last_end:]
-            cleaned_message = re.sub(r'\s+', ' ', cleaned_message.strip())
-        else:
-            cleaned_message = message
-
-        return cleaned_message, handoffs
+        with tracer.span("handoff.extract", characters=len(message)) as span:
+            parser = HandoffParser()
+            parser.feed(message)
+            parser.close()
+            span.set(handoffs=len(parser.handoffs))
+        return parser.get_cleaned_message(), parser.handoffs
 
     async def execute_handoff(self, task_id: str, subagent: FlowAgent, prompt: str) -> None:
         try:
-            result = await subagent.run(ImportanceRequest(importance=10, message=prompt))
-            self.handoff_results[task_id] = {
+            run_lock = getattr(subagent, "run_lock", None)
+            if run_lock is None:
+                result = await subagent.run(ImportanceRequest(importance=10, message=prompt))
+            else:
+                async with run_lock: # never interleaved with a re-entry turn on the same chat flow
+                    result = await subagent.run(ImportanceRequest(importance=10, message=prompt))
+            self._add_result(task_id, {
                 "subagent": subagent.name,
                 "result": result.message,
                 "status": "completed"
-            }
+            })
         except Exception as e:
-            self.handoff_results[task_id] = {
+            self._add_result(task_id, {
                 "subagent": subagent.name,
                 "result": f"Error: {str(e)}",
                 "status": "failed"
-            }
+            })
         finally:
-            if task_id in self.pending_tasks:
-                del self.pending_tasks[task_id]
+            self._pop_pending(task_id)
+
+    async def _traced_handoff(self, scheduled: ScheduledTask, subagent: FlowAgent, prompt: str, parent: Span | None) -> None:
+        if not tracer.enabled:
+            return await self.execute_handoff(scheduled.task_id, subagent, prompt)
+        with tracer.span("handoff.execute", parent=parent, agent=subagent.name, model=subagent.model, task_id=scheduled.task_id,
+                         delegated_by=self.parent_agent.name, queue_wait=scheduled.started_at - scheduled.submitted_at) as span:
+            await self.execute_handoff(scheduled.task_id, subagent, prompt)
+            span.set(status=self.handoff_results.get(scheduled.task_id, {}).get("status"))
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        if self.journal is not None:
+            self.journal(event)
+        for observer in self.observers:
+            observer(event)
+
+    def _add_result(self, task_id: str, info: Dict[str, Any]) -> None:
+        self.handoff_results[task_id] = info
+        if self.journal is not None or self.observers:
+            self._emit({"op": "result", "task_id": task_id, "info": info})
+
+    def _pop_result(self, task_id: str) -> None:
+        del self.handoff_results[task_id]
+        if self.journal is not None or self.observers:
+            self._emit({"op": "result_consumed", "task_id": task_id})
+
+    def _pop_pending(self, task_id: str) -> None:
+        if self.pending_tasks.pop(task_id, None) is not None and (self.journal is not None or self.observers):
+            self._emit({"op": "handoff_done", "task_id": task_id})
+
+    def _on_task_done(self, task: ScheduledTask) -> None:
+        """
+        Records the tasks interrupted by the scheduler, the others were recorded by execute_handoff
+        """
+        if task.status in (TIMED_OUT, CANCELLED):
+            self._add_result(task.task_id, {
+                "subagent": task.subagent,
+                "result": "Error: timed out" if task.status == TIMED_OUT else "Error: cancelled",
+                "status": "failed"
+            })
+        self._pop_pending(task.task_id)
+        self.parent_agent.notify_handoff_result()
+
+    def _on_subagent_reentry(self, subagent: FlowAgent, response: ImportanceResponse) -> None:
+        """
+        Collects the follow-up response a subagent produced on its own once its own handoffs completed
+        """
+        self._add_result(self.scheduler.new_task_id(), {
+            "subagent": subagent.name,
+            "result": response.message,
+            "status": "completed"
+        })
+        self.parent_agent.notify_handoff_result()
+
+    def has_results(self) -> bool:
+        """
+        @return: True if some handoff results were not folded into the parent yet
+        """
+        return len(self.handoff_results) > 0
 
     def start_handoff(self, handoff: Dict[str, str]) -> None:
         subagent_name = handoff.get("subagent")
@@ -104,27 +141,52 @@ class HandoffManager:
             )
             return
 
-        task_id = f"task_{len(self.pending_tasks) + len(self.handoff_results) + 1}"
         self.parent_agent.add_system_message(
             importance=2,
             message=f"Task successfully delegated to {subagent_name}: \"{prompt[:50]}...\""
         )
-        
-        task = asyncio.create_task(
-            self.execute_handoff(task_id, subagent, prompt)
+
+        self._submit(subagent, prompt, self._get_priority(handoff))
+
+    def _submit(self, subagent: FlowAgent, prompt: str, priority: int) -> None:
+        parent = tracer.current() # the task may start from another task, its span nests in the turn delegating it
+        task = self.scheduler.submit(
+            subagent.name,
+            lambda scheduled: self._traced_handoff(scheduled, subagent, prompt, parent),
+            priority=priority,
+            on_done=self._on_task_done
         )
 
-        self.pending_tasks[task_id] = {
-            "task": task,
-            "subagent": subagent_name,
-            "prompt": prompt
-        }
+        if not task.is_done():
+            self.pending_tasks[task.task_id] = {
+                "task": task,
+                "subagent": subagent.name,
+                "prompt": prompt,
+                "priority": priority
+            }
+            if self.journal is not None or self.observers:
+                self._emit({"op": "handoff", "task_id": task.task_id, "subagent": subagent.name, "prompt": prompt, "priority": priority})
+
+    @staticmethod
+    def _get_priority(handoff: Dict[str, Any]) -> int:
+        try:
+            return int(handoff.get("priority", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def cancel_handoff(self, task_id: str) -> bool:
+        """
+        Cancels a queued or running delegated task
+        @param task_id: the id of the task
+        @return: True if the task was cancelled
+        """
+        return task_id in self.pending_tasks and self.scheduler.cancel(task_id)
 
     def check_completed_tasks(self) -> None:
         if self.pending_tasks:
             pending_msg = "Currently processing:\n"
             for info in self.pending_tasks.values():
-                pending_msg += f"- Task for {info['subagent']}: \"{info['prompt'][:30]}...\"\n"
+                pending_msg += f"- Task for {info['subagent']} ({info['task'].status}): \"{info['prompt'][:30]}...\"\n"
             self.parent_agent.add_system_message(importance=1, message=pending_msg)
 
         for task_id, info in list(self.handoff_results.items()):
@@ -139,7 +201,67 @@ class HandoffManager:
                         f"Task for {info['subagent']} failed: {info['result']}"
                     )
                 )
-            del self.handoff_results[task_id]
+            self._pop_result(task_id)
+
+    def dump_state(self) -> Dict[str, Any]:
+        """
+        @return: a JSON-serializable snapshot of the tasks in flight and of the results not folded yet
+        """
+        pending = {
+            task_id: {"subagent": info["subagent"], "prompt": info["prompt"], "priority": info.get("priority", 0)}
+            for task_id, info in self.pending_tasks.items()
+        }
+        for info in self.interrupted: # not dispatched again yet, still in flight for the next restart
+            pending[info["task_id"]] = {"subagent": info["subagent"], "prompt": info["prompt"], "priority": info["priority"]}
+        return {"pending": pending, "results": dict(self.handoff_results)}
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restores a snapshot from dump_state, the tasks that were in flight are marked for re-dispatch
+        @param state: the snapshot
+        """
+        self.handoff_results = dict(state["results"])
+        self.interrupted = [{"task_id": task_id, **info} for task_id, info in state["pending"].items()]
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """
+        Replays one journaled change on a restored state
+        @param event: the change passed to the journal
+        """
+        op = event["op"]
+        if op == "handoff":
+            self.interrupted.append({key: event[key] for key in ("task_id", "subagent", "prompt", "priority")})
+        elif op == "handoff_done":
+            self.interrupted = [info for info in self.interrupted if info["task_id"] != event["task_id"]]
+        elif op == "result":
+            self.handoff_results[event["task_id"]] = event["info"]
+        elif op == "result_consumed":
+            self.handoff_results.pop(event["task_id"], None)
+
+    def redispatch_interrupted(self) -> None:
+        """
+        Dispatches again the restored tasks that were in flight, once an event loop runs
+        """
+        if not self.interrupted:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return # dispatched by the next run
+        interrupted, self.interrupted = self.interrupted, []
+        subagents = {subagent.name: subagent for subagent in self.subagents}
+        for info in interrupted:
+            if self.journal is not None or self.observers:
+                self._emit({"op": "handoff_done", "task_id": info["task_id"]})
+            subagent = subagents.get(info["subagent"])
+            if subagent is None:
+                self._add_result(info["task_id"], {
+                    "subagent": info["subagent"],
+                    "result": "Error: subagent removed before the task could resume",
+                    "status": "failed"
+                })
+                continue
+            self._submit(subagent, info["prompt"], info["priority"])
 
     def list_subagents(self) -> List[str]:
         return [s.name for s in self.subagents]
\ No newline at end of file
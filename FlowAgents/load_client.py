@@ -1,11 +1,40 @@
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
+import httpx
 import os
-from agents import set_default_openai_client, set_tracing_disabled
+from agents import OpenAIChatCompletionsModel, set_default_openai_client, set_tracing_disabled
 
 client = None
+models: dict[str, OpenAIChatCompletionsModel] = {} # model name -> model bound to the shared client
+
+# one pooled client is shared by the whole agent tree, connections are kept alive across turns and handoffs
+client_config = {
+    "base_url": "https://openrouter.ai/api/v1",
+    "api_key_env": "OPENROUTER_API_KEY",
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0, # seconds an idle connection is kept open
+    "timeout": 600.0,
+    "max_retries": 2,
+    "fake_model": None, # options of a FakeModel answering in-process instead of the endpoint, for tests and benchmarks
+}
+
+def configure_client(**config):
+    """
+    Updates the client configuration, the client is rebuilt on next use
+    @param config: any key of client_config
+    """
+    global client
+    unknown = set(config) - set(client_config)
+    if unknown:
+        raise ValueError(f"Unknown client options: {', '.join(sorted(unknown))}")
+    client_config.update(config)
+    client = None
+    models.clear()
 
 def get_client():
+    if client is None:
+        load_client()
     return client
 
 def isClientLoaded():
@@ -14,10 +43,40 @@ def isClientLoaded():
 def load_client():
     load_dotenv()
     global client
+    if client_config["fake_model"] is not None:
+        from .fake_model import FakeAsyncOpenAI # never loaded unless asked for
+        client = FakeAsyncOpenAI(**client_config["fake_model"])
+        models.clear()
+        set_tracing_disabled(True)
+        set_default_openai_client(client)
+        return client
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=client_config["max_connections"],
+            max_keepalive_connections=client_config["max_keepalive_connections"],
+            keepalive_expiry=client_config["keepalive_expiry"]
+        ),
+        timeout=client_config["timeout"]
+    )
     client = AsyncOpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv("OPENROUTER_API_KEY")
+        base_url=client_config["base_url"],
+        api_key=os.getenv(client_config["api_key_env"]),
+        max_retries=client_config["max_retries"],
+        http_client=http_client
     )
+    models.clear()
     set_tracing_disabled(True)
     set_default_openai_client(client)
-    return client
\ No newline at end of file
+    return client
+
+def get_model(model: str) -> OpenAIChatCompletionsModel:
+    """
+    @param model: the model name
+    @return: the model bound to the shared client, built once per name
+    """
+    if model not in models:
+        models[model] = OpenAIChatCompletionsModel(
+            model=model,
+            openai_client=get_client()
+        )
+    return models[model]
@@ -0,0 +1,156 @@
+from typing import Awaitable, Callable, Dict, Any, List, Tuple
+from .cache_utility import TimedLRU, SingleFlight
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+class ResponseCache:
+    """
+    Opt-in cache of model responses: an in-memory LRU tier in front of an optional disk tier with TTL and
+    size-based eviction. Concurrent identical requests are coalesced into a single in-flight call.
+    """
+
+    def __init__(self, max_entries: int = 1024, directory: str | None = None, ttl: float | None = None,
+                 max_disk_bytes: int = 100 * 1024 * 1024):
+        """
+        @param max_entries: max responses kept in memory
+        @param directory: where responses are persisted, None to keep them in memory only
+        @param ttl: seconds a response stays valid, None to keep it until evicted
+        @param max_disk_bytes: size of the disk tier over which the oldest responses are removed
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._memory = TimedLRU(max_entries, ttl)
+        self._in_flight = SingleFlight()
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock() # disk entries are read and written from worker threads
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    @staticmethod
+    def make_key(model: str, instructions: str, message: str, tools: List[Any]) -> str:
+        """
+        @return: the hash identifying a call by its model, serialized chat flow, input and tool signatures
+        """
+        tool_signatures = [
+            [getattr(tool, "name", type(tool).__name__), getattr(tool, "params_json_schema", None)]
+            for tool in tools
+        ]
+        payload = json.dumps([model, instructions, message, tool_signatures], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """
+        Returns the cached response, or computes it once even if many callers ask for it at the same time
+        @param key: the key from make_key
+        @param compute: makes the call on a miss
+        @return: the response and True if it was computed by this call, False if it came from the cache or another caller
+        """
+        response = self._memory.get(key)
+        if response is not None:
+            self.hits += 1
+            return response, False
+        (response, computed), ran = await self._in_flight.run(key, lambda: self._load_or_compute(key, compute))
+        if not ran:
+            self.coalesced += 1
+        return response, computed and ran
+
+    async def _load_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        entry = await self._get_disk(key)
+        if entry is not None:
+            created_at, response = entry
+            self.hits += 1
+            self.disk_hits += 1
+            self._memory.put(key, response, created_at)
+            return response, False
+        self.misses += 1
+        response = await compute()
+        self._memory.put(key, response)
+        await self._put_disk(key, response)
+        return response, True
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    async def _get_disk(self, key: str) -> Tuple[float, str] | None:
+        if self.directory is None:
+            return None
+        return await asyncio.to_thread(self._read_disk, key)
+
+    def _read_disk(self, key: str) -> Tuple[float, str] | None:
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if self._memory.is_expired(entry["created_at"]):
+            with self._disk_lock:
+                self._remove_disk(path)
+            return None
+        return entry["created_at"], entry["response"]
+
+    async def _put_disk(self, key: str, response: str):
+        if self.directory is not None:
+            await asyncio.to_thread(self._write_disk, key, response)
+
+    def _write_disk(self, key: str, response: str):
+        path = self._path(key)
+        data = json.dumps({"created_at": time.time(), "response": response})
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(data)
+        with self._disk_lock:
+            if os.path.exists(path):
+                self._disk_bytes -= os.path.getsize(path)
+            os.replace(tmp_path, path) # readers never see a partial entry
+            self._disk_bytes += os.path.getsize(path)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _remove_disk(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_bytes -= size
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """
+        Removes expired responses, then the oldest ones until the disk tier is back under 90% of its size
+        """
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        now = time.time()
+        for entry in entries:
+            if self._disk_bytes <= self.max_disk_bytes * 0.9 and (self.ttl is None or now - entry.stat().st_mtime <= self.ttl):
+                break
+            self._remove_disk(entry.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        @return: hit and miss counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
@@ -0,0 +1,205 @@
+from typing import Dict, List, Any
+from .flow_agent import FlowAgent
+import asyncio
+import json
+import mmap
+import os
+import re
+
+SEGMENT_PATTERN = re.compile(r"log\.(\d+)\.jsonl$")
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}") # session ids name folders, so . and .. can never be one
+
+class SessionStore:
+    """
+    Persists an agent tree: every change of the chat flows and of the delegated tasks is appended to a log, and a
+    compact snapshot is taken every snapshot_every changes. The log is split in segments, a snapshot starts a new
+    one and removes the older ones, so a restart reads the snapshot and replays only the changes made after it.
+    """
+
+    def __init__(self, directory: str, session_id: str, snapshot_every: int = 1000, fsync: bool = False):
+        """
+        @param directory: where sessions are stored, one folder per session
+        @param session_id: the session to restore and persist
+        @param snapshot_every: changes appended between two snapshots
+        @param fsync: syncs every change to the disk, otherwise the OS decides when the log reaches it
+        @raise ValueError: the session id does not match SESSION_ID_PATTERN
+        """
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        self.session_id = session_id
+        self.path = os.path.join(directory, session_id)
+        self.snapshot_path = os.path.join(self.path, "snapshot.json")
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.agents: Dict[str, FlowAgent] = {}
+        self.replayed = 0 # changes replayed on the last restore
+        self._segment = 0
+        self._log = None
+        self._since_snapshot = 0
+
+    @staticmethod
+    def _walk(agents: List[FlowAgent]) -> Dict[str, FlowAgent]:
+        """
+        @return: every agent of the tree by its path, e.g. main_agent/coder
+        """
+        found = {}
+        stack = [(agent.name, agent) for agent in reversed(agents)]
+        while stack:
+            path, agent = stack.pop()
+            found[path] = agent
+            for subagent in reversed(getattr(agent, "subagents", [])):
+                stack.append((f"{path}/{subagent.name}", subagent))
+        return found
+
+    def attach(self, agents: List[FlowAgent]) -> bool:
+        """
+        Restores the session into a freshly loaded tree if it was saved before, then persists every change of the tree
+        @param agents: the top level agents of the tree
+        @return: True if the session was restored
+        """
+        self.agents = self._walk(agents)
+        os.makedirs(self.path, exist_ok=True)
+        restored = self._restore()
+        for path, agent in self.agents.items():
+            agent.chat_flow_manager.journal = lambda event, path=path: self._append(path, event)
+            handoff_manager = getattr(agent, "handoff_manager", None)
+            if handoff_manager is not None:
+                handoff_manager.journal = lambda event, path=path: self._append(path, event)
+        self.snapshot() # starts a fresh segment from the restored state
+        self._redispatch()
+        return restored
+
+    def _segments(self) -> List[int]:
+        return sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(self.path)) if match)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"log.{segment}.jsonl")
+
+    def _restore(self) -> bool:
+        snapshot = self._read_snapshot()
+        segments = self._segments()
+        if snapshot is None and not segments:
+            return False
+        first_segment = 0
+        if snapshot is not None:
+            first_segment = snapshot["segment"]
+            for path, state in snapshot["agents"].items():
+                agent = self.agents.get(path)
+                if agent is None:
+                    continue # removed from the configuration since
+                agent.chat_flow_manager.load_state(state["flow"])
+                if state.get("handoffs") is not None and getattr(agent, "handoff_manager", None) is not None:
+                    agent.handoff_manager.load_state(state["handoffs"])
+        self.replayed = 0
+        for segment in segments:
+            if segment >= first_segment:
+                self.replayed += self._replay(self._segment_path(segment))
+        self._segment = max([first_segment, *segments])
+        self._advance_task_ids()
+        return True
+
+    def _read_snapshot(self) -> Dict[str, Any] | None:
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return None
+        with open(self.snapshot_path, "rb") as file: # read once and decoded straight from the bytes, no extra copy
+            return json.load(file)
+
+    def _replay(self, log_path: str) -> int:
+        """
+        Applies the changes of a log segment, a partial last line left by a crash is cut off
+        @return: the number of changes applied
+        """
+        if os.path.getsize(log_path) == 0:
+            return 0
+        applied = 0
+        valid_size = 0
+        with open(log_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line in iter(data.readline, b""):
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(event)
+                applied += 1
+                valid_size += len(line)
+            truncated = valid_size < len(data)
+        if truncated:
+            with open(log_path, "r+b") as file:
+                file.truncate(valid_size)
+        return applied
+
+    def _apply(self, event: Dict[str, Any]):
+        agent = self.agents.get(event.pop("agent"))
+        if agent is None:
+            return
+        if event["op"] in ("handoff", "handoff_done", "result", "result_consumed"):
+            if getattr(agent, "handoff_manager", None) is not None:
+                agent.handoff_manager.apply(event)
+        else:
+            agent.chat_flow_manager.apply(event)
+
+    def _advance_task_ids(self):
+        for agent in self.agents.values():
+            handoff_manager = getattr(agent, "handoff_manager", None)
+            if handoff_manager is not None:
+                task_ids = [*handoff_manager.handoff_results, *(info["task_id"] for info in handoff_manager.interrupted)]
+                handoff_manager.scheduler.advance_task_ids(task_ids)
+
+    def _redispatch(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return # the next run of each agent dispatches them
+        for agent in self.agents.values():
+            handoff_manager = getattr(agent, "handoff_manager", None)
+            if handoff_manager is not None:
+                handoff_manager.redispatch_interrupted()
+
+    def _append(self, path: str, event: Dict[str, Any]):
+        self._log.write(json.dumps({"agent": path, **event}) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Writes the state of the whole tree and starts a new log segment, the older segments are removed
+        """
+        if self._log is not None:
+            self._log.close()
+        self._segment += 1
+        self._log = open(self._segment_path(self._segment), "a", encoding="utf-8")
+        state = {"segment": self._segment, "agents": {}}
+        for path, agent in self.agents.items():
+            handoff_manager = getattr(agent, "handoff_manager", None)
+            state["agents"][path] = {
+                "flow": agent.chat_flow_manager.dump_state(),
+                "handoffs": handoff_manager.dump_state() if handoff_manager is not None else None,
+            }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        for segment in self._segments():
+            if segment < self._segment:
+                os.remove(self._segment_path(segment)) # covered by the snapshot
+        self._since_snapshot = 0
+
+    def close(self):
+        """
+        Stops persisting the tree, the log stays on disk for the next restore
+        """
+        for agent in self.agents.values():
+            agent.chat_flow_manager.journal = None
+            if getattr(agent, "handoff_manager", None) is not None:
+                agent.handoff_manager.journal = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
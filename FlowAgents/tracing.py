@@ -0,0 +1,250 @@
+from typing import Dict, Any, Tuple, List
+from contextvars import ContextVar
+from IOMethods.output_methods import FileOutputMethod
+import asyncio
+import atexit
+import bisect
+import json
+import os
+import random
+import time
+
+# upper bounds of the duration histograms, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INHERITED_ATTRIBUTES = ("agent", "model") # copied from the parent span when a span leaves them unset or None
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+class Span:
+    """
+    One timed operation of a turn, nested in the span that was current when it started
+    """
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes", "started_at", "start_ns",
+                 "duration_ns", "status", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: "Span | None", attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        if parent is not None:
+            for key in INHERITED_ATTRIBUTES:
+                if attributes.get(key) is None and key in parent.attributes:
+                    attributes[key] = parent.attributes[key]
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.duration_ns = 0
+        self.status = "ok"
+        self._token = None
+
+    def set(self, **attributes):
+        """
+        Adds attributes known once the operation ran, e.g. the tokens of a response
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        if exc_type is not None:
+            self.status = "cancelled" if issubclass(exc_type, asyncio.CancelledError) else "error"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": self.duration_ns / 1e6,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class _NullSpan:
+    """
+    Returned while tracing is disabled, every operation is a no-op
+    """
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Metrics:
+    """
+    Aggregates finished spans into Prometheus metrics: duration histograms by span and agent, token and eviction
+    counters, and the context size of each agent
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {} # buckets, then sum and count
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def _observe(self, metric: str, labels: Tuple[Tuple[str, str], ...], value: float):
+        values = self.histograms.get((metric, labels))
+        if values is None:
+            values = self.histograms[(metric, labels)] = [0.0] * (len(DURATION_BUCKETS) + 2)
+        values[bisect.bisect_left(DURATION_BUCKETS, value)] += 1 # the last bucket is +Inf
+        values[-2] += value
+        values[-1] += 1
+
+    def _add(self, metric: str, labels: Tuple[Tuple[str, str], ...], value: float):
+        self.counters[(metric, labels)] = self.counters.get((metric, labels), 0) + value
+
+    def observe(self, span: Span):
+        attributes = span.attributes
+        agent = str(attributes.get("agent") or "")
+        labels = (("span", span.name), ("agent", agent))
+        self._observe("flowagents_span_duration_seconds", labels, span.duration_ns / 1e9)
+        if span.status != "ok":
+            self._add("flowagents_span_errors_total", labels, 1)
+        model_labels = (("agent", agent), ("model", str(attributes.get("model") or "")))
+        if "prompt_tokens" in attributes:
+            self._add("flowagents_prompt_tokens_total", model_labels, attributes["prompt_tokens"])
+        if "completion_tokens" in attributes:
+            self._add("flowagents_completion_tokens_total", model_labels, attributes["completion_tokens"])
+        if "queue_wait" in attributes:
+            self._observe("flowagents_handoff_queue_wait_seconds", (("agent", agent),), attributes["queue_wait"])
+        if "evicted" in attributes:
+            self._add("flowagents_evicted_messages_total", (("agent", agent),), attributes["evicted"])
+        if "cache" in attributes: # hit or miss of a tool call
+            self._add("flowagents_tool_cache_total", (("tool", str(attributes.get("tool") or "")), ("result", attributes["cache"])), 1)
+        if "context_tokens" in attributes:
+            self.gauges[("flowagents_context_tokens", (("agent", agent),))] = attributes["context_tokens"]
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+        pairs = [f'{key}="{Metrics._escape(value)}"' for key, value in labels]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        """
+        @return: the metrics in the Prometheus text format
+        """
+        lines = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({metric for metric, _ in metrics}):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{self._labels(labels)} {value}" for (metric, labels), value in metrics.items() if metric == name)
+        for name in sorted({metric for metric, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), values in self.histograms.items():
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*DURATION_BUCKETS, "+Inf"), values[:-2]):
+                    cumulative += count
+                    bucket_labels = self._labels(labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative:g}")
+                lines.append(f"{name}_sum{self._labels(labels)} {values[-2]}")
+                lines.append(f"{name}_count{self._labels(labels)} {values[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+class Tracer:
+    """
+    Records spans of agent turns when enabled: each finished span is appended to a JSONL trace file and aggregated
+    into metrics, written to a Prometheus text file every metrics_interval seconds. Disabled, span() only returns
+    a shared no-op span.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = Metrics()
+        self.metrics_path: str | None = None
+        self.metrics_interval = 10.0
+        self._traces: FileOutputMethod | None = None
+        self._next_metrics_write = 0.0
+
+    def configure(self, enabled: bool = True, traces_path: str | None = None, metrics_path: str | None = None,
+                  metrics_interval: float = 10.0, **traces_options):
+        """
+        @param enabled: records spans, False to disable tracing again
+        @param traces_path: the JSONL file every finished span is appended to, None to only aggregate metrics
+        @param metrics_path: the Prometheus text file the metrics are written to, None to only serve them
+        @param metrics_interval: seconds between two writes of the metrics file
+        @param traces_options: options of the buffered trace writer, e.g. flush_interval
+        """
+        self.close()
+        self.enabled = enabled
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        for path in (traces_path, metrics_path):
+            if path is not None and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._traces = FileOutputMethod(traces_path, **traces_options) if enabled and traces_path is not None else None
+
+    def span(self, name: str, parent: Span | None = None, **attributes) -> Span | _NullSpan:
+        """
+        @param name: the operation, e.g. llm.call
+        @param parent: the span to nest in, defaults to the current span of this task
+        @param attributes: attributes known when the operation starts
+        @return: the span to use as a context manager
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, parent if parent is not None else _current_span.get(), attributes)
+
+    @staticmethod
+    def current() -> Span | None:
+        """
+        @return: the span current in this task, to nest work started elsewhere in it
+        """
+        return _current_span.get()
+
+    def _finish(self, span: Span):
+        self.metrics.observe(span)
+        if self._traces is not None:
+            self._traces.output(json.dumps(span.to_dict(), default=str))
+        if self.metrics_path is not None and time.monotonic() >= self._next_metrics_write:
+            self.write_metrics()
+
+    def write_metrics(self):
+        """
+        Writes the metrics file now, atomically so a scraper never reads it half written
+        """
+        if self.metrics_path is None:
+            return
+        tmp_path = f"{self.metrics_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.metrics.render())
+        os.replace(tmp_path, self.metrics_path)
+        self._next_metrics_write = time.monotonic() + self.metrics_interval
+
+    def close(self):
+        """
+        Flushes the traces and writes the metrics a last time
+        """
+        if self._traces is not None:
+            self._traces.close()
+            self._traces = None
+        if self.enabled:
+            self.write_metrics()
+
+tracer = Tracer() # shared by the whole process, configured by the tracing section of agents.yml
+atexit.register(tracer.close)
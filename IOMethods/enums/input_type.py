@@ -1,6 +1,7 @@
 from enum import Enum
-from IOMethods.input_methods import UserCLIInputMethod
+from IOMethods.input_methods import UserCLIInputMethod, FileInputMethod
 
 class InputType(Enum):
     USER_CLI = UserCLIInputMethod("Ask the agent > ")
+    FILE = FileInputMethod # built from input_options, e.g. file_path and follow
     NO = None
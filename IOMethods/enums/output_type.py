@@ -1,7 +1,8 @@
 from enum import Enum
-from IOMethods.output_methods import ConsoleOutputMethod
+from IOMethods.output_methods import ConsoleOutputMethod, NullOutputMethod, FileOutputMethod, JSONLOutputMethod
 
 class OutputType(Enum):
     CONSOLE = ConsoleOutputMethod()
-    NO = None
-
+    FILE = FileOutputMethod # built from its options, e.g. file_path and fsync
+    JSONL = JSONLOutputMethod
+    NO = NullOutputMethod()
@@ -1,9 +1,14 @@
 from abc import ABC, abstractmethod
+import asyncio
+import os
+import threading
+import time
 
 class InputMethod(ABC):
 
     def __init__(self):
         self.open = True
+        self._pending: asyncio.Future | None = None # read still running on its thread
 
     def has_next(self) -> bool:
         return self.open
@@ -12,7 +17,16 @@ class InputMethod(ABC):
         if not self.has_next():
             raise Exception("No more input")
         return self._input()
-    
+
+    async def next_async(self) -> str:
+        """
+        Reads the next input without blocking the event loop, so background tasks keep running while waiting
+        @return: the next input, None if the input ended
+        """
+        if not self.has_next():
+            raise Exception("No more input")
+        return await self._input_async()
+
     def close(self):
         self.open = False
 
@@ -20,6 +34,42 @@ class InputMethod(ABC):
     def _input(self) -> str:
         pass
 
+    async def _input_async(self) -> str:
+        """
+        Runs the blocking _input on a daemon thread, a cancelled read is kept and returned by the next call
+        """
+        if self._pending is None or self._pending.get_loop() is not asyncio.get_running_loop():
+            self._pending = self._read_in_thread()
+        try:
+            return await asyncio.shield(self._pending)
+        finally:
+            if self._pending.done():
+                self._pending = None
+
+    def _read_in_thread(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def read():
+            try:
+                result, error = self._input(), None
+            except Exception as e:
+                result, error = None, e
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(resolve, result, error)
+
+        # daemon, so a read waiting on the terminal never keeps the process alive on exit
+        threading.Thread(target=read, name=f"{type(self).__name__}-reader", daemon=True).start()
+        return future
+
 class UserCLIInputMethod(InputMethod):
 
     def __init__(self, request_message: str):
@@ -31,17 +81,63 @@ class UserCLIInputMethod(InputMethod):
 
 class FileInputMethod(InputMethod):
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, follow: bool = False, poll_interval: float = 0.5):
+        """
+        @param file_path: the file read line by line
+        @param follow: keeps waiting for lines appended to the file instead of closing at its end, like tail -f
+        @param poll_interval: seconds between two checks for new lines in follow mode
+        """
         super().__init__()
         self.file_path = file_path
+        self.follow = follow
+        self.poll_interval = poll_interval
         self.line = 0
+        self._file = None # kept open, every line is read once
+        self._partial = "" # line being written when follow reached the end of the file
 
     def _input(self) -> str:
-        with open(self.file_path, "r") as file:
-            lines = file.readlines()
-            if self.line >= len(lines):
-                self.close()
+        while True:
+            line = self._read_line()
+            if line is not None or not self.open:
+                return line
+            time.sleep(self.poll_interval)
+
+    async def _input_async(self) -> str:
+        # reads from a local file are short, only the wait for new lines needs to yield
+        while True:
+            line = self._read_line()
+            if line is not None or not self.open:
+                return line
+            await asyncio.sleep(self.poll_interval)
+
+    def _read_line(self) -> str | None:
+        """
+        @return: the next complete line, None at the end of the file, closing the input unless following it
+        """
+        if not self.open:
+            return None
+        if self._file is None:
+            self._file = open(self.file_path, "r")
+        line = self._file.readline()
+        if line.endswith("\n"):
+            self.line += 1
+            line, self._partial = self._partial + line[:-1], ""
+            return line
+        if not self.follow:
+            self.close()
+            line, self._partial = self._partial + line, ""
+            if line == "":
                 return None
-            line = lines[self.line]
             self.line += 1
-            return line
\ No newline at end of file
+            return line
+        self._partial += line
+        if self._file.tell() > os.path.getsize(self.file_path): # truncated, start over
+            self._file.seek(0)
+            self._partial = ""
+        return None
+
+    def close(self):
+        super().close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
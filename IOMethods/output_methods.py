@@ -1,18 +1,247 @@
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import List
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+
+FSYNC_NEVER = "never" # the OS decides when written batches reach the disk
+FSYNC_BATCH = "batch" # every written batch is synced
+FSYNC_FLUSH = "flush" # synced on explicit flush and close only
 
 class OutputMethod(ABC):
     @abstractmethod
     def output(self, message: str):
         pass
 
+    def output_message(self, agent: str, role: str, message: str):
+        """
+        Outputs a message of an agent
+        @param agent: the name of the agent
+        @param role: the role of the message, e.g. assistant
+        @param message: the message
+        """
+        self.output(f"{agent}: {message}")
+
+    def start_stream(self, agent: str, role: str):
+        """
+        Opens a message of an agent streamed by output_chunk
+        @param agent: the name of the agent
+        @param role: the role of the message
+        """
+        self.output_chunk(f"{agent}: ")
+
+    def output_chunk(self, chunk: str):
+        """
+        Outputs a piece of a streamed message as soon as it is generated
+        @param chunk: the piece of the message
+        """
+        self.output(chunk)
+
+    def end_stream(self):
+        """
+        Closes the streamed message started by output_chunk
+        """
+        pass
+
+    def flush(self):
+        """
+        Blocks until every buffered output is written
+        """
+        pass
+
+    def close(self):
+        """
+        Flushes and releases the output
+        """
+        pass
+
+class NullOutputMethod(OutputMethod):
+    def output(self, message: str):
+        pass
+
 class ConsoleOutputMethod(OutputMethod):
     def output(self, message: str):
         print(message)
 
+    def output_chunk(self, chunk: str):
+        print(chunk, end="", flush=True)
+
+    def end_stream(self):
+        print()
+
 class FileOutputMethod(OutputMethod):
-    def __init__(self, file_path: str):
-        self.file_path = file_path  
+    """
+    Appends to a file kept open, writes are buffered and batched by a writer thread so agents never wait on the disk
+    """
+
+    def __init__(self, file_path: str, max_buffer_bytes: int = 64 * 1024, flush_interval: float = 1.0,
+                 fsync: str = FSYNC_NEVER):
+        """
+        @param file_path: the file to append to
+        @param max_buffer_bytes: buffered size over which a batch is written right away
+        @param flush_interval: max seconds an output stays buffered
+        @param fsync: when written batches are synced to the disk: never, batch or flush
+        """
+        if fsync not in (FSYNC_NEVER, FSYNC_BATCH, FSYNC_FLUSH):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.file_path = file_path
+        self.max_buffer_bytes = max_buffer_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.batches = 0
+        self._buffer: List[str] = []
+        self._buffer_size = 0
+        self._requested = 0 # flushes requested
+        self._written = 0 # flushes completed by the writer
+        self._closed = False
+        self._condition = threading.Condition()
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(file_path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write_batches, name=f"output-{file_path}", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def output(self, message: str):
+        self._write(message + "\n")
+
+    def output_chunk(self, chunk: str):
+        self._write(chunk)
+
+    def end_stream(self):
+        self._write("\n")
+
+    def _write(self, text: str):
+        with self._condition:
+            if self._closed:
+                raise ValueError(f"Output {self.file_path} is closed")
+            self._buffer.append(text)
+            self._buffer_size += len(text)
+            if self._buffer_size >= self.max_buffer_bytes:
+                self._condition.notify()
+
+    def _write_batches(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._buffer_size >= self.max_buffer_bytes or self._requested > self._written or self._closed,
+                    timeout=self.flush_interval
+                )
+                batch, self._buffer, self._buffer_size = self._buffer, [], 0
+                requested, closed = self._requested, self._closed
+            if batch:
+                self._file.write("".join(batch))
+                self._file.flush()
+                self.batches += 1
+            if self.fsync == FSYNC_BATCH and batch or self.fsync == FSYNC_FLUSH and requested > self._written:
+                os.fsync(self._file.fileno())
+            with self._condition:
+                self._written = requested
+                self._condition.notify_all()
+            if closed:
+                self._file.close()
+                return
+
+    def flush(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._requested += 1
+            requested = self._requested
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._written >= requested)
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._requested += 1
+            self._condition.notify_all()
+        self._writer.join()
+        atexit.unregister(self.close)
+
+class JSONLOutputMethod(FileOutputMethod):
+    """
+    Buffered file output writing one JSON record per message, with the agent, the role and timestamps
+    """
+
+    def __init__(self, file_path: str, max_buffer_bytes: int = 64 * 1024, flush_interval: float = 1.0,
+                 fsync: str = FSYNC_NEVER):
+        super().__init__(file_path, max_buffer_bytes, flush_interval, fsync)
+        # agent, role, start time and chunks of the message streamed by the current task, agents stream concurrently
+        self._stream = contextvars.ContextVar(f"jsonl_stream_{id(self)}", default=None)
+
+    @staticmethod
+    def _timestamp(seconds: float) -> str:
+        return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+    def _record(self, agent: str | None, role: str, message: str, started_at: float | None = None):
+        now = time.time()
+        record = {"timestamp": self._timestamp(now), "agent": agent, "role": role, "message": message}
+        if started_at is not None:
+            record["started_at"] = self._timestamp(started_at)
+        self._write(json.dumps(record) + "\n")
 
     def output(self, message: str):
-        with open(self.file_path, "a") as file:
-            file.write(message + "\n")
+        self._record(None, "log", message)
+
+    def output_message(self, agent: str, role: str, message: str):
+        self._record(agent, role, message)
+
+    def start_stream(self, agent: str, role: str):
+        self._stream.set((agent, role, time.time(), []))
+
+    def output_chunk(self, chunk: str):
+        if self._stream.get() is None: # chunk outside of an agent stream
+            self.start_stream(None, "log")
+        self._stream.get()[3].append(chunk)
+
+    def end_stream(self):
+        stream = self._stream.get()
+        if stream is None:
+            return
+        agent, role, started_at, chunks = stream
+        self._stream.set(None)
+        self._record(agent, role, "".join(chunks), started_at)
+
+class MultiOutputMethod(OutputMethod):
+    """
+    Fans every output out to several output methods
+    """
+
+    def __init__(self, output_methods: List[OutputMethod]):
+        self.output_methods = output_methods
+
+    def output(self, message: str):
+        for output_method in self.output_methods:
+            output_method.output(message)
+
+    def output_message(self, agent: str, role: str, message: str):
+        for output_method in self.output_methods:
+            output_method.output_message(agent, role, message)
+
+    def start_stream(self, agent: str, role: str):
+        for output_method in self.output_methods:
+            output_method.start_stream(agent, role)
+
+    def output_chunk(self, chunk: str):
+        for output_method in self.output_methods:
+            output_method.output_chunk(chunk)
+
+    def end_stream(self):
+        for output_method in self.output_methods:
+            output_method.end_stream()
+
+    def flush(self):
+        for output_method in self.output_methods:
+            output_method.flush()
+
+    def close(self):
+        for output_method in self.output_methods:
+            output_method.close()
@@ -1,9 +1,71 @@
 from typing import List, Callable
-from agents import Tool
+import importlib.util
+import sys
 
-class BaseTool(Tool):
-    def __init__(self, name: str, description: str, author: str, version: str, functions: List[Callable]):
+EXECUTORS = ("thread", "process")
+
+class BaseTool:
+    """
+    A tool module declares one BaseTool at module level with literal metadata, so the manifest can read it
+    without importing the module:
+
+        TOOL = BaseTool(name="FILE_MANAGER", description="...", author="...", version="1.0", functions=[read_file])
+
+    Each function is exposed to the model as a function tool, its parameters are read from its annotations
+    and its @param docstring lines.
+    """
+
+    def __init__(self, name: str, description: str, author: str, version: str, functions: List[Callable],
+                 executor: str = "thread", timeout: float | None = None, max_concurrency: int | None = None,
+                 idempotent: bool = False, ttl: float | None = None, max_entries: int = 256):
+        """
+        @param name: the name agents list in their tools
+        @param description: what the tool does
+        @param author: the author of the tool
+        @param version: the version of the tool
+        @param functions: the functions the model can call, async functions always run on the event loop
+        @param executor: thread for blocking functions, process for CPU-heavy ones, the functions must then be picklable
+        @param timeout: seconds a call may take, defaults to the timeout of the executor
+        @param max_concurrency: calls of the tool running at once, None for no limit but the pool size
+        @param idempotent: the functions only depend on their arguments, their results are cached by the executor
+        @param ttl: seconds a cached result stays valid, None to keep it until evicted
+        @param max_entries: results of the tool kept in the cache
+        """
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown tool executor: {executor}")
         self.name = name
         self.description = description
         self.author = author
         self.version = version
+        self.functions = {function.__name__: function for function in functions}
+        self.executor = executor
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.idempotent = idempotent # results are cached by name, version and arguments, bump the version to drop them
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.module_name: str | None = None # set once imported by the loader, process workers import it again
+        self.module_path: str | None = None
+
+    def get_function(self, name: str) -> Callable:
+        return self.functions[name]
+
+def import_tool_module(module_name: str, path: str):
+    """
+    Imports a tool module from its file, once per process
+    @param module_name: the name the module is registered under
+    @param path: the file of the module
+    @return: the module
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
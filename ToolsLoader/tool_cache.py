@@ -0,0 +1,67 @@
+from typing import Awaitable, Callable, Dict, Any, Tuple
+from FlowAgents.cache_utility import TimedLRU, SingleFlight
+import json
+
+class ToolResultCache:
+    """
+    In-memory LRU of the results of one idempotent tool version, with a TTL. Concurrent identical calls are
+    coalesced into a single execution, failed calls are never cached. Results are shared by every caller, so
+    they should be immutable, e.g. the text sent to the model.
+    """
+
+    def __init__(self, version: str, ttl: float | None = None, max_entries: int = 256):
+        """
+        @param version: the version of the tool, a new version gets a new cache
+        @param ttl: seconds a result stays valid, None to keep it until evicted
+        @param max_entries: results kept, the least recently used are evicted first
+        """
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._results = TimedLRU(max_entries, ttl)
+        self._in_flight = SingleFlight()
+
+    @staticmethod
+    def make_key(tool_name: str, version: str, function_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        @return: the key of a call, arguments are canonicalized so their order and spacing never matter
+        """
+        return json.dumps([tool_name, version, function_name, arguments], sort_keys=True, separators=(",", ":"), default=str)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        @param key: the key from make_key
+        @param compute: runs the call on a miss
+        @return: the result and True if it was computed by this call, False if it came from the cache or another caller
+        """
+        result = self._results.get(key)
+        if result is not None:
+            self.hits += 1
+            return result, False
+        result, computed = await self._in_flight.run(key, lambda: self._compute(key, compute))
+        if not computed:
+            self.coalesced += 1
+        return result, computed
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        self.misses += 1
+        result = await compute()
+        self._results.put(key, result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        @return: hit and miss counters, coalesced calls count as hits
+        """
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "entries": len(self._results),
+        }
@@ -0,0 +1,138 @@
+from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from FlowAgents.tracing import tracer
+from ToolsLoader.tool import BaseTool, import_tool_module
+from ToolsLoader.tool_cache import ToolResultCache
+import asyncio
+import inspect
+import json
+import time
+import weakref
+
+def _call_in_process(module_name: str, module_path: str, function_name: str, arguments: Dict[str, Any]) -> Any:
+    """
+    Runs a tool function in a worker process, the module is imported once per worker
+    """
+    return getattr(import_tool_module(module_name, module_path), function_name)(**arguments)
+
+class ToolExecutor:
+    """
+    Runs tool calls off the event loop: blocking functions in a thread pool, CPU-heavy ones in a process pool,
+    async functions on the loop itself. Each call has a timeout and each tool a concurrency limit, the pools
+    are only started by the first call needing them. Results are returned as the text sent to the model, the ones
+    of idempotent tools are memoized per tool version.
+    """
+
+    def __init__(self, max_threads: int = 8, max_processes: int = 2, timeout: float | None = 60.0):
+        """
+        @param max_threads: blocking calls running at once across every tool
+        @param max_processes: CPU-heavy calls running at once across every tool
+        @param timeout: default seconds a call may take, waiting for the tool limit included, None for no limit
+        """
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self.timeout = timeout
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+        # event loop -> tool name -> calls of the tool allowed at once, a semaphore only works on one loop
+        self._limits: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]] = weakref.WeakKeyDictionary()
+        self._caches: Dict[str, ToolResultCache] = {} # tool name -> results of its idempotent calls, shared by the tree
+        self._stats = {"calls": 0, "completed": 0, "failed": 0, "timed_out": 0}
+        self._running = 0
+        self._run_time_total = 0.0
+        self._run_time_max = 0.0
+
+    async def call(self, tool: BaseTool, function_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        @param tool: the imported tool
+        @param function_name: the function of the tool to call
+        @param arguments: the keyword arguments of the call
+        @return: the result of the function as text, JSON unless it is a string, from the cache of the tool if it
+        is idempotent and already ran with them; cached results are immutable so no caller can alter them for the others
+        @raise asyncio.TimeoutError: the call took longer than the timeout of the tool, a thread or a process
+        running it is not interrupted but its result is dropped
+        """
+        with tracer.span("tool.call", tool=tool.name, function=function_name, executor=tool.executor) as span:
+            if not tool.idempotent:
+                return await self._execute(tool, function_name, arguments)
+            cache = self._caches.get(tool.name)
+            if cache is None or cache.version != tool.version: # results of another version are dropped
+                cache = self._caches[tool.name] = ToolResultCache(tool.version, tool.ttl, tool.max_entries)
+            key = ToolResultCache.make_key(tool.name, tool.version, function_name, arguments)
+            result, computed = await cache.get_or_compute(key, lambda: self._execute(tool, function_name, arguments))
+            span.set(cache="miss" if computed else "hit")
+            return result
+
+    async def _execute(self, tool: BaseTool, function_name: str, arguments: Dict[str, Any]) -> str:
+        timeout = tool.timeout if tool.timeout is not None else self.timeout
+        self._stats["calls"] += 1
+        started_at = time.monotonic()
+        self._running += 1
+        try:
+            result = await asyncio.wait_for(self._limited(tool, function_name, arguments), timeout)
+            self._stats["completed"] += 1
+            return result if isinstance(result, str) else json.dumps(result, default=str)
+        except asyncio.TimeoutError:
+            self._stats["timed_out"] += 1
+            raise
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+        finally:
+            self._running -= 1
+            run_time = time.monotonic() - started_at
+            self._run_time_total += run_time
+            self._run_time_max = max(self._run_time_max, run_time)
+
+    async def _limited(self, tool: BaseTool, function_name: str, arguments: Dict[str, Any]) -> Any:
+        if tool.max_concurrency is None:
+            return await self._run(tool, function_name, arguments)
+        limits = self._limits.setdefault(asyncio.get_running_loop(), {})
+        limit = limits.get(tool.name)
+        if limit is None:
+            limit = limits[tool.name] = asyncio.Semaphore(tool.max_concurrency)
+        async with limit:
+            return await self._run(tool, function_name, arguments)
+
+    async def _run(self, tool: BaseTool, function_name: str, arguments: Dict[str, Any]) -> Any:
+        function = tool.get_function(function_name)
+        if inspect.iscoroutinefunction(function):
+            return await function(**arguments)
+        loop = asyncio.get_running_loop()
+        if tool.executor == "process":
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.max_processes)
+            return await loop.run_in_executor(
+                self._processes, _call_in_process, tool.module_name, tool.module_path, function_name, arguments
+            )
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="tool")
+        return await loop.run_in_executor(self._threads, partial(function, **arguments))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        @return: call counters, run-time statistics in seconds and the cache statistics of each idempotent tool
+        """
+        finished = self._stats["calls"] - self._running
+        caches = {name: cache.get_stats() for name, cache in self._caches.items()}
+        hits = sum(stats["hits"] + stats["coalesced"] for stats in caches.values())
+        lookups = hits + sum(stats["misses"] for stats in caches.values())
+        return {
+            "running": self._running,
+            **self._stats,
+            "avg_run_time": self._run_time_total / finished if finished else 0.0,
+            "max_run_time": self._run_time_max,
+            "cache_hit_rate": hits / lookups if lookups else 0.0,
+            "caches": caches,
+        }
+
+    def close(self):
+        """
+        Shuts the pools down without waiting for the calls still running
+        """
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = None
+        self._processes = None
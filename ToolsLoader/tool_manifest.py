@@ -0,0 +1,173 @@
+from typing import Dict, Any, List
+import ast
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# JSON schema types of the annotations the manifest understands, other annotations accept any value
+ANNOTATION_TYPES = {
+    "str": "string", "int": "integer", "float": "number", "bool": "boolean",
+    "list": "array", "List": "array", "tuple": "array", "Tuple": "array", "dict": "object", "Dict": "object",
+}
+PARAM_PATTERN = re.compile(r"^[@:]param\s+(\w+)\s*:\s*(.*)$")
+
+class ToolManifest:
+    """
+    Metadata of the tool modules of a folder, read from their syntax tree instead of importing them and cached
+    on disk: only the modules whose mtime or size changed are parsed again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: str = "ToolsLoader/tools", manifest_path: str | None = None):
+        """
+        @param directory: the folder of the tool modules
+        @param manifest_path: where the manifest is persisted, defaults to .manifest.json in the folder
+        """
+        self.directory = directory
+        self.manifest_path = manifest_path or os.path.join(directory, ".manifest.json")
+        self.files: Dict[str, Dict[str, Any]] = {} # module path -> {mtime, size, tools: tool entries}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.files = data["files"]
+
+    def save(self):
+        """
+        Persists the manifest if it changed, atomically so a crash never leaves a partial manifest
+        """
+        if not self._dirty:
+            return
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self.VERSION, "files": self.files}, file)
+        os.replace(tmp_path, self.manifest_path)
+        self._dirty = False
+
+    def update(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Parses the tool modules that changed since the manifest was saved, then persists it
+        @return: tool name -> tool entry, with its module path, metadata and function schemas
+        """
+        paths = []
+        if os.path.isdir(self.directory):
+            paths = sorted(
+                os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                if file_name.endswith(".py") and not file_name.startswith((".", "_"))
+            )
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.files.get(path)
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                try:
+                    with open(path, "r", encoding="utf-8") as file:
+                        source = file.read()
+                    tools = self.parse(source, path)
+                except (SyntaxError, ValueError) as e: # one broken module never hides the others
+                    logger.warning("Skipping tool module %s: %s: %s", path, type(e).__name__, e)
+                    if self.files.pop(path, None) is not None:
+                        self._dirty = True
+                    continue
+                self.files[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "tools": tools}
+                self._dirty = True
+        for path in [path for path in self.files if path not in paths]:
+            del self.files[path]
+            self._dirty = True
+        self.save()
+        return {tool["name"]: tool for path in paths if path in self.files for tool in self.files[path]["tools"]}
+
+    @staticmethod
+    def parse(source: str, path: str = "<tool>") -> List[Dict[str, Any]]:
+        """
+        @param source: the source of a tool module
+        @param path: the file of the module
+        @return: the entries of the BaseTool declared at module level with literal metadata
+        """
+        tree = ast.parse(source, filename=path)
+        functions = {
+            node.name: node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        }
+        tools = []
+        for node in tree.body:
+            if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)):
+                continue
+            call = node.value
+            if not (isinstance(call, ast.Call) and getattr(call.func, "id", getattr(call.func, "attr", None)) == "BaseTool"):
+                continue
+            options = {}
+            function_names = []
+            for keyword in call.keywords:
+                if keyword.arg == "functions" and isinstance(keyword.value, (ast.List, ast.Tuple)):
+                    function_names = [element.id for element in keyword.value.elts if isinstance(element, ast.Name)]
+                elif keyword.arg is not None:
+                    try:
+                        options[keyword.arg] = ast.literal_eval(keyword.value)
+                    except ValueError:
+                        pass # computed at import time, unknown to the manifest
+            if "name" not in options:
+                continue
+            tools.append({
+                "name": options["name"],
+                "description": options.get("description", ""),
+                "author": options.get("author", ""),
+                "version": str(options.get("version", "")),
+                "executor": options.get("executor", "thread"),
+                "timeout": options.get("timeout"),
+                "max_concurrency": options.get("max_concurrency"),
+                "path": path,
+                "attribute": node.targets[0].id,
+                "functions": [ToolManifest._function_schema(functions[name]) for name in function_names if name in functions],
+            })
+        return tools
+
+    @staticmethod
+    def _function_schema(node: ast.FunctionDef | ast.AsyncFunctionDef) -> Dict[str, Any]:
+        """
+        @return: the name, description and JSON schema of the parameters of a tool function
+        """
+        description_lines = []
+        parameter_descriptions = {}
+        for line in (ast.get_docstring(node) or "").splitlines():
+            line = line.strip()
+            match = PARAM_PATTERN.match(line)
+            if match:
+                parameter_descriptions[match.group(1)] = match.group(2)
+            elif line and not line.startswith(("@", ":")):
+                description_lines.append(line)
+
+        arguments = node.args
+        positional = arguments.posonlyargs + arguments.args
+        first_default = len(positional) - len(arguments.defaults)
+        properties = {}
+        required = []
+        parameters = [(argument, index < first_default) for index, argument in enumerate(positional)]
+        parameters += [(argument, default is None) for argument, default in zip(arguments.kwonlyargs, arguments.kw_defaults)]
+        for argument, is_required in parameters:
+            schema = {}
+            if argument.annotation is not None:
+                annotation = ast.unparse(argument.annotation).split("[", 1)[0].split(".")[-1]
+                if annotation in ANNOTATION_TYPES:
+                    schema["type"] = ANNOTATION_TYPES[annotation]
+            if argument.arg in parameter_descriptions:
+                schema["description"] = parameter_descriptions[argument.arg]
+            properties[argument.arg] = schema
+            if is_required:
+                required.append(argument.arg)
+        return {
+            "name": node.name,
+            "description": " ".join(description_lines),
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        }
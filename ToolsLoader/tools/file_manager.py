@@ -0,0 +1,49 @@
+from ToolsLoader.tool import BaseTool
+import os
+
+# the project folder, paths are relative to it and nothing outside of it is served, symlinks included
+ROOT = os.path.realpath(os.environ.get("FILE_MANAGER_ROOT", os.getcwd()))
+
+def _resolve(path: str) -> str:
+    """
+    @param path: a path given by the model, relative to the project
+    @return: its real path, symlinks resolved
+    @raise PermissionError: the path leads outside of the project or into a hidden entry, e.g. .env or .git
+    """
+    resolved = os.path.realpath(os.path.join(ROOT, path))
+    if os.path.commonpath([ROOT, resolved]) != ROOT:
+        raise PermissionError(f"{path} is outside of the project")
+    relative = os.path.relpath(resolved, ROOT)
+    if relative != "." and any(part.startswith(".") for part in relative.split(os.sep)):
+        raise PermissionError(f"{path} is hidden")
+    return resolved
+
+def read_file(path: str, max_characters: int = 20000) -> str:
+    """
+    Reads a text file of the project
+    @param path: the file to read, relative to the project
+    @param max_characters: characters returned at most, the rest of the file is cut
+    """
+    with open(_resolve(path), "r", encoding="utf-8", errors="replace") as file:
+        return file.read(max_characters)
+
+def list_directory(path: str = ".") -> list:
+    """
+    Lists the entries of a folder of the project, folders end with a slash, hidden entries are left out
+    @param path: the folder to list, relative to the project
+    """
+    return sorted(
+        entry.name + "/" if entry.is_dir() else entry.name
+        for entry in os.scandir(_resolve(path)) if not entry.name.startswith(".")
+    )
+
+TOOL = BaseTool(
+    name="FILE_MANAGER",
+    description="Reads the files of the project, paths are relative to the project folder",
+    author="BetterAgent",
+    version="1.0",
+    functions=[read_file, list_directory],
+    max_concurrency=4,
+    idempotent=True, # repeated reads across turns and subagents are served from the executor cache
+    ttl=10 # short, so edits made outside the agents show up quickly
+)
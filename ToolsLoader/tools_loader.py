@@ -1,12 +1,86 @@
 from ToolsLoader.tool_mapper import ToolMapper
-from ToolsLoader.tool import BaseTool
-from typing import List
+from ToolsLoader.tool_manifest import ToolManifest
+from ToolsLoader.tool_executor import ToolExecutor
+from ToolsLoader.tool import BaseTool, import_tool_module
+from agents import FunctionTool
+from functools import partial
+from typing import List, Dict, Any
+import asyncio
+import json
+import os
+import threading
 
 class ToolsLoader:
-    def __init__(self, path: str):
+    """
+    Discovers the tool modules of a folder from its manifest and imports each module only when one of its
+    functions is called for the first time, so startup never pays for the tools no agent calls
+    """
+
+    def __init__(self, path: str = "ToolsLoader/tools", manifest_path: str | None = None, executor: ToolExecutor | None = None):
+        """
+        @param path: the folder of the tool modules
+        @param manifest_path: where the manifest is persisted, defaults to .manifest.json in the folder
+        @param executor: runs the tool calls, defaults to an executor with the default pools
+        """
         self.path = path
-        self.tool_mapper = ToolMapper()
+        self.manifest = ToolManifest(path, manifest_path)
+        self.executor = executor if executor is not None else ToolExecutor()
+        self.tool_mapper = ToolMapper() # the tools imported so far
+        self.entries: Dict[str, Dict[str, Any]] = {} # tool name -> manifest entry
+        self._import_lock = threading.Lock()
+
+    def load_tools(self) -> List[str]:
+        """
+        Updates the manifest, parsing only the tool modules that changed, none of them is imported
+        @return: the names of the tools found
+        """
+        self.entries = self.manifest.update()
+        return list(self.entries)
+
+    def get_tool(self, name: str) -> BaseTool:
+        """
+        @param name: the name of a tool of the manifest
+        @return: the tool, its module is imported on first use
+        """
+        with self._import_lock:
+            if name not in self.tool_mapper.tool_map:
+                entry = self.entries[name]
+                module_name = f"tool_modules.{os.path.splitext(os.path.basename(entry['path']))[0]}"
+                tool = getattr(import_tool_module(module_name, entry["path"]), entry["attribute"])
+                tool.module_name = module_name
+                tool.module_path = entry["path"]
+                self.tool_mapper.add_tool(tool)
+            return self.tool_mapper.get_tool(name)
 
-    def load_tools(self) -> List[BaseTool]:
-        pass
+    def function_tools(self, name: str) -> List[FunctionTool]:
+        """
+        @param name: the name of a tool
+        @return: a function tool per function of the tool, built from the manifest only, empty if the tool does not exist
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return []
+        return [
+            FunctionTool(
+                name=function["name"],
+                description=function["description"] or entry["description"],
+                params_json_schema=function["parameters"],
+                on_invoke_tool=partial(self._invoke, name, function["name"]),
+                strict_json_schema=False # parameters with defaults stay optional
+            )
+            for function in entry["functions"]
+        ]
 
+    async def _invoke(self, name: str, function_name: str, context, arguments: str) -> str:
+        """
+        Called by the agent for a tool call, failures are returned to the model instead of ending the run
+        """
+        try:
+            tool = self.tool_mapper.tool_map.get(name)
+            if tool is None: # the import runs in a thread so a slow module never blocks the loop
+                tool = await asyncio.to_thread(self.get_tool, name)
+            return await self.executor.call(tool, function_name, json.loads(arguments) if arguments else {})
+        except asyncio.TimeoutError:
+            return f"Tool {function_name} timed out"
+        except Exception as e:
+            return f"Tool {function_name} failed: {type(e).__name__}: {e}"
@@ -0,0 +1,405 @@
+from load_config_agent import AgentsLoader
+from full_agent import FullAgent
+from FlowAgents.conversation_flow.importance_message import ImportanceRequest
+from FlowAgents.session_store import SESSION_ID_PATTERN
+from FlowAgents.tracing import tracer
+from IOMethods.output_methods import OutputMethod
+from typing import Dict, Any, List, Set, Tuple
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY_BYTES = 1024 * 1024
+HTTP_STATUS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class SessionOutputMethod(OutputMethod):
+    """
+    Output of one session tree, forwarded as events to the WebSocket clients watching the session
+    """
+
+    def __init__(self):
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def _publish(self, event: Dict[str, Any]):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def output(self, message: str):
+        self._publish({"type": "log", "message": message})
+
+    def output_message(self, agent: str, role: str, message: str):
+        self._publish({"type": "message", "agent": agent, "role": role, "message": message})
+
+    def start_stream(self, agent: str, role: str):
+        self._publish({"type": "stream_start", "agent": agent, "role": role})
+
+    def output_chunk(self, chunk: str):
+        self._publish({"type": "chunk", "chunk": chunk})
+
+    def end_stream(self):
+        self._publish({"type": "stream_end"})
+
+class Session:
+    def __init__(self, session_id: str, agents: List[FullAgent], output_method: SessionOutputMethod):
+        self.session_id = session_id
+        self.agents = agents
+        self.root: FullAgent = agents[0]
+        self.output_method = output_method
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.turns = 0
+
+    def is_busy(self) -> bool:
+        """
+        @return: True while a turn runs, delegated tasks are in flight or a client is connected
+        """
+        return (self.root.run_lock.locked() or self.root.has_background_work()
+                or bool(self.output_method.subscribers))
+
+class AgentServer:
+    """
+    Hosts one agent tree per session id in a single process, over HTTP and WebSocket. Turns of a session are
+    serialized by its lock, idle sessions are evicted (and restored from disk if sessions are persisted), and every
+    tree shares the same pooled client and the same scheduler, which bounds the delegated tasks of the whole server.
+    """
+
+    def __init__(self, config_path: str = "agents.yml", host: str = "127.0.0.1", port: int = 8080,
+                 idle_timeout: float = 900.0, max_sessions: int = 1000, client_options: Dict[str, Any] | None = None):
+        """
+        @param config_path: the agents configuration every session tree is built from
+        @param host: the interface to listen on
+        @param port: the port to listen on, 0 for any free port
+        @param idle_timeout: seconds after which an idle session is evicted
+        @param max_sessions: sessions kept at once, new sessions are refused past it if none can be evicted
+        @param client_options: override the client section of the configuration, e.g. base_url
+        """
+        self.agents_loader = AgentsLoader(config_path, client_options=client_options)
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, Session] = {}
+        self.evicted = 0
+        self.errors = 0 # turns that failed with an unexpected error
+        self._server: asyncio.AbstractServer | None = None
+        self._evictor: asyncio.Task | None = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._evictor = asyncio.create_task(self._evict_idle_loop())
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Serving on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for session_id in list(self.sessions):
+            self._evict(session_id)
+
+    def get_session(self, session_id: str) -> Session | None:
+        """
+        @return: the session, built (or restored if persisted) on first use, None if the server is full
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions and not self._evict_least_recent():
+                return None
+            output_method = SessionOutputMethod()
+            agents = self.agents_loader.load_agents(session_id=session_id, output_method=output_method)
+            session = Session(session_id, agents, output_method)
+            self.sessions[session_id] = session
+        session.last_used = time.monotonic()
+        return session
+
+    async def run_turn(self, session: Session, message: str) -> str:
+        """
+        Runs one turn of a session, after the turns already waiting on it
+        @return: the response of the turn
+        """
+        async with session.root.run_lock:
+            response = await session.root.interact(ImportanceRequest(message=message))
+        session.turns += 1
+        session.last_used = time.monotonic()
+        return response.message
+
+    def _evict(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            for agent in session.agents: # its delegated tasks and re-entry turns must not outlive it on the shared scheduler
+                agent.cancel_background()
+        self.agents_loader.close_session(session_id)
+        self.evicted += 1
+
+    def _evict_least_recent(self) -> bool:
+        """
+        Evicts the idle session used the longest time ago, to make room for a new one
+        @return: False if every session is busy
+        """
+        idle = [session for session in self.sessions.values() if not session.is_busy()]
+        if not idle:
+            return False
+        self._evict(min(idle, key=lambda session: session.last_used).session_id)
+        return True
+
+    def _evict_idle(self, idle_timeout: float) -> int:
+        """
+        Evicts the sessions idle for longer than idle_timeout, busy sessions are kept
+        @return: the number of evicted sessions
+        """
+        now = time.monotonic()
+        idle = [
+            session_id for session_id, session in self.sessions.items()
+            if now - session.last_used >= idle_timeout and not session.is_busy()
+        ]
+        for session_id in idle:
+            self._evict(session_id)
+        return len(idle)
+
+    async def _evict_idle_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            self._evict_idle(self.idle_timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.sessions),
+            "busy_sessions": sum(1 for session in self.sessions.values() if session.is_busy()),
+            "evicted": self.evicted,
+            "turns": sum(session.turns for session in self.sessions.values()),
+            "errors": self.errors,
+            "scheduler": self.agents_loader.scheduler.get_stats(),
+            "tools": self.agents_loader.tools_loader.executor.get_stats(),
+        }
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True: # keep-alive, one request after the other
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(path, headers, reader, writer)
+                    break
+                try:
+                    status, payload = await self._route(method, path, body)
+                except Exception as e: # a failing turn answers 500, the connection and the server keep going
+                    self.errors += 1
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                self._write_response(writer, status, payload, keep_alive=headers.get("connection", "").lower() != "close")
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # malformed or interrupted request, the connection is dropped
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes] | None:
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool = True):
+        """
+        @param payload: sent as JSON, or as plain text if it is a string
+        """
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+        )
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        if parts == ["health"]:
+            return 200, {"status": "ok"}
+        if parts == ["stats"]:
+            return 200, self.get_stats()
+        if parts == ["metrics"]:
+            return 200, tracer.metrics.render() # Prometheus text, empty unless tracing is configured
+        if parts == ["sessions"] and method == "GET":
+            return 200, [
+                {"session": session.session_id, "turns": session.turns, "busy": session.is_busy(),
+                 "idle": time.monotonic() - session.last_used}
+                for session in self.sessions.values()
+            ]
+        if len(parts) in (2, 3) and parts[0] == "sessions" and not SESSION_ID_PATTERN.fullmatch(parts[1]):
+            return 400, {"error": "session ids are 1 to 64 letters, digits, _ or -"}
+        if len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            if parts[1] not in self.sessions:
+                return 404, {"error": "unknown session"}
+            self._evict(parts[1])
+            return 200, {"session": parts[1], "evicted": True}
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            try:
+                message = json.loads(body or b"{}")["message"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "expected a JSON body with a message"}
+            session = self.get_session(parts[1])
+            if session is None:
+                return 503, {"error": "too many sessions"}
+            return 200, {"session": session.session_id, "response": await self.run_turn(session, message)}
+        return 404, {"error": "not found"}
+
+    async def _handle_websocket(self, path: str, headers: Dict[str, str], reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        """
+        /sessions/{id}/ws: every text frame is a turn, the outputs of the tree are pushed as JSON events,
+        including the turns the tree starts on its own when delegated results land
+        """
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        if len(parts) != 3 or parts[0] != "sessions" or parts[2] != "ws" or "sec-websocket-key" not in headers:
+            self._write_response(writer, 404, {"error": "not found"}, keep_alive=False)
+            return
+        if not SESSION_ID_PATTERN.fullmatch(parts[1]):
+            self._write_response(writer, 400, {"error": "session ids are 1 to 64 letters, digits, _ or -"}, keep_alive=False)
+            return
+        session = self.get_session(parts[1])
+        if session is None:
+            self._write_response(writer, 503, {"error": "too many sessions"}, keep_alive=False)
+            return
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode("latin-1")
+        )
+        events: asyncio.Queue = asyncio.Queue()
+        session.output_method.subscribers.add(events)
+        sender = asyncio.create_task(self._send_events(events, writer))
+        turns = set()
+        try:
+            while True:
+                opcode, payload = await self._read_frame(reader)
+                if opcode == 0x8: # close
+                    break
+                if opcode == 0x9: # ping
+                    self._write_frame(writer, 0xA, payload)
+                elif opcode == 0x1:
+                    turn = asyncio.create_task(self._websocket_turn(session, payload.decode("utf-8"), events))
+                    turns.add(turn)
+                    turn.add_done_callback(turns.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            session.output_method.subscribers.discard(events)
+            session.last_used = time.monotonic()
+            sender.cancel()
+            for turn in turns:
+                turn.cancel()
+            try:
+                self._write_frame(writer, 0x8, b"")
+            except ConnectionError:
+                pass
+
+    async def _websocket_turn(self, session: Session, message: str, events: asyncio.Queue):
+        try:
+            response = await self.run_turn(session, message)
+        except Exception as e: # sent to the client as an error event, never left unretrieved in the task
+            self.errors += 1
+            events.put_nowait({"type": "error", "session": session.session_id, "error": f"{type(e).__name__}: {e}"})
+            return
+        events.put_nowait({"type": "response", "session": session.session_id, "response": response})
+
+    async def _send_events(self, events: asyncio.Queue, writer: asyncio.StreamWriter):
+        while True:
+            event = await events.get()
+            self._write_frame(writer, 0x1, json.dumps(event).encode("utf-8"))
+            await writer.drain()
+
+    @staticmethod
+    async def _read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        """
+        @return: the opcode and the payload of the next message, fragments joined
+        """
+        message_opcode, payload = None, b""
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if length > MAX_BODY_BYTES:
+                raise ConnectionError("frame too large")
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            data = await reader.readexactly(length)
+            if mask is not None:
+                data = bytes(byte ^ mask[i % 4] for i, byte in enumerate(data))
+            if opcode >= 0x8: # control frames are never fragmented
+                return opcode, data
+            if opcode != 0x0:
+                message_opcode = opcode
+            payload += data
+            if first & 0x80:
+                return message_opcode, payload
+
+    @staticmethod
+    def _write_frame(writer: asyncio.StreamWriter, opcode: int, payload: bytes):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        writer.write(header + payload)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serves one agent tree per session over HTTP and WebSocket")
+    parser.add_argument("--config", default="agents.yml")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--idle-timeout", type=float, default=900.0)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--base-url", default=None, help="overrides the model endpoint, e.g. a local OpenAI-compatible server")
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    # applied by the loader over the client section, so the flag wins over agents.yml
+    client_options = {"base_url": args.base_url} if args.base_url is not None else None
+    server = AgentServer(args.config, args.host, args.port, args.idle_timeout, args.max_sessions, client_options)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from typing import Tuple
+from agents import Tool
+from FlowAgents.flow_agent import SharedAgent
+from FlowAgents.handoff_agent import HandoffAgent
+from FlowAgents.conversation_flow.flow_prefix import FlowPrefix
+from AgentsKnowledge.knowledge_index import KnowledgeRetriever
+
+@dataclass(frozen=True)
+class AgentTemplate:
+    """
+    One agent of the configuration, compiled once: the options are resolved, the developer messages are serialized
+    and counted into a prefix. The agent scaffolding is built on first run, so no client is needed. Every session instantiates its agents from the
+    same templates and shares all of this, only the chat flows and the handoffs are allocated per session.
+    """
+    name: str
+    model: str
+    is_full: bool
+    context_size: int | None
+    stream: bool
+    reentry: bool
+    reentry_debounce: float
+    cache: bool # uses the response cache of the loader
+    packing: bool # gets a packer of its own when the loader has a packing section
+    summarize: bool # attached to the summarizer of the loader
+    knowledge: KnowledgeRetriever | None # stateless, shared by every session
+    max_concurrency: int | None # limits of the agent as a subagent
+    timeout: float | None
+    tools: Tuple[Tool, ...]
+    subagents: Tuple["AgentTemplate", ...]
+    prefix: FlowPrefix # system prompt and handoff instructions
+    agent: SharedAgent # built on first run, then shared
+
+    @staticmethod
+    def compile(name: str, model: str, system_prompt: str, subagents: Tuple["AgentTemplate", ...],
+                tools: Tuple[Tool, ...] = (), **options) -> "AgentTemplate":
+        """
+        @param name: the name of the agent
+        @param model: the model of the agent
+        @param system_prompt: the first developer message of the agent
+        @param subagents: the compiled subagents
+        @param tools: the tools of the agent
+        @param options: the other fields, already resolved
+        @return: the template
+        """
+        prefix = FlowPrefix.from_texts([system_prompt, *HandoffAgent.handoff_instructions([s.name for s in subagents])])
+        return AgentTemplate(name=name, model=model, subagents=subagents, tools=tools, prefix=prefix,
+                             agent=SharedAgent(name, model, list(tools)), **options)
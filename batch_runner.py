@@ -0,0 +1,224 @@
+from load_config_agent import AgentsLoader
+from FlowAgents.conversation_flow.importance_message import ImportanceRequest
+from FlowAgents.handoff_agent import HandoffAgent
+from IOMethods.output_methods import NullOutputMethod
+from typing import Dict, Any, List
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import time
+
+class BatchRunner:
+    """
+    Streams a JSONL file through the agents, each record in its own agent tree, with a bounded number of
+    concurrent sessions. Results are appended to an output JSONL and checkpointed, so a crashed run resumes
+    where it stopped.
+    """
+
+    def __init__(self,
+                 config_path: str,
+                 input_path: str,
+                 output_path: str,
+                 concurrency: int = 4,
+                 prompt_field: str = "body",
+                 id_field: str = "request_id",
+                 checkpoint_every: int = 20,
+                 wait_handoffs: bool = True,
+                 timeout: float | None = None):
+        """
+        @param config_path: the agents configuration
+        @param input_path: the JSONL file of the records to run
+        @param output_path: the JSONL file results are written to, replaced unless its checkpoint resumes it
+        @param concurrency: sessions running at once
+        @param prompt_field: the record field sent to the agents
+        @param id_field: the record field identifying the record in the results
+        @param checkpoint_every: records completed between two checkpoints
+        @param wait_handoffs: waits for the delegated tasks of a record and folds their results into its final response
+        @param timeout: seconds a record may take, None for no limit
+        """
+        self.agents_loader = AgentsLoader(config_path, output_method=NullOutputMethod())
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = f"{output_path}.checkpoint"
+        self.concurrency = concurrency
+        self.prompt_field = prompt_field
+        self.id_field = id_field
+        self.checkpoint_every = checkpoint_every
+        self.wait_handoffs = wait_handoffs
+        self.timeout = timeout
+        self.latencies: List[float] = []
+        self.errors = 0
+        self._read_offset = 0 # offset of the next input line to read
+        self._in_flight: List[int] = [] # heap of the offsets of the records not completed yet
+        self._done_offsets: set[int] = set() # completed records past the oldest one in flight
+        self._skip_offsets: set[int] = set() # completed before the resumed checkpoint
+        self._since_checkpoint = 0
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Runs every record not completed yet
+        @return: the throughput and latency report
+        """
+        output_size = self._load_checkpoint()
+        started_at = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2) # records are streamed, never all loaded
+        with open(self.output_path, "ab") as output:
+            output.truncate(output_size) # drops the results written after the checkpoint, they are run again
+            output.seek(output_size)
+            workers = [asyncio.create_task(self._worker(queue, output)) for _ in range(self.concurrency)]
+            await self._produce(queue)
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            self._checkpoint(output)
+        return self._report(time.monotonic() - started_at)
+
+    def _load_checkpoint(self) -> int:
+        """
+        @return: the size of the output at the checkpoint, results past it are dropped
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return 0 # nothing to resume, results of an earlier run would be duplicated
+        with open(self.checkpoint_path, "r") as file:
+            checkpoint = json.load(file)
+        self._read_offset = checkpoint["input_offset"]
+        self._skip_offsets = set(checkpoint["done_offsets"])
+        return checkpoint["output_size"]
+
+    async def _produce(self, queue: asyncio.Queue):
+        with open(self.input_path, "rb") as file:
+            file.seek(self._read_offset)
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if not line:
+                    break
+                self._read_offset = file.tell()
+                if offset in self._skip_offsets or not line.strip():
+                    continue
+                heapq.heappush(self._in_flight, offset)
+                await queue.put((offset, line)) # parsed by the worker, a malformed line only fails its own record
+
+    async def _worker(self, queue: asyncio.Queue, output):
+        while True:
+            offset, line = await queue.get()
+            try:
+                result = await self._run_record(line)
+                output.write((json.dumps(result) + "\n").encode("utf-8"))
+                self._complete(offset, output)
+            finally:
+                queue.task_done()
+
+    async def _run_record(self, line: bytes) -> Dict[str, Any]:
+        started_at = time.monotonic()
+        result: Dict[str, Any] = {"id": None}
+        root = None
+        try:
+            record = json.loads(line)
+            result["id"] = record.get(self.id_field)
+            root = self.agents_loader.load_agents()[0]
+            response = await asyncio.wait_for(self._run_session(root, record[self.prompt_field]), self.timeout)
+            result.update(status="completed", response=response)
+        except Exception as e:
+            self.errors += 1
+            result.update(status="failed", error=f"{type(e).__name__}: {e}")
+            if root is not None: # timed out or failed, the tasks it delegated are not left running
+                root.cancel_background()
+        result["latency"] = time.monotonic() - started_at
+        self.latencies.append(result["latency"])
+        return result
+
+    async def _run_session(self, root: HandoffAgent, prompt: str) -> str:
+        async with root.run_lock:
+            response = await root.interact(ImportanceRequest(message=prompt))
+        if self.wait_handoffs:
+            await self._wait_settled(root)
+            if root.handoff_manager.has_results(): # left by the tasks when re-entry is off, folded in by one more turn
+                async with root.run_lock:
+                    await root.reenter()
+            response = root.last_response
+        root.cancel_background() # nothing reads the results of the tasks the final response delegated
+        return response.message
+
+    async def _wait_settled(self, root: HandoffAgent):
+        """
+        Waits until no delegated task is queued or running and no agent of the tree is re-entering
+        """
+        while root.run_lock.locked() or root.has_background_work(): # the scheduler is shared by every record
+            await asyncio.sleep(0.05)
+
+    def _complete(self, offset: int, output):
+        self._done_offsets.add(offset)
+        while self._in_flight and self._in_flight[0] in self._done_offsets:
+            self._done_offsets.discard(heapq.heappop(self._in_flight))
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self._checkpoint(output)
+
+    def _checkpoint(self, output):
+        """
+        Persists where to resume: the oldest record still in flight, the records completed past it and the output size
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        input_offset = self._in_flight[0] if self._in_flight else self._read_offset
+        checkpoint = {
+            "input_offset": input_offset,
+            "done_offsets": sorted(offset for offset in self._done_offsets | self._skip_offsets if offset >= input_offset),
+            "output_size": output.tell(),
+        }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._since_checkpoint = 0
+
+    def _report(self, elapsed: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+        return {
+            "records": len(latencies),
+            "failed": self.errors,
+            "elapsed": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(50),
+            "latency_p90": percentile(90),
+            "latency_p99": percentile(99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Runs every record of a JSONL file through the agents")
+    parser.add_argument("input", help="JSONL file of the records to run")
+    parser.add_argument("output", help="JSONL file the results are written to, resumed from its checkpoint if any")
+    parser.add_argument("--config", default="agents.yml")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--prompt-field", default="body")
+    parser.add_argument("--id-field", default="request_id")
+    parser.add_argument("--checkpoint-every", type=int, default=20)
+    parser.add_argument("--no-wait-handoffs", action="store_true", help="takes the first response without waiting for delegated tasks")
+    parser.add_argument("--timeout", type=float, default=None)
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    runner = BatchRunner(
+        config_path=args.config,
+        input_path=args.input,
+        output_path=args.output,
+        concurrency=args.concurrency,
+        prompt_field=args.prompt_field,
+        id_field=args.id_field,
+        checkpoint_every=args.checkpoint_every,
+        wait_handoffs=not args.no_wait_handoffs,
+        timeout=args.timeout
+    )
+    print(json.dumps(await runner.run(), indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
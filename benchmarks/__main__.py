@@ -0,0 +1,44 @@
+from .harness import BenchmarkResults, compare
+from . import chat_flow_benchmarks, handoff_benchmarks, turn_benchmarks, tracing_benchmarks
+import argparse
+import asyncio
+import json
+import sys
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Times the hot paths and writes the results as JSON")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="history sizes")
+    parser.add_argument("--words", type=int, nargs="+", default=[100, 1000, 10000], help="response sizes of extract_handoffs")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=json.loads, default=0.0, help="latency of the fake model during the turns")
+    parser.add_argument("--only", nargs="+", choices=["chat_flow", "handoff", "turn", "tracing"],
+                        default=["chat_flow", "handoff", "turn", "tracing"])
+    parser.add_argument("--baseline", default=None, help="an earlier results file, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown allowed against the baseline")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = BenchmarkResults(repeat=args.repeat)
+    if "chat_flow" in args.only:
+        chat_flow_benchmarks.run(results, args.sizes)
+    if "handoff" in args.only:
+        handoff_benchmarks.run(results, args.words)
+    if "tracing" in args.only:
+        tracing_benchmarks.run(results)
+    if "turn" in args.only:
+        asyncio.run(turn_benchmarks.run(results, args.sizes, args.latency))
+    results.save(args.output)
+    print(f"Results written to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results.to_dict(), json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression['name']} {json.dumps(regression['params'])} x{regression['ratio']:.2f}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
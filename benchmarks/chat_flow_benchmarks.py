@@ -0,0 +1,59 @@
+from FlowAgents.conversation_flow.chat_flow_manager import ChatFlowManager
+from FlowAgents.conversation_flow.importance_message import DeveloperMessage, ImportanceRequest, ImportanceResponse
+from .harness import BenchmarkResults
+from typing import List
+import random
+
+ADDED_MESSAGES = 100 # messages added per repetition of the add_message benchmark
+
+def make_messages(count: int, words: int = 40, seed: int = 0):
+    """
+    @return: count user and assistant messages alternating, with a developer message every 50
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(500)]
+    messages = []
+    for i in range(count):
+        text = " ".join(rng.choice(vocabulary) for _ in range(words))
+        if i % 50 == 0:
+            messages.append(DeveloperMessage(message=text))
+        elif i % 2:
+            messages.append(ImportanceRequest(importance=rng.randint(5, 40), message=text))
+        else:
+            messages.append(ImportanceResponse(importance=rng.randint(50, 150), message=text))
+    return messages
+
+def make_flow(history: int, max_context_size: int = 10 ** 9) -> ChatFlowManager:
+    """
+    @return: a chat flow holding history messages, none of them decayed
+    """
+    flow = ChatFlowManager(max_context_size=max_context_size)
+    flow.add_messages(make_messages(history))
+    return flow
+
+def run(results: BenchmarkResults, sizes: List[int]):
+    for history in sizes:
+        params = {"history": history}
+        def add_setup():
+            return make_flow(history), iter(make_messages(ADDED_MESSAGES, seed=1))
+        results.measure("chat_flow.add_message", params, lambda state: state[0].add_message(next(state[1])),
+                        number=ADDED_MESSAGES, setup=add_setup)
+
+        def cleaning_setup():
+            flow = make_flow(history)
+            flow.max_context_size = int(flow.get_total_token_size() / ChatFlowManager.CLEAN_THRESHOLD * 0.9) # evicts ~10%
+            return flow
+        results.measure("chat_flow.trigger_cleaning", params, lambda flow: flow.trigger_cleaning(), setup=cleaning_setup)
+
+        flow = make_flow(history)
+        results.measure("chat_flow.serialize_cached", params, flow.serialize, number=1000)
+
+        def rebuild_setup():
+            flow = make_flow(history)
+            return flow, flow.chat_flow[-1]
+
+        def rebuild(state):
+            flow, message = state
+            message.message = message.message # an edit invalidates the joined serialization
+            flow.serialize()
+        results.measure("chat_flow.serialize_rebuild", params, rebuild, number=10, setup=rebuild_setup)
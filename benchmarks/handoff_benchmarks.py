@@ -0,0 +1,27 @@
+from FlowAgents.handoff_agent import HandoffAgent
+from FlowAgents.handoff_utility import HandoffManager
+from IOMethods.output_methods import NullOutputMethod
+from .harness import BenchmarkResults
+from typing import List
+import json
+import random
+
+def make_response(words: int, handoffs: int, seed: int = 0) -> str:
+    """
+    @return: a response of about words words with handoffs handoff objects spread through it
+    """
+    rng = random.Random(seed)
+    parts = [" ".join(f"word{rng.randint(0, 500)}" for _ in range(words // (handoffs + 1)))]
+    for i in range(handoffs):
+        parts.append(json.dumps({"handoff": {"subagent": f"subagent_{i % 3}", "prompt": "Work on {this} part"}}))
+        parts.append(" ".join(f"word{rng.randint(0, 500)}" for _ in range(words // (handoffs + 1))))
+    return " ".join(parts)
+
+def run(results: BenchmarkResults, sizes: List[int]):
+    parent = HandoffAgent("parent", output_method=NullOutputMethod())
+    manager = HandoffManager(parent, [])
+    for words in sizes:
+        for handoffs in (0, 3):
+            message = make_response(words, handoffs)
+            results.measure("handoff.extract_handoffs", {"words": words, "handoffs": handoffs},
+                            lambda: manager.extract_handoffs(message), number=20)
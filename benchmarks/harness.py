@@ -0,0 +1,110 @@
+from typing import Dict, Any, List, Callable, Awaitable
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+class BenchmarkResults:
+    """
+    Collects the timings of a benchmark run and writes them as JSON, so runs can be compared to track regressions
+    """
+
+    def __init__(self, repeat: int = 5):
+        """
+        @param repeat: timed repetitions of each benchmark, the statistics are taken over them
+        """
+        self.repeat = repeat
+        self.results: List[Dict[str, Any]] = []
+
+    def _record(self, name: str, params: Dict[str, Any], number: int, samples: List[int]):
+        per_op = sorted(sample / number for sample in samples) # nanoseconds per operation of each repetition
+        result = {
+            "name": name,
+            "params": params,
+            "number": number,
+            "repeat": len(samples),
+            "min_ns": per_op[0],
+            "median_ns": statistics.median(per_op),
+            "mean_ns": statistics.fmean(per_op),
+            "max_ns": per_op[-1],
+        }
+        self.results.append(result)
+        print(f"{name:<40} {json.dumps(params):<40} {result['median_ns'] / 1000:>12.2f} us/op")
+        return result
+
+    def measure(self, name: str, params: Dict[str, Any], run: Callable[[], Any], number: int = 1,
+                setup: Callable[[], Any] | None = None) -> Dict[str, Any]:
+        """
+        Times run, number calls per repetition
+        @param name: the benchmark
+        @param params: what the benchmark was run with, e.g. the history size
+        @param run: the operation, called with the result of setup if given
+        @param number: calls per repetition, the timings are divided by it
+        @param setup: builds a fresh state before each repetition, not timed
+        @return: the recorded result
+        """
+        samples = []
+        for _ in range(self.repeat):
+            state = setup() if setup is not None else None
+            started_at = time.perf_counter_ns()
+            if setup is not None:
+                for _ in range(number):
+                    run(state)
+            else:
+                for _ in range(number):
+                    run()
+            samples.append(time.perf_counter_ns() - started_at)
+        return self._record(name, params, number, samples)
+
+    async def measure_async(self, name: str, params: Dict[str, Any], run: Callable[[Any], Awaitable[Any]],
+                            number: int = 1, setup: Callable[[], Awaitable[Any]] | None = None) -> Dict[str, Any]:
+        """
+        Same as measure for coroutines, run inside the running event loop
+        """
+        samples = []
+        for _ in range(self.repeat):
+            state = await setup() if setup is not None else None
+            started_at = time.perf_counter_ns()
+            for _ in range(number):
+                await run(state)
+            samples.append(time.perf_counter_ns() - started_at)
+        return self._record(name, params, number, samples)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "created_at": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": self.repeat,
+            "results": self.results,
+        }
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(tmp_path, path)
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[Dict[str, Any]]:
+    """
+    @param results: a saved run
+    @param baseline: an earlier saved run
+    @param tolerance: relative slowdown of the median allowed before a benchmark counts as a regression
+    @return: the benchmarks slower than the baseline past the tolerance, with their ratio
+    """
+    def key(result: Dict[str, Any]) -> str:
+        return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        previous = baseline_results.get(key(result))
+        if previous is None or previous["median_ns"] == 0:
+            continue
+        ratio = result["median_ns"] / previous["median_ns"]
+        if ratio > 1 + tolerance:
+            regressions.append({"name": result["name"], "params": result["params"], "ratio": ratio})
+    return regressions
@@ -0,0 +1,19 @@
+from FlowAgents.tracing import tracer
+from .harness import BenchmarkResults
+
+def run(results: BenchmarkResults):
+    """
+    Times an empty span with tracing disabled, the cost paid by every instrumented path, and enabled without export
+    """
+    def empty_span():
+        with tracer.span("benchmark", agent="benchmark"):
+            pass
+
+    enabled = tracer.enabled
+    try:
+        tracer.enabled = False
+        results.measure("tracing.span", {"enabled": False}, empty_span, number=100000)
+        tracer.enabled = True
+        results.measure("tracing.span", {"enabled": True}, empty_span, number=100000)
+    finally:
+        tracer.enabled = enabled
@@ -0,0 +1,72 @@
+from load_config_agent import AgentsLoader
+from FlowAgents.conversation_flow.importance_message import ImportanceRequest
+from .chat_flow_benchmarks import make_messages
+from .harness import BenchmarkResults
+from typing import Dict, Any, List
+import asyncio
+import os
+import tempfile
+import yaml
+
+def tree_config(fake_model: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    @return: a three level tree answered by the fake model: the root delegates to two subagents, one of them delegates
+    to a third
+    """
+    return {
+        "input": "NO",
+        "output": "NO",
+        "client": {"fake_model": fake_model},
+        "scheduler": {"max_concurrency": 8, "max_concurrency_per_subagent": 2},
+        "agents": {
+            "main_agent": {
+                "model": "fake",
+                "system_prompt": "You coordinate the work",
+                "subagents": {
+                    "researcher_agent": {
+                        "model": "fake",
+                        "system_prompt": "You research",
+                        "subagents": {"reader_agent": {"model": "fake", "system_prompt": "You read sources"}},
+                    },
+                    "coder": {"model": "fake", "system_prompt": "You write code"},
+                },
+            },
+        },
+    }
+
+async def settle(root):
+    """
+    Waits until every task delegated in the tree is done
+    """
+    while root.has_background_work():
+        await asyncio.sleep(0.001)
+
+def walk(agent):
+    yield agent
+    for subagent in agent.get_subagents():
+        yield from walk(subagent)
+
+async def run(results: BenchmarkResults, sizes: List[int], latency: float | Dict[str, Any] = 0.0):
+    """
+    Times a turn of the root agent until every handoff it caused, at any depth, completed
+    @param latency: latency of the fake model, 0 to time the framework only
+    """
+    fake_model = {"latency": latency, "response_words": [20, 60], "handoff_rate": 1.0, "max_handoffs": 2}
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "agents.yml")
+        with open(config_path, "w", encoding="utf-8") as file:
+            yaml.safe_dump(tree_config(fake_model), file, sort_keys=False)
+        loader = AgentsLoader(config_path)
+
+    for history in sizes:
+        async def setup():
+            root = loader.load_agents()[0]
+            for agent in walk(root):
+                agent.chat_flow_manager.add_messages(make_messages(history))
+            return root
+
+        async def turn(root):
+            await root.interact(ImportanceRequest(message="Plan the next release"))
+            await settle(root)
+
+        await results.measure_async("turn.multi_level_handoff", {"history": history, "latency": latency}, turn, setup=setup)
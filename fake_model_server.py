@@ -0,0 +1,113 @@
+from FlowAgents.fake_model import FakeAsyncOpenAI
+from agent_server import AgentServer
+from typing import Dict, Any
+import argparse
+import asyncio
+import json
+
+class FakeModelServer:
+    """
+    Serves a FakeModel as an OpenAI-compatible endpoint, so other processes (the agent server, a batch run) can be
+    pointed at it with their base url instead of a real provider
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, **options):
+        """
+        @param host: the interface to listen on
+        @param port: the port to listen on, 0 for any free port
+        @param options: the options of the FakeModel
+        """
+        self.host = host
+        self.port = port
+        self.client = FakeAsyncOpenAI(**options)
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Fake model on http://{self.host}:{self.port}/v1")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True: # keep-alive, streamed responses close the connection
+                request = await AgentServer._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                path = path.split("?", 1)[0].rstrip("/")
+                if path in ("/v1/models", "/models"):
+                    AgentServer._write_response(writer, 200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+                elif path not in ("/v1/chat/completions", "/chat/completions"):
+                    AgentServer._write_response(writer, 404, {"error": {"message": "not found"}})
+                elif method != "POST":
+                    AgentServer._write_response(writer, 405, {"error": {"message": "use POST"}})
+                else:
+                    try:
+                        options: Dict[str, Any] = json.loads(body or b"{}")
+                        result = await self.client.chat.completions.create(**options)
+                    except (ValueError, TypeError) as e:
+                        AgentServer._write_response(writer, 400, {"error": {"message": str(e)}})
+                    else:
+                        if not options.get("stream"):
+                            AgentServer._write_response(writer, 200, result.model_dump(exclude_none=True))
+                        else:
+                            await self._write_events(writer, result)
+                            break
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # malformed or interrupted request, the connection is dropped
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write_events(writer: asyncio.StreamWriter, chunks):
+        """
+        Streams the chunks as server-sent events, the end of the stream is marked by the closed connection
+        """
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        async for chunk in chunks:
+            writer.write(f"data: {chunk.model_dump_json(exclude_none=True)}\n\n".encode("utf-8"))
+            await writer.drain()
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serves a deterministic fake chat model over the OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=json.loads, default=0.0,
+                        help='seconds or a distribution, e.g. \'{"distribution": "lognormal", "mean": -3, "sigma": 0.5}\'')
+    parser.add_argument("--response-words", type=int, nargs=2, default=[20, 80], metavar=("MIN", "MAX"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--script", default=None, help="JSON file of [{\"match\": regex, \"response\": text}]")
+    parser.add_argument("--handoff-rate", type=float, default=0.0)
+    parser.add_argument("--max-handoffs", type=int, default=1)
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    script = None
+    if args.script is not None:
+        with open(args.script, "r", encoding="utf-8") as file:
+            script = json.load(file)
+    server = FakeModelServer(args.host, args.port, latency=args.latency, response_words=args.response_words,
+                             seed=args.seed, script=script, handoff_rate=args.handoff_rate, max_handoffs=args.max_handoffs)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,31 +1,68 @@
 from typing import List
 from agents import Tool
-from FlowAgents.handoff_agent import HandoffAgent, FlowAgent, ImportanceRequest
-from IOMethods.output_methods import OutputMethod, ConsoleOutputMethod
+from FlowAgents.handoff_agent import HandoffAgent, FlowAgent, ImportanceRequest, REENTRY_IMPORTANCE
+from FlowAgents.conversation_flow.importance_message import ImportanceResponse
+from IOMethods.output_methods import OutputMethod
 from IOMethods.input_methods import InputMethod, UserCLIInputMethod
+from FlowAgents.response_cache import ResponseCache
+from AgentsKnowledge.knowledge_index import KnowledgeRetriever
+from FlowAgents.conversation_flow.relevance_packer import RelevancePacker
+from FlowAgents.conversation_flow.flow_prefix import FlowPrefix
+from FlowAgents.flow_agent import SharedAgent
+from FlowAgents.tracing import tracer
 
 class FullAgent(HandoffAgent):
     def __init__(self, 
                  name: str, 
                  model: str = "gpt-4o-mini", 
                  system_prompt: str = "", 
-                 tools: List[Tool] = [], 
-                 output_method: OutputMethod = ConsoleOutputMethod(), 
-                 input_method: InputMethod = UserCLIInputMethod("Ask the agent > "),
-                 top_level_agents: List[FlowAgent] = []):
-        super().__init__(name, model, system_prompt, tools, output_method)
-        self.input_method = input_method
-        self.top_level_agents = top_level_agents
+                 tools: List[Tool] | None = None, 
+                 output_method: OutputMethod | None = None, 
+                 input_method: InputMethod | None = None,
+                 top_level_agents: List[FlowAgent] | None = None,
+                 context_size: int | None = None,
+                 stream: bool = False,
+                 response_cache: ResponseCache | None = None,
+                 knowledge: KnowledgeRetriever | None = None,
+                 packer: RelevancePacker | None = None,
+                 reentry: bool = False,
+                 reentry_debounce: float = 0.0,
+                 prefix: FlowPrefix | None = None,
+                 agent: SharedAgent | None = None):
+        super().__init__(name, model, system_prompt, tools, output_method, context_size, stream,
+                         response_cache=response_cache, knowledge=knowledge, packer=packer,
+                         reentry=reentry, reentry_debounce=reentry_debounce, prefix=prefix, agent=agent)
+        self.input_method = input_method if input_method is not None else UserCLIInputMethod("Ask the agent > ")
+        self.top_level_agents = top_level_agents if top_level_agents is not None else []
+        self.last_response: ImportanceResponse | None = None # response of the latest turn, re-entered ones included
 
 
     async def next_interaction(self):
-        request = ImportanceRequest(message=self.input_method.next())
-        response = await self.run(request)
-        if self.top_level_agents is not None and len(self.top_level_agents) > 0:
-            for agent in self.top_level_agents:
-                response = await agent.run(ImportanceRequest(importance=1, message=self.chat_flow_manager.serialize()))
-                if response.message is not None and response.message != "":
-                    self.add_system_message(importance=1, message=response.message)
-        self.output_method.output(response.message)
+        message = await self.input_method.next_async() # handoffs keep running while waiting for the input
+        if message is None: # the input ended
+            return
+        request = ImportanceRequest(message=message)
+        async with self.run_lock:
+            await self.interact(request)
+
+    async def interact(self, request: ImportanceRequest) -> ImportanceResponse:
+        """
+        Runs a full turn: this agent, then every top level agent on the resulting conversation
+        @param request: the request of the turn
+        @return: the response of the turn
+        """
+        with tracer.span("agent.turn", agent=self.name, model=self.model): # one trace per turn, top level agents included
+            response = await self.run(request)
+            if self.top_level_agents is not None and len(self.top_level_agents) > 0:
+                for agent in self.top_level_agents:
+                    response = await agent.run(ImportanceRequest(importance=1, message=self.chat_flow_manager.serialize()))
+                    if response.message is not None and response.message != "":
+                        self.add_system_message(importance=1, message=response.message)
+            self.output_method.output(response.message)
+        self.last_response = response
+        return response
+
+    async def reenter(self) -> ImportanceResponse:
+        return await self.interact(ImportanceRequest(importance=REENTRY_IMPORTANCE))
 
 
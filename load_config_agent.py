@@ -3,101 +3,203 @@ from typing import List, Dict, Any
 from IOMethods.enums.input_type import InputType
 from IOMethods.enums.output_type import OutputType
 from IOMethods.input_methods import InputMethod
-from IOMethods.output_methods import OutputMethod
+from IOMethods.output_methods import OutputMethod, MultiOutputMethod
 from full_agent import FullAgent
 from FlowAgents.handoff_agent import HandoffAgent
+from FlowAgents.load_client import configure_client
+from FlowAgents.tracing import tracer
+from FlowAgents.handoff_scheduler import HandoffScheduler
+from FlowAgents.response_cache import ResponseCache
+from FlowAgents.context_summarizer import ContextSummarizer
+from FlowAgents.session_store import SessionStore
+from AgentsKnowledge.knowledge_index import KnowledgeIndex, KnowledgeRetriever
+from FlowAgents.conversation_flow.relevance_packer import RelevancePacker
+from agent_template import AgentTemplate
+from ToolsLoader.tools_loader import ToolsLoader
+from ToolsLoader.tool_executor import ToolExecutor
 
 import yaml
 
 class AgentsLoader:
-    def __init__(self, path: str):
+    def __init__(self, path: str, output_method: OutputMethod | None = None, client_options: Dict[str, Any] | None = None):
+        """
+        @param path: the agents configuration
+        @param output_method: overrides the output of the configuration for every agent
+        @param client_options: override the client section of the configuration, e.g. base_url
+        """
         self.path = path
+        self.output_method = output_method
         with open(path, "r") as file:
             config = yaml.safe_load(file)
         self.config = config
+        client_config = {**(config.get("client") or {}), **(client_options or {})}
+        if client_config:
+            configure_client(**client_config) # one pooled client is shared by every agent of the tree, built on first run
+        if config.get("tracing"):
+            tracer.configure(**config["tracing"]) # spans of every turn, exported as JSONL traces and Prometheus metrics
+        # opt-in response cache shared by every agent, each agent can opt out with cache: false
+        self.response_cache = ResponseCache(**config["cache"]) if config.get("cache") else None
+        self.session_stores: Dict[str, SessionStore] = {} # session id -> the store persisting its tree
+        # optional background summaries of what the chat flows drop, shared so its concurrency limit covers the tree
+        self.summarizer = ContextSummarizer(**config["summarizer"]) if config.get("summarizer") else None
+        knowledge_config = dict(config.get("knowledge") or {})
+        self.knowledge_top_k = knowledge_config.pop("top_k", 5)
+        self.knowledge_budget = knowledge_config.pop("token_budget", 2000)
+        self.knowledge_index = KnowledgeIndex(**knowledge_config) # one index shared by every agent, persisted on disk
+        # one scheduler bounds every delegated task of every tree the loader builds, e.g. across server sessions
+        self.scheduler = HandoffScheduler(**config.get("scheduler", {}))
+        tools_config = dict(config.get("tools") or {})
+        # one executor bounds the tool calls of every agent, tool modules are only imported when first called
+        executor_options = {key: tools_config.pop(key) for key in ("max_threads", "max_processes", "timeout") if key in tools_config}
+        self.tools_loader = ToolsLoader(executor=ToolExecutor(**executor_options), **tools_config)
+        self.tools_loader.load_tools()
+        # compiled once, load_agents only allocates the state of a session; the first agent is the FullAgent
+        self.templates = [
+            self._compile(agent_name, agent_config, is_full=index == 0)
+            for index, (agent_name, agent_config) in enumerate((config.get("agents") or {}).items())
+        ]
 
-    def load_agents(self) -> List[FlowAgent]:
-        agents = []
-        
-        # Process all top-level agents
-        for agent_name, agent_config in self.config.get("agents", {}).items():
-            agent_config['name'] = agent_name
-
-            # First agent is a FullAgent, others are HandoffAgents
-            if len(agents) == 0:
-                agent = self._load_agent(agent_config, is_full=True)
-            else:
-                agent = self._load_agent(agent_config)
-            
-            # Recursively load subagents for this agent
-            self._load_agents_recursively(agent_config, agent)
-            
-            agents.append(agent)
+    def load_agents(self, session_id: str | None = None, output_method: OutputMethod | None = None) -> List[FlowAgent]:
+        """
+        Instantiates the agent tree of the configuration from its compiled templates
+        @param session_id: restores the tree of this session and persists it, needs the sessions section, None to start empty
+        @param output_method: the output of this tree only, defaults to the output of the loader
+        @return: the top level agents, the first one is the FullAgent
+        """
+        if output_method is None:
+            output_method = self.load_output_method()
+        agents = [self._instantiate(template, output_method) for template in self.templates]
+
+        if self.config.get("top_level_review", False):
+            # the next top level agents review the conversation of the first one, one more model call each per turn
+            agents[0].top_level_agents = agents[1:]
+
+        if session_id is not None and self.config.get("sessions"):
+            if session_id in self.session_stores:
+                self.session_stores[session_id].close()
+            store = SessionStore(session_id=session_id, **self.config["sessions"])
+            store.attach(agents) # snapshot plus the changes logged after it, in-flight handoffs are dispatched again
+            self.session_stores[session_id] = store
         
         return agents
 
-    def _load_agents_recursively(self, config: Dict[str, Any], parent_agent: FlowAgent) -> None:
+    def close_session(self, session_id: str) -> None:
+        """
+        Stops persisting the tree of a session, it is restored by the next load_agents with its id
+        @param session_id: the session
+        """
+        store = self.session_stores.pop(session_id, None)
+        if store is not None:
+            store.close()
+
+    def _compile(self, name: str, config: Dict[str, Any], is_full: bool = False) -> AgentTemplate:
+        """
+        Compiles an agent of the configuration and its subagents, once per loader
+        @param name: the name of the agent
+        @param config: the configuration of the agent, not modified
+        @param is_full: compiles the FullAgent reading the input
+        @return: the template of the agent
+        """
+        subagents = tuple(
+            self._compile(subagent_name, subagent_config)
+            for subagent_name, subagent_config in (config.get('subagents') or {}).items()
+        )
+        for subagent in subagents:
+            self.scheduler.set_subagent_limit(subagent.name, max_concurrency=subagent.max_concurrency, timeout=subagent.timeout)
+
+        # Knowledge files/folders are chunked and indexed, each request only gets its most relevant chunks
+        knowledge = None
+        if config.get('knowledge'):
+            knowledge = KnowledgeRetriever(
+                self.knowledge_index,
+                config['knowledge'],
+                top_k=config.get('knowledge_top_k', self.knowledge_top_k),
+                token_budget=config.get('knowledge_budget', self.knowledge_budget)
+            )
+
+        # Tools are built from the manifest, tools missing from the tools folder are ignored
+        tools = [tool for tool_name in config.get('tools') or [] for tool in self.tools_loader.function_tools(tool_name)]
+
+        return AgentTemplate.compile(
+            name=name,
+            model=config.get('model', 'gpt-4o-mini'),
+            system_prompt=config.get('system_prompt', ''),
+            subagents=subagents,
+            tools=tuple(tools),
+            is_full=is_full,
+            context_size=config.get('context_size'), # overrides the known context of the model
+            stream=config.get('stream', self.config.get('stream', False)), # agents inherit the top-level stream mode
+            reentry=config.get('reentry', self.config.get('reentry', False)),
+            reentry_debounce=config.get('reentry_debounce', self.config.get('reentry_debounce', 0.0)),
+            cache=config.get('cache', True),
+            packing=config.get('packing', True),
+            summarize=config.get('summarize', True),
+            knowledge=knowledge,
+            max_concurrency=config.get('max_concurrency'),
+            timeout=config.get('timeout')
+        )
+
+    def _instantiate(self, template: AgentTemplate, output_method: OutputMethod) -> FlowAgent:
+        """
+        Builds the agents of a template tree for one session, sharing everything the templates compiled
+        @param template: the template of the agent
+        @param output_method: the output of the session
+        @return: the agent, its subagents set
+        """
         subagents = []
-        
-        # Load all subagents
-        for subagent_name, subagent_config in config.get("subagents", {}).items():
-            subagent_config['name'] = subagent_name
-            subagent = self._load_agent(subagent_config)
-            
-            # Recursively process any nested subagents
-            self._load_agents_recursively(subagent_config, subagent)
-            
-            subagents.append(subagent)
-        
-        # Set the subagents on the parent agent
-        parent_agent.set_subagents(subagents)
+        for subagent_template in template.subagents:
+            subagents.append(self._instantiate(subagent_template, output_method))
 
-    def _load_agent(self, config: Dict[str, Any], is_full: bool = False) -> FlowAgent:
-        name = config.get('name', 'unnamed_agent')
-        model = config.get('model', 'gpt-4o-mini')
-        system_prompt = config.get('system_prompt', '')
-        
-        # Process knowledge files/folders if any
-        knowledge = config.get('knowledge', [])
-        # In a real implementation, we'd load and process these knowledge files here
-        
-        # Process tools if any
-        tools = []
-        for tool_name in config.get('tools', []):
-            # In a real implementation, we'd load actual tool objects based on names
-            pass
-        
-        output_method = self.load_output_method()
-        
-        if is_full:
+        options = dict(
+            name=template.name,
+            model=template.model,
+            tools=list(template.tools),
+            output_method=output_method,
+            context_size=template.context_size,
+            stream=template.stream,
+            response_cache=self.response_cache if template.cache else None,
+            knowledge=template.knowledge,
+            # each agent packs its own chat flow, it keeps the vectors of its messages
+            packer=RelevancePacker(**self.config["packing"]) if self.config.get("packing") and template.packing else None,
+            reentry=template.reentry,
+            reentry_debounce=template.reentry_debounce,
+            prefix=template.prefix,
+            agent=template.agent
+        )
+        if template.is_full:
             # Create a FullAgent with input and output methods
-            input_method = self.load_input_method()
-            agent = FullAgent(
-                name=name,
-                model=model,
-                system_prompt=system_prompt,
-                tools=tools,
-                output_method=output_method,
-                input_method=input_method
-            )
+            agent = FullAgent(input_method=self.load_input_method(), **options)
         else:
             # Create a HandoffAgent with just the output method
-            agent = HandoffAgent(
-                name=name,
-                model=model,
-                system_prompt=system_prompt,
-                tools=tools,
-                output_method=output_method
-            )
-            
-        # If there's knowledge, add it as developer messages
-        for k in knowledge:
-            agent.add_developer_message(message=f"Knowledge from {k}")
-            
+            agent = HandoffAgent(**options)
+
+        agent.set_subagents(subagents, self.scheduler, describe=False) # the prefix has the handoff instructions
+
+        if self.summarizer is not None and template.summarize:
+            self.summarizer.attach(agent)
+
         return agent
 
     def load_input_method(self) -> InputMethod:
-        return InputType[self.config["input"]].value
+        input_method = InputType[self.config["input"]].value
+        if isinstance(input_method, type): # input methods needing options are built from the configuration
+            return input_method(**self.config.get("input_options", {}))
+        return input_method
 
     def load_output_method(self) -> OutputMethod:
-        return OutputType[self.config["output"]].value
+        if self.output_method is None: # built once, every agent shares the same sinks
+            self.output_method = self._build_output_method(self.config["output"])
+        return self.output_method
+
+    def _build_output_method(self, config: str | Dict[str, Any] | List[Any]) -> OutputMethod:
+        """
+        @param config: an output type name, a mapping with its type and options, or a list of them to fan out to
+        """
+        if isinstance(config, list):
+            output_methods = [self._build_output_method(item) for item in config]
+            return output_methods[0] if len(output_methods) == 1 else MultiOutputMethod(output_methods)
+        options = dict(config) if isinstance(config, dict) else {"type": config}
+        output_method = OutputType[options.pop("type")].value
+        if isinstance(output_method, type): # output methods needing options are built from the configuration
+            return output_method(**options)
+        return output_method
@@ -5,13 +5,12 @@ from Debugger.debugger_gui import create_debug_gui
 
 async def main():
     agents_loader = AgentsLoader("agents.yml")
-    agents = agents_loader.load_agents()
+    agents = agents_loader.load_agents(session_id="main") # restores the previous conversation when sessions is configured
 
-    gui = create_debug_gui(agents[0])
+    create_debug_gui(agents[0]) # follows the agents from their change events
 
     while agents[0].input_method.has_next():
         await agents[0].next_interaction()
-        gui.refresh()
     
 
 if __name__ == "__main__":